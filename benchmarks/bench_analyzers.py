@@ -0,0 +1,191 @@
+"""
+Speed of the sentiment analyzers on a synthetic headline corpus.
+
+    python benchmarks/bench_analyzers.py --analyzers vader,textblob --output results.json
+    python benchmarks/bench_analyzers.py --compare before.json after.json
+
+For each analyzer this measures:
+    cold start:  seconds to import the analyzer, build it and score one title, in a fresh process
+    latency:     p50 and p99 milliseconds of evaluate() on one title
+    throughput:  titles per second through evaluate_batch() at each batch size
+analyze_title() and analyze_titles() are measured the same way with every analyzer
+that could be built. An analyzer that cannot be built (e.g. torch or its model is
+missing) is reported with its error instead. Results are written as JSON together
+with the git commit, so runs can be compared between commits with --compare.
+--profile DIR also writes a profile of the run (see sentinews.profiling), which
+makes every number slower.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from sentinews.models import ANALYZER_CLASSES, analyze_title, analyze_titles
+from sentinews.profiling import active_profiler, profiler_for
+from synthetic import synthetic_headlines
+
+COLD_START = """
+import time
+start = time.perf_counter()
+from sentinews.models import ANALYZER_CLASSES
+analyzer = ANALYZER_CLASSES[{name!r}]()
+built = time.perf_counter()
+analyzer.evaluate('Joe Biden wins the debate')
+print(built - start, time.perf_counter() - built)
+"""
+
+
+def cold_start(name):
+    """
+    Seconds to import and build the analyzer, and to score its first title, in a new process.
+    """
+    result = subprocess.run([sys.executable, '-c', COLD_START.format(name=name)], capture_output=True, text=True)
+    if result.returncode != 0:
+        # The exception line of the traceback
+        lines = result.stderr.strip().splitlines() or ['failed']
+        raise RuntimeError(next((line for line in reversed(lines) if 'Error' in line), lines[-1]))
+    build, first_title = map(float, result.stdout.split()[-2:])
+    return {'build_seconds': build, 'first_title_seconds': first_title}
+
+
+def latency(evaluate, titles):
+    """
+    p50 and p99 milliseconds of evaluate(title).
+    """
+    times = []
+    for title in titles:
+        start = time.perf_counter()
+        evaluate(title)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': float(np.percentile(times, 50)), 'p99_ms': float(np.percentile(times, 99))}
+
+
+def throughput(evaluate_batch, titles, batch_sizes):
+    """
+    Titles per second through evaluate_batch() at each batch size.
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(titles), batch_size):
+            evaluate_batch(titles[i:i + batch_size])
+        results[str(batch_size)] = len(titles) / (time.perf_counter() - start)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, n_titles=2000, latency_samples=200, batch_sizes=(1, 8, 32, 128), seed=0, with_cold_start=True):
+    """
+    Benchmark the analyzers called 'names'.
+    :return: results as they are written to JSON
+    :rtype: dict
+    """
+    titles = synthetic_headlines(n_titles, seed=seed)
+    sample = titles[:latency_samples]
+    results = {}
+    analyzers = []
+    for name in names:
+        logging.info(f"Benchmarking {name}")
+        try:
+            result = {'cold_start': cold_start(name)} if with_cold_start else {}
+            analyzer = ANALYZER_CLASSES[name]()
+            analyzer.evaluate(titles[0])
+        except Exception as e:
+            results[name] = {'error': str(e) or type(e).__name__}
+            continue
+        result['latency'] = latency(analyzer.evaluate, sample)
+        result['throughput'] = throughput(analyzer.evaluate_batch, titles, batch_sizes)
+        results[name] = result
+        analyzers.append(analyzer)
+        active_profiler().stage(f'benchmarked {name}')
+
+    if analyzers:
+        results['analyze_title'] = {
+            'analyzers': [analyzer.name for analyzer in analyzers],
+            'latency': latency(lambda title: analyze_title(analyzers, title), sample),
+            'throughput': throughput(lambda batch: analyze_titles(analyzers, batch), titles, batch_sizes),
+        }
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now(tz=timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'n_titles': n_titles,
+            'latency_samples': len(sample),
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(before, after):
+    """
+    Lines of 'metric: before -> after (ratio)' for every metric in both result files.
+    """
+    def metrics(results, prefix=''):
+        for key, value in results.items():
+            if isinstance(value, dict):
+                yield from metrics(value, f'{prefix}{key}.')
+            elif isinstance(value, (int, float)):
+                yield f'{prefix}{key}', value
+
+    old = dict(metrics(before['results']))
+    lines = [f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}"]
+    for key, value in metrics(after['results']):
+        if key in old and old[key]:
+            lines.append(f'{key}: {old[key]:.4g} -> {value:.4g} ({value / old[key]:.2f}x)')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--analyzers', default=','.join(ANALYZER_CLASSES),
+                        help='comma separated analyzers (default: all)')
+    parser.add_argument('--titles', type=int, default=2000, help='headlines in the corpus')
+    parser.add_argument('--latency-samples', type=int, default=200, help='titles timed one at a time')
+    parser.add_argument('--batch-sizes', default='1,8,32,128', help='comma separated batch sizes')
+    parser.add_argument('--seed', type=int, default=0, help='corpus seed')
+    parser.add_argument('--no-cold-start', action='store_true', help='skip the fresh-process measurements')
+    parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    parser.add_argument('--profile', metavar='DIR', help='write a profile of the run to a new directory in DIR')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            print('\n'.join(compare(json.load(before), json.load(after))))
+        return
+
+    with profiler_for('bench-analyzers', args.profile):
+        results = run([name.strip() for name in args.analyzers.split(',') if name.strip()],
+                      n_titles=args.titles,
+                      latency_samples=args.latency_samples,
+                      batch_sizes=[int(size) for size in args.batch_sizes.split(',')],
+                      seed=args.seed,
+                      with_cold_start=not args.no_cold_start)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
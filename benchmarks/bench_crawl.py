@@ -0,0 +1,172 @@
+"""
+Speed of whole crawls, run offline against the stand-in server in replay.py.
+
+    python benchmarks/bench_crawl.py --sources CNN,NYT --days 7 --latency 0.05 --output results.json
+    python benchmarks/bench_crawl.py --compare before.json after.json
+
+Each source crawls synthetic (or, with --cassette, recorded) results, scores them
+with the chosen analyzers and stores them through the database API sink, which
+the stand-in server also plays. Rate limits are turned off, so the numbers show
+the crawler itself. For each source this reports:
+    articles/sec and requests/sec over the whole crawl
+    seconds spent handling pages (parsing, filtering, scoring, handing to the sink),
+    storing the results at the end, and the rest, which is mostly waiting on requests
+    what the server saw: requests, 429s sent, rows stored and bytes sent
+Results are JSON together with the git commit, like bench_analyzers.py, so
+--compare works the same way. --profile DIR also writes a profile of the run
+(see sentinews.profiling), which makes every number slower.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_analyzers import compare, git_commit
+
+# The sources read these when they are built; nothing is sent anywhere real
+os.environ.setdefault('NYT_API_KEY', 'stand-in')
+os.environ.setdefault('NEWS_API_KEY', 'stand-in')
+os.environ.setdefault('AUTH_PASSWORD', 'stand-in')
+os.environ['DB_API_URL'] = 'https://db.stand-in/articles'
+
+from sentinews import api_tool
+from sentinews.models import AnalyzerRegistry
+from sentinews.profiling import active_profiler, profiler_for
+from replay import Cassette, StandInServer
+
+SOURCES = {'CNN': api_tool.CNN, 'NYT': api_tool.NYT, 'FOX': api_tool.FOX, 'NEWSAPI': api_tool.NEWSAPI}
+
+
+def crawl(server, source_class, start_date, end_date, num_steps, analyzers, save_type, fetch_mode, concurrency):
+    """
+    Crawl one source against the server.
+    :return: the source's results as they are written to JSON
+    :rtype: dict
+    """
+    source = source_class(start_date=start_date, end_date=end_date, num_steps=num_steps, analyzers=analyzers,
+                          save_type=save_type, fetch_mode=fetch_mode, concurrency=concurrency,
+                          session=server.session())
+    source.rate_limiter = None
+    handling = 0.0
+
+    def on_page(articles):
+        nonlocal handling
+        page_start = time.perf_counter()
+        source.process_page(articles)
+        handling += time.perf_counter() - page_start
+
+    before = dict(server.stats)
+    start = time.perf_counter()
+    source.crawl(on_page)
+    crawled = time.perf_counter()
+    source.store_results()
+    seconds = time.perf_counter() - start
+    served = {key: server.stats[key] - before.get(key, 0)
+              for key in ('requests', 'throttled', 'stored', 'bytes_sent', 'replayed')}
+    articles = source.get_articles_logged()
+    return {'articles': articles,
+            'seconds': seconds,
+            'articles_per_sec': articles / seconds,
+            'requests_per_sec': served['requests'] / seconds,
+            'time': {'handling_pages': handling,
+                     'storing': seconds - (crawled - start),
+                     'other': crawled - start - handling},
+            'server': served}
+
+
+def run(sources, days=7, num_steps=None, results_per_query=150, latency=0.0, throttle_every=0, page_size=None,
+        analyzers='vader', save_type='api_bulk', fetch_mode='async', concurrency=4, cassette=None):
+    """
+    Crawl each source in turn against one stand-in server.
+    :return: results as they are written to JSON
+    :rtype: dict
+    """
+    registry = AnalyzerRegistry(analyzers).warmup()
+    end_date = datetime.now(tz=timezone.utc)
+    start_date = end_date - timedelta(days=days)
+    results = {}
+    with StandInServer(results_per_query=results_per_query, page_size=page_size, latency=latency,
+                       throttle_every=throttle_every, cassette=Cassette(cassette) if cassette else None,
+                       now=end_date) as server:
+        for name in sources:
+            logging.info(f"Benchmarking a crawl of {name}")
+            results[name] = crawl(server, SOURCES[name], start_date, end_date, num_steps, registry,
+                                  save_type, fetch_mode, concurrency)
+            active_profiler().stage(f'crawled {name}')
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now(tz=timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'days': days,
+            'num_steps': num_steps,
+            'results_per_query': results_per_query,
+            'latency': latency,
+            'throttle_every': throttle_every,
+            'page_size': page_size,
+            'analyzers': registry.names,
+            'save_type': save_type,
+            'fetch_mode': fetch_mode,
+            'concurrency': concurrency,
+            'cassette': cassette,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', default=','.join(SOURCES), help='comma separated sources (default: all)')
+    parser.add_argument('--days', type=int, default=7, help='days crawled, ending now')
+    parser.add_argument('--num-steps', type=int, help='time windows per crawl (default: the sources\' own)')
+    parser.add_argument('--results', type=int, default=150, help='results per query and time window')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits before answering')
+    parser.add_argument('--throttle-every', type=int, default=0, help='answer every n-th request with a 429')
+    parser.add_argument('--page-size', type=int, help='most results the server puts on a page')
+    parser.add_argument('--analyzers', default='vader', help='comma separated analyzers')
+    parser.add_argument('--save-type', default='api_bulk', choices=['api_bulk', 'api'])
+    parser.add_argument('--fetch-mode', default='async', choices=['async', 'sync'])
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight per host in async mode')
+    parser.add_argument('--cassette', help='JSON lines file of recorded responses to replay')
+    parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    parser.add_argument('--profile', metavar='DIR', help='write a profile of the run to a new directory in DIR')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            print('\n'.join(compare(json.load(before), json.load(after))))
+        return
+
+    with profiler_for('bench-crawl', args.profile):
+        results = run([name.strip().upper() for name in args.sources.split(',') if name.strip()],
+                      days=args.days,
+                      num_steps=args.num_steps,
+                      results_per_query=args.results,
+                      latency=args.latency,
+                      throttle_every=args.throttle_every,
+                      page_size=args.page_size,
+                      analyzers=args.analyzers,
+                      save_type=args.save_type,
+                      fetch_mode=args.fetch_mode,
+                      concurrency=args.concurrency,
+                      cassette=args.cassette)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
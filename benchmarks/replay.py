@@ -0,0 +1,411 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from dateutil.parser import isoparse
+
+from sentinews.fetch import PooledSession
+from synthetic import synthetic_headline, synthetic_headlines
+
+"""
+replay.py
+---
+A local stand-in for the news APIs and the database API, so a whole crawl can run
+without the network, e.g. in the tests or for bench_crawl.py.
+StandInServer answers on 127.0.0.1 in each provider's own response shape:
+    search.api.cnn.io: {"result": [...]}
+    api.nytimes.com:   {"response": {"docs": [...], "meta": {"hits": n}}}
+    api.foxnews.com:   JSONP, angular.callbacks._0({"response": {"docs": [...]}})
+    newsapi.org:       {"status": "ok", "articles": [...]}
+and accepts the POSTs of save_type api and api_bulk. Responses come from a Cassette
+of recorded ones when it has the request, otherwise they are made up from
+synthetic headlines, the same for the same request every time. Latency, 429s and
+short pages can be injected.
+A source is pointed at the server by giving it the server's session(), which sends
+https://<host>/<path> to http://127.0.0.1:<port>/<host>/<path>.
+RecordingSession saves the responses of live APIs to a Cassette for later replay.
+"""
+
+# Query parameters that are left out of cassettes
+SECRET_PARAMS = {'api-key', 'apiKey', 'apikey'}
+# Hosts that get throttled. NewsApiClient raises on a 429 instead of retrying.
+THROTTLED_HOSTS = ('search.api.cnn.io', 'api.nytimes.com', 'api.foxnews.com')
+
+
+def redirect_url(base_url, url):
+    """
+    The url of 'url' on the stand-in server at base_url.
+    :param base_url: e.g. http://127.0.0.1:8000
+    :type base_url: str
+    :param url: e.g. https://api.nytimes.com/svc/search/v2/articlesearch.json?q=...
+    :type url: str
+    :return: e.g. http://127.0.0.1:8000/api.nytimes.com/svc/search/v2/articlesearch.json?q=...
+    :rtype: str
+    """
+    if url.startswith(base_url):
+        return url
+    parts = urlsplit(url)
+    return f'{base_url}/{parts.netloc}{parts.path}' + (f'?{parts.query}' if parts.query else '')
+
+
+class RedirectSession(PooledSession):
+    """
+    PooledSession that sends every request to a StandInServer instead.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, **kwargs):
+        return super().request(method, redirect_url(self.base_url, url), **kwargs)
+
+
+class Cassette:
+    """
+    Recorded responses, one JSON object per line of a file. The api keys in
+    request urls are never written.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: JSON lines file. Responses already in it are loaded.
+        :type path: str or Path
+        """
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.responses = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[self.key(entry['method'], entry['url'])] = entry
+
+    @staticmethod
+    def key(method, url):
+        """
+        Requests with the same host, path and query parameters, in any order, share a key.
+        :rtype: str
+        """
+        parts = urlsplit(url)
+        params = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                        if name not in SECRET_PARAMS)
+        return f'{method.upper()} {parts.netloc}{parts.path}?{urlencode(params)}'
+
+    def record(self, method, url, status, content_type, body):
+        """
+        Add a response and append it to the file.
+        :param body: response body
+        :type body: str
+        """
+        key = self.key(method, url)
+        parts = urlsplit(url)
+        params = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                  if name not in SECRET_PARAMS]
+        entry = {'method': method.upper(),
+                 'url': f'{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(params)}',
+                 'status': status,
+                 'content_type': content_type,
+                 'body': body}
+        with self.lock:
+            self.responses[key] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def lookup(self, method, url):
+        """
+        :return: the recorded response with 'status', 'content_type' and 'body', or None
+        :rtype: dict or None
+        """
+        return self.responses.get(self.key(method, url))
+
+    def __len__(self):
+        return len(self.responses)
+
+
+class RecordingSession(PooledSession):
+    """
+    PooledSession that saves every GET response to a Cassette.
+    """
+
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def request(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        if method.upper() == 'GET':
+            self.cassette.record(method, response.request.url, response.status_code,
+                                 response.headers.get('Content-Type', 'application/json'), response.text)
+        return response
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so the pooled connections are reused like with the real APIs
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would hold back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.stand_in.handle(self, 'GET')
+
+    def do_POST(self):
+        self.server.stand_in.handle(self, 'POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer:
+
+    def __init__(self, results_per_query=150, page_size=None, latency=0.0, throttle_every=0, retry_after=0,
+                 cassette=None, synthetic=True, now=None, body_sentences=20, port=0):
+        """
+        :param results_per_query: results a query has, per time window for the APIs that take dates
+        :type results_per_query: int
+        :param page_size: most results on a page, even if the client asks for more
+        :type page_size: int
+        :param latency: seconds every request waits before it is answered
+        :type latency: float
+        :param throttle_every: answer every n-th GET to THROTTLED_HOSTS with a 429 (0 for never)
+        :type throttle_every: int
+        :param retry_after: Retry-After header of the 429s, in seconds
+        :type retry_after: float
+        :param cassette: recorded responses to serve when they match the request
+        :type cassette: Cassette
+        :param synthetic: make up responses for requests that are not in the cassette, otherwise 404
+        :type synthetic: bool
+        :param now: date of the newest results. Defaults to when the server was created.
+        :type now: datetime
+        :param body_sentences: sentences in the text of a CNN article
+        :type body_sentences: int
+        :param port: 0 for any free port
+        :type port: int
+        """
+        self.results_per_query = results_per_query
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.cassette = cassette
+        self.synthetic = synthetic
+        self.now = now or datetime.now(tz=timezone.utc)
+        self.body_sentences = body_sentences
+
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.hosts = Counter()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.stand_in = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def session(self, **kwargs):
+        """
+        A session whose requests all go to this server.
+        :rtype: RedirectSession
+        """
+        return RedirectSession(self.url, **kwargs)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"Stand-in server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, handler, method):
+        parts = urlsplit(handler.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        url = f'https://{host}/{path}' + (f'?{parts.query}' if parts.query else '')
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+
+        with self.lock:
+            self.stats['requests'] += 1
+            self.hosts[host] += 1
+            throttled = False
+            if method == 'GET' and host in THROTTLED_HOSTS:
+                self.stats['throttleable'] += 1
+                throttled = bool(self.throttle_every) and self.stats['throttleable'] % self.throttle_every == 0
+        if self.latency:
+            time.sleep(self.latency)
+
+        if throttled:
+            status, content_type, payload = 429, 'application/json', b'{"fault": "rate limit"}'
+        else:
+            status, content_type, payload = self.respond(method, url, body)
+
+        with self.lock:
+            self.stats['throttled'] += status == 429
+            self.stats['bytes_sent'] += len(payload)
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            handler.send_header('Retry-After', str(self.retry_after))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def respond(self, method, url, body):
+        """
+        The response to one request that is not throttled.
+        :return: status code, content type and body
+        :rtype: tuple
+        """
+        if self.cassette is not None:
+            recorded = self.cassette.lookup(method, url)
+            if recorded is not None:
+                with self.lock:
+                    self.stats['replayed'] += 1
+                return recorded['status'], recorded['content_type'], recorded['body'].encode('utf-8')
+        if not self.synthetic:
+            return 404, 'application/json', b'{"error": "not recorded"}'
+        if method == 'POST':
+            return self.store(url, body)
+
+        parts = urlsplit(url)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        make = {'search.api.cnn.io': self.cnn,
+                'api.nytimes.com': self.nyt,
+                'api.foxnews.com': self.fox,
+                'newsapi.org': self.newsapi}.get(parts.netloc)
+        if make is None:
+            return 404, 'application/json', b'{"error": "unknown host"}'
+        payload = make(params)
+        if isinstance(payload, str):
+            return 200, 'application/javascript', payload.encode('utf-8')
+        return 200, 'application/json', json.dumps(payload).encode('utf-8')
+
+    def store(self, url, body):
+        """
+        Accept a bulk POST (a JSON array) or the per-article POST of save_type api.
+        """
+        rows = json.loads(body) if body else None
+        if isinstance(rows, list):
+            with self.lock:
+                self.stats['stored'] += len(rows)
+            return 201, 'application/json', json.dumps([201] * len(rows)).encode('utf-8')
+        with self.lock:
+            self.stats['stored'] += 1
+        return 201, 'application/json', b'{"status": 201}'
+
+    def page(self, offset, size):
+        """
+        Indices of the results on a page that starts at result 'offset'.
+        """
+        size = min(size, self.page_size or size)
+        return range(max(offset, 0), max(min(offset + size, self.results_per_query), 0))
+
+    def articles(self, key, names, first, last, indices):
+        """
+        Title, url and date of some of a query's results, newest first and spread
+        evenly from last back to first.
+        :param key: what identifies the query, so it always gets the same results
+        :type key: str
+        :param names: candidates the titles are about
+        :type names: list of str
+        :rtype: list of dict
+        """
+        step = (last - first) / self.results_per_query
+        articles = []
+        for i in indices:
+            rng = random.Random(zlib.crc32(f'{key}|{i}'.encode('utf-8')))
+            title = synthetic_headline(rng, names)
+            slug = '-'.join(title.lower().split()[:6]).strip('",:')
+            articles.append({'title': title,
+                             'url': f'/stand-in/{zlib.crc32(key.encode("utf-8")):08x}/{i}/{slug}',
+                             'date': (last - step * (i + 0.5)).astimezone(timezone.utc),
+                             'rng': rng})
+        return articles
+
+    def cnn(self, params):
+        query = params.get('q', '')
+        size = int(params.get('size', 10))
+        first = self.now - timedelta(hours=self.results_per_query)
+        articles = self.articles(f'cnn|{query}', [query], first, self.now,
+                                 self.page(int(params.get('from', 0)), size))
+        return {'result': [{'url': 'https://www.cnn.com' + article['url'],
+                            'firstPublishDate': article['date'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                            'headline': article['title'],
+                            'body': ' '.join(synthetic_headlines(self.body_sentences,
+                                                                 seed=article['rng'].getrandbits(32), names=[query]))}
+                           for article in articles]}
+
+    def nyt(self, params):
+        query = params.get('q', '')
+        first = datetime.strptime(params['begin_date'], '%Y%m%d').replace(tzinfo=timezone.utc)
+        last = datetime.strptime(params['end_date'], '%Y%m%d').replace(tzinfo=timezone.utc) + timedelta(days=1)
+        last = min(last, self.now)
+        page = int(params.get('page', 0))
+        articles = self.articles(f'nyt|{query}|{params["begin_date"]}|{params["end_date"]}', [query], first, last,
+                                 self.page(page * 10, 10))
+        return {'status': 'OK',
+                'response': {'docs': [{'web_url': 'https://www.nytimes.com' + article['url'],
+                                       'pub_date': article['date'].strftime('%Y-%m-%dT%H:%M:%S+0000'),
+                                       'headline': {'main': article['title']},
+                                       'document_type': 'article'}
+                                      for article in articles],
+                             'meta': {'hits': self.results_per_query, 'offset': page * 10, 'time': 10}}}
+
+    def fox(self, params):
+        query = params.get('q', '')
+        first = datetime.strptime(params['min_date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        last = datetime.strptime(params['max_date'], '%Y-%m-%d').replace(tzinfo=timezone.utc) + timedelta(days=1)
+        last = min(last, self.now)
+        start = int(params.get('start', 0))
+        articles = self.articles(f'fox|{query}|{params["min_date"]}|{params["max_date"]}', [query], first, last,
+                                 self.page(start, 10))
+        payload = {'response': {'numFound': self.results_per_query, 'start': start,
+                                'docs': [{'url': ['https://www.foxnews.com' + article['url']],
+                                          'date': article['date'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                          'title': article['title'],
+                                          'description': '',
+                                          'type': 'article'}
+                                         for article in articles]}}
+        callback = params.get('callback', 'angular.callbacks._0')
+        return f'{callback}({json.dumps(payload)})'
+
+    def newsapi(self, params):
+        query = params.get('qintitle') or params.get('q', '')
+        names = [name.strip('() ') for name in query.split(' OR ')] or ['']
+        last = isoparse(params['to']) if params.get('to') else self.now
+        first = isoparse(params['from']) if params.get('from') else last - timedelta(days=1)
+        if first.tzinfo is None:
+            first = first.replace(tzinfo=timezone.utc)
+        if last.tzinfo is None:
+            last = last.replace(tzinfo=timezone.utc)
+        size = int(params.get('pageSize', 20))
+        page = int(params.get('page', 1))
+        articles = self.articles(f'newsapi|{query}|{params.get("from")}|{params.get("to")}', names, first, last,
+                                 self.page((page - 1) * size, size))
+        return {'status': 'ok',
+                'totalResults': self.results_per_query,
+                'articles': [{'source': {'id': 'cnn', 'name': 'CNN'},
+                              'title': article['title'],
+                              'url': 'https://www.example.com' + article['url'],
+                              'publishedAt': article['date'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                              'content': ''}
+                             for article in articles]}
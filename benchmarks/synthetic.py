@@ -0,0 +1,63 @@
+import random
+
+"""
+synthetic.py
+---
+Reproducible made-up headlines for benchmarks and offline crawls.
+Each headline names exactly one candidate, like the titles that pass
+BaseNews.improper_title(), and the same seed always gives the same headlines.
+"""
+
+TEMPLATES = [
+    '{name} {verb} {topic} plan',
+    '{name} {verb} {topic} plan at {place} rally',
+    'Why {name} {verb} the {topic} debate',
+    '{name} campaign {verb} new {topic} ad in {place}',
+    'In {place}, {name} {verb} {topic} plan',
+    '{name} {verb} critics over {topic} remarks',
+    'Analysis: {name} {verb} {topic} and what it means for {place}',
+    '{name} says {topic} is "{adjective}" as polls tighten in {place}',
+    'Fact check: {name} on {topic}',
+    '{adjective} night for {name} in {place}',
+]
+VERBS = ['unveils', 'defends', 'attacks', 'praises', 'rejects', 'slams', 'embraces', 'questions', 'wins over',
+         'loses ground on', 'doubles down on', 'backs away from']
+TOPICS = ['health care', 'climate', 'immigration', 'tax', 'trade', 'education', 'gun control', 'economy',
+          'student debt', 'foreign policy', 'infrastructure', 'jobs']
+PLACES = ['Iowa', 'New Hampshire', 'Nevada', 'South Carolina', 'Texas', 'California', 'Michigan', 'Ohio',
+          'Florida', 'Pennsylvania']
+ADJECTIVES = ['great', 'terrible', 'historic', 'disappointing', 'strong', 'weak', 'wonderful', 'awful',
+              'surprising', 'quiet']
+
+
+def synthetic_headlines(n, seed=0, names=None):
+    """
+    :param n: number of headlines
+    :type n: int
+    :param seed: the same seed gives the same headlines
+    :type seed: int
+    :param names: candidates to write about. Defaults to api_tool.CANDIDATES.
+    :type names: list of str
+    :rtype: list of str
+    """
+    if names is None:
+        from sentinews.api_tool import CANDIDATES
+        names = CANDIDATES
+    rng = random.Random(seed)
+    return [synthetic_headline(rng, names) for _ in range(n)]
+
+
+def synthetic_headline(rng, names):
+    """
+    One headline about a candidate picked from 'names'.
+    :param rng: source of randomness, e.g. random.Random(seed)
+    :type rng: random.Random
+    :type names: list of str
+    :rtype: str
+    """
+    headline = rng.choice(TEMPLATES).format(name=rng.choice(names),
+                                            verb=rng.choice(VERBS),
+                                            topic=rng.choice(TOPICS),
+                                            place=rng.choice(PLACES),
+                                            adjective=rng.choice(ADJECTIVES))
+    return headline[0].upper() + headline[1:]
@@ -29,10 +29,17 @@ setuptools.setup(
     packages=setuptools.find_packages(where='src/'),
     package_dir={'': 'src'},
     install_requires=install_requirements,
+    extras_require={
+        # Faster parsing of API responses, see sentinews.decoding
+        'orjson': ['orjson'],
+    },
+    entry_points={
+        'console_scripts': ['sentinews=sentinews.cli:main'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
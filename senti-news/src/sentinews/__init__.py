@@ -1,4 +1,3 @@
-import wget
 import pathlib
 import os
 
@@ -7,15 +6,50 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-os.environ['LSTM_PKL_FILENAME'] = 'lstm.pkl'
+os.environ.setdefault('LSTM_PKL_FILENAME', 'lstm.pkl')
 
 current_dir = pathlib.Path(__file__).parent
-g = list((current_dir / 'lstm_pkls').glob('**/*.pkl'))
-if os.environ.get('LSTM_PKL_DIR_PATH') is None and len(g) > 0:
-    os.environ['LSTM_PKL_DIR_PATH'] = str(g[0].parent)
-    os.environ['LSTM_PKL_FILENAME'] = g[0].name
-# elif len(g) == 0:
-#     url = os.environ['LSTM_PKL_URL']
-#     os.environ['LSTM_PKL_DIR_PATH'] = current_dir / 'lstm_pkls'
-#     print('No pkl file found, downloading now...')
-#     wget.download(url, os.environ.get('LSTM_PKL_DIR_PATH') / os.environ.get("LSTM_PKL_FILENAME"))
+
+
+def cache_dir():
+    """
+    Where files sentinews makes for itself are kept, e.g. trained tables and model exports:
+    sentinews in XDG_CACHE_HOME, by default ~/.cache/sentinews. The package directory
+    is often read-only once installed.
+    :rtype: Path
+    """
+    return pathlib.Path(os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache') / 'sentinews'
+
+
+def package_version(name):
+    """
+    Installed version of a distribution, or 'unknown'.
+    :param name: e.g. 'textblob', which has no __version__ attribute
+    :type name: str
+    :rtype: str
+    """
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return 'unknown'
+
+
+def locate_lstm_pkl():
+    """
+    Point LSTM_PKL_MODEL_DIR and LSTM_PKL_FILENAME at the first .pkl file in the
+    package's lstm_pkls directory, unless a model directory has already been set.
+    Called when an LSTMAnalyzer is built instead of on every import.
+    """
+    if os.environ.get('LSTM_PKL_MODEL_DIR') is not None:
+        return
+    g = list((current_dir / 'lstm_pkls').glob('**/*.pkl'))
+    if len(g) > 0:
+        os.environ['LSTM_PKL_MODEL_DIR'] = str(g[0].parent)
+        os.environ['LSTM_PKL_FILENAME'] = g[0].name
+    # elif len(g) == 0:
+    #     import wget
+    #     url = os.environ['LSTM_PKL_URL']
+    #     os.environ['LSTM_PKL_MODEL_DIR'] = current_dir / 'lstm_pkls'
+    #     print('No pkl file found, downloading now...')
+    #     wget.download(url, os.environ.get('LSTM_PKL_MODEL_DIR') / os.environ.get("LSTM_PKL_FILENAME"))
@@ -0,0 +1,68 @@
+import os
+import pathlib
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+"""
+_fs.py
+---
+Files that other processes may read while they are written: metrics for a collector,
+the TextBlob table and quantized model exports for other crawlers. Each is written
+under a temporary name next to where it goes and then moved into place in one step,
+so a reader sees the old version or the new one, never half of one.
+"""
+
+
+@contextmanager
+def staged(path, directory=False):
+    """
+    Yields a temporary path next to 'path' to write to. When the block ends it replaces
+    'path'. If the block raises, the temporary path is removed and the error raised again.
+    :type path: str or Path
+    :param directory: stage a directory instead of a file. If another process moves its
+    directory into place first, that one is kept and this one removed.
+    :type directory: bool
+    :rtype: Path
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if directory:
+        staging = pathlib.Path(tempfile.mkdtemp(prefix=path.name + '-', dir=path.parent))
+    else:
+        fd, staging = tempfile.mkstemp(prefix=path.name + '-', suffix='.tmp', dir=path.parent)
+        os.close(fd)
+        staging = pathlib.Path(staging)
+    try:
+        yield staging
+    except BaseException:
+        _remove(staging)
+        raise
+    try:
+        os.replace(staging, path)
+    except OSError:
+        _remove(staging)
+        if directory and path.is_dir():
+            # Another process moved its directory into place first
+            return
+        raise
+
+
+def write_atomic(path, text):
+    """
+    Write 'text' to the file 'path' in one step.
+    :type path: str or Path
+    :type text: str
+    """
+    with staged(path) as staging:
+        staging.write_text(text)
+
+
+def _remove(path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -1,15 +1,28 @@
-import json
+import math
 import time
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from dateutil.parser import isoparse
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, time as day_time, timezone, timedelta
 import logging
 from dotenv import load_dotenv
 from newsapi import NewsApiClient
 
-from sentinews.models import VaderAnalyzer, TextBlobAnalyzer, LSTMAnalyzer, analyze_title
+from sentinews.candidates import CandidateMatcher
+from sentinews.decoding import decode_response, project
+from sentinews.fetch import AsyncFetcher, RateLimiter, get_session, retry_delay
+from sentinews.metrics import default_metrics, serve_metrics
+from sentinews.models import AnalyzerRegistry, analyze_titles, analyzer_specs
+from sentinews.pagination import PageStream, PaginationController, as_datetime
+from sentinews.profiling import profiler_for
+from sentinews.score_cache import cache_from_env
+from sentinews.scoring import ScoringStage
+from sentinews.seen import SeenUrlIndex
+from sentinews.sinks import BulkApiSink, ColumnarBuffer
+from sentinews.state import CrawlState
 
 load_dotenv()
 logging.basicConfig(level=logging.DEBUG)
@@ -18,49 +31,567 @@ CANDIDATES = ['Donald Trump', 'Joe Biden', 'Bernie Sanders', 'Elizabeth Warren',
               'Michael Bloomberg', 'Andrew Yang', 'Tom Steyer']
 
 LAST_NAMES = ['trump', 'biden', 'sanders', 'warren', 'harris', 'buttigieg', 'yang', 'bloomberg', 'steyer']
+# CANDIDATE_LAST_NAMES (comma separated) replaces the list above
+if os.environ.get('CANDIDATE_LAST_NAMES'):
+    LAST_NAMES = os.environ['CANDIDATE_LAST_NAMES'].split(',')
 
-print("Loading sentiment analyzers...")
-analyzers = [
-    VaderAnalyzer(),
-    TextBlobAnalyzer(),
-    LSTMAnalyzer(),
-]
-print("Loaded!")
+candidate_matcher = CandidateMatcher(LAST_NAMES)
 
-DB_API_URL = os.environ['DB_API_URL']
+# Analyzers are only loaded when the first page of titles gets scored.
+# Call default_analyzers.warmup() to load them up front.
+default_analyzers = AnalyzerRegistry()
+# Scores for titles that were already seen under another url or source are reused
+default_score_cache = cache_from_env()
 
 
 class BaseNews:
-
-    def __init__(self, start_date, end_date, save_type='csv', num_steps=None):
+    # Requests per minute allowed by the source's API (None for no limit)
+    RATE_LIMIT = None
+    # Requests that can be made back to back before the rate limit applies
+    RATE_BURST = 1
+    # Times a request that gets a 429 response is retried before it is given up on
+    MAX_RETRIES = 5
+    # Articles per POST and seconds between POSTs with save_type='api_bulk'
+    BULK_BATCH_SIZE = 100
+    BULK_FLUSH_INTERVAL = 5.0
+    # Rows held in memory with save_type csv or db before they are spilled to disk
+    SPILL_ROWS = 50000
+    # Results on a full page of the source's API
+    PAGE_SIZE = 10
+    # When to stop asking for more pages of a candidate's results
+    STOP_ON_SHORT_PAGE = True
+    STOP_WHEN_ALL_SEEN = True
+    STOP_BEFORE_START_DATE = True
+    # Pages waiting to be scored before fetching blocks, with scoring_processes set
+    SCORING_QUEUE_SIZE = 8
+    # Pages completed between checkpoints of the crawl state
+    CHECKPOINT_PAGES = 10
+    # Fields of each raw result that the source uses. The others are dropped as soon
+    # as a page is parsed (None keeps everything).
+    FIELDS = None
+
+    def __init__(self, start_date, end_date, save_type='csv', num_steps=None, analyzers=None,
+                 fetch_mode='sync', concurrency=4, session=None, seen_index=None,
+                 score_cache=None, scoring_processes=0, state=None, mode='full', metrics=None):
+        self.analyzers = analyzers if analyzers is not None else default_analyzers
+        self.score_cache = score_cache if score_cache is not None else default_score_cache
+        # Counters and timings of every stage, see sentinews.metrics
+        self.metrics = metrics if metrics is not None else default_metrics
+        if os.environ.get('METRICS_PORT'):
+            serve_metrics(int(os.environ['METRICS_PORT']), self.metrics)
+        # JSON summary written by report_metrics(). crawl_sources() writes one for every source instead.
+        self.metrics_summary = os.environ.get('METRICS_SUMMARY')
+        # Pooled keep-alive session shared by every source and the database API sink
+        self.session = session if session is not None else get_session()
+        self.fetch_mode = fetch_mode  # fetch_mode can be sync or async
+        self.concurrency = concurrency  # requests in flight per host in async mode
+        self.rate_limiter = RateLimiter(self.RATE_LIMIT, self.RATE_BURST) if self.RATE_LIMIT else None
+        if num_steps is None:
+            num_steps = (end_date - start_date).days*3 #break each day into 3 chunks of time
+            if num_steps == 0:# the case where the dates are less than a day apart
+                num_steps = 3
+        # Crawl progress is checkpointed when there is a crawl state, see sentinews.state.
+        # mode can be full, resume, incremental or backfill:
+        #   full:        crawl start_date to end_date
+        #   resume:      carry on with the last crawl of this source that did not finish,
+        #                skipping the pages it completed. Its dates replace the ones given.
+        #   incremental: only fetch articles newer than each candidate's watermark
+        #   backfill:    like resume, but for the crawl over exactly these dates, see backfill()
+        if state is None and (mode != 'full' or os.environ.get('CRAWL_STATE_DB')):
+            state = CrawlState()
+        self.state = state
+        self.mode = mode
+        self.run_id = None
+        # Progress since the last checkpoint: (stream key, page, done) and label -> newest date
+        self.checkpoint_pages = []
+        self.checkpoint_watermarks = {}
+        # Streams with a page that failed. Their later pages are not recorded, and the
+        # run is left unfinished, so resuming it fetches the failed page again.
+        self.failed_streams = set()
+        # Turned off when something other than start() decides when results are stored
+        self.auto_checkpoint = True
+        if state is not None:
+            start_date, end_date, num_steps = self._begin_run(start_date, end_date, num_steps)
         self.start_date = start_date
         self.end_date = end_date
         self.increment = (end_date - start_date) / num_steps
-        self.save_type = save_type #save_type can be csv, sql, or api
+        self.save_type = save_type #save_type can be csv, sql, api or api_bulk
         if save_type == 'csv' or save_type == 'db':
-            import pandas as pd
-            self.frame = pd.DataFrame(columns=[
-                'url', 'news_co', 'datetime',
-                'title', 'vader_score','textblob_score', 'lstm_score'])
-        if num_steps is None:
-            self.num_steps = (end_date - start_date).days*3 #break each day into 3 chunks of time
-            if self.num_steps == 0:# the case where the dates are less than a day apart
-                self.num_steps = 3
+            self.frame = ColumnarBuffer(spill_rows=self.SPILL_ROWS)
+            self.csv_filename = None
         self.num_steps = num_steps
         self.articles_logged = 0
+        # Urls stored by earlier runs are skipped before any parsing or scoring.
+        # Set SEEN_URLS_DB to a SQLite file to turn this on without passing an index.
+        if seen_index is None and os.environ.get('SEEN_URLS_DB'):
+            seen_index = SeenUrlIndex()
+        self.seen_index = seen_index
+        # Urls handed to the sink this run but not yet stored. Each one leaves the set
+        # once it is stored (and in the seen index) or has failed, so a failed one is retried.
+        self.pending_urls = set()
+        self.pagination = PaginationController(self.PAGE_SIZE,
+                                               stop_on_short_page=self.STOP_ON_SHORT_PAGE,
+                                               stop_when_all_seen=self.STOP_WHEN_ALL_SEEN,
+                                               stop_before_start_date=self.STOP_BEFORE_START_DATE)
+        # With scoring_processes, titles are scored in worker processes while fetching goes on
+        self.scoring_stage = None
+        if scoring_processes:
+            # Built again in each worker with the same model directories and backends
+            names, options = analyzer_specs(self.analyzers)
+            self.scoring_stage = ScoringStage(names,
+                                              analyzer_options=options,
+                                              on_scored=self.post_article_to_db,
+                                              processes=scoring_processes,
+                                              max_pending=self.SCORING_QUEUE_SIZE,
+                                              on_failed=self._forget_failed,
+                                              metrics=self.metrics)
+        if save_type == 'api_bulk':
+            self.sink = BulkApiSink(os.environ['DB_API_URL'],
+                                    session=self.session,
+                                    password=os.environ['AUTH_PASSWORD'],
+                                    batch_size=self.BULK_BATCH_SIZE,
+                                    flush_interval=self.BULK_FLUSH_INTERVAL,
+                                    on_logged=self._count_logged,
+                                    on_failed=self._forget_failed,
+                                    metrics=self.metrics)
+
+    @property
+    def source_name(self):
+        return type(self).__name__
+
+    def stream_labels(self):
+        """
+        Labels of the streams the source builds, which are also the keys of its watermarks.
+        :rtype: list of str
+        """
+        return list(CANDIDATES)
+
+    def _begin_run(self, start_date, end_date, num_steps):
+        # Find the run to carry on with, or record a new one
+        if self.mode in ('resume', 'backfill'):
+            if self.mode == 'resume':
+                run = self.state.unfinished_run(self.source_name)
+            else:
+                run = self.state.run_for(self.source_name, start_date, end_date)
+            if run is not None:
+                logging.info(f"Resuming {self.source_name} crawl of {run['start_date']} to {run['end_date']}")
+                self.run_id = run['run_id']
+                return run['start_date'], run['end_date'], run['num_steps']
+        elif self.mode == 'incremental':
+            watermarks = [self.state.watermark(self.source_name, label) for label in self.stream_labels()]
+            if watermarks and None not in watermarks:
+                start_date = max(start_date, self._align(min(watermarks), start_date))
+                logging.info(f"Incremental {self.source_name} crawl from {start_date}")
+        elif self.mode != 'full':
+            raise ValueError(f"Unknown crawl mode '{self.mode}'")
+        self.run_id = self.state.start_run(self.source_name, start_date, end_date, num_steps)
+        return start_date, end_date, num_steps
+
+    @staticmethod
+    def _align(date, reference):
+        # Watermarks are stored in UTC. Match the timezone awareness of the crawl's dates.
+        if reference is None or reference.tzinfo is not None:
+            return date
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
 
     @staticmethod
     def improper_title(title):
         """
-        Checks if the 'title'
-        :param title:
-        :type title:
-        :return:
-        :rtype:
+        Checks if the 'title' is not about one and only one candidate.
+        :param title: headline
+        :type title: str
+        :return: True if the title names no candidate or more than one
+        :rtype: bool
+        """
+        return candidate_matcher.match(title) is None
+
+    @staticmethod
+    def improper_titles(titles):
+        """
+        improper_title() for a whole page of titles in one pass.
+        :param titles: headlines
+        :type titles: list of str
+        :rtype: list of bool
+        """
+        return [candidate is None for candidate in candidate_matcher.match_many(titles)]
+
+    @staticmethod
+    def title_candidate(title):
+        """
+        Which candidate the title is about.
+        :param title: headline
+        :type title: str
+        :return: candidate's last name in lowercase, or None if the title is improper
+        :rtype: str or None
+        """
+        return candidate_matcher.match(title)
+
+    def get(self, url):
+        """
+        Make a GET request to the news source's API.
+        Waits for the rate limiter if the source has one. A 429 response is retried
+        up to MAX_RETRIES times after the delay given by retry_delay().
+        :param url: api url
+        :type url: str
+        :rtype: requests.Response
+        """
+        source = self.source_name
+        for attempt in range(self.MAX_RETRIES + 1):
+            if self.rate_limiter is not None:
+                start = time.perf_counter()
+                self.rate_limiter.acquire()
+                self.metrics.inc('sentinews_rate_limit_wait_seconds_total', time.perf_counter() - start, source=source)
+            start = time.perf_counter()
+            response = self.session.get(url)
+            self.metrics.observe('sentinews_http_request_seconds', time.perf_counter() - start, source=source)
+            self.metrics.inc('sentinews_http_responses_total', source=source, code=response.status_code)
+            self.metrics.inc('sentinews_http_response_bytes_total', len(response.content), source=source)
+            if response.status_code != 429 or attempt == self.MAX_RETRIES:
+                return response
+
+            delay = retry_delay(response, attempt)
+            logging.info(f"Too many requests, retrying in {delay:.1f}s")
+            self.metrics.inc('sentinews_retry_wait_seconds_total', delay, source=source)
+            if self.rate_limiter is not None:
+                self.rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+    def start(self):
+        """
+        Crawl the source, score every article and store the results.
+        With a crawl state, results are stored and progress is saved every
+        CHECKPOINT_PAGES pages, so an interrupted crawl can be resumed.
+        With PROFILE_DIR set the run is profiled, see sentinews.profiling.
+        """
+        with profiler_for(self.source_name) as profiler:
+            profiler.stage('started')
+            self.crawl(self.process_page)
+            profiler.stage('crawled')
+            self.store_results()
+            profiler.stage('stored')
+
+    def crawl(self, on_page):
+        """
+        Fetch every page of results for the source and pass the raw articles of each
+        page to on_page(articles). Paginated sources only need to implement
+        build_streams(); sources with their own client override this instead.
+        :param on_page: callback for each page, e.g. process_page
+        :type on_page: callable
+        """
+        self.fetch_streams(self.build_streams(), on_page)
+
+    def build_streams(self):
+        """
+        The page urls to request, one PageStream per candidate (and time window).
+        Implemented by each paginated news source.
+        :rtype: list of PageStream
+        """
+        raise NotImplementedError
+
+    def fetch_streams(self, streams, on_page=None):
+        """
+        Request the pages of every stream, stopping a stream early when the
+        pagination controller says the rest of its pages are not needed.
+        In async mode the streams are fetched concurrently and pages are handled as
+        they arrive, otherwise everything is fetched one page at a time in order.
+        :param streams: one stream per candidate (and time window)
+        :type streams: list of PageStream
+        :param on_page: called with the raw articles of each page. Defaults to process_page.
+        :type on_page: callable
+        """
+        on_page = on_page or self.process_page
+        # Progress is saved under the stream as it was built, before resuming trims it
+        keys = {}
+        remaining = []
+        for stream in streams:
+            key = self.stream_key(stream)
+            stream = self.prepare_stream(key, stream)
+            if stream is not None:
+                keys[id(stream)] = key
+                remaining.append(stream)
+        streams = remaining
+
+        # Pages handled so far in each stream. A request that raised is never handed to
+        # handle_page, so a later page arriving out of turn means one before it failed.
+        handled = {}
+
+        def handle_page(stream, url, response):
+            key = keys[id(stream)]
+            page = stream.urls.index(url)
+            if page != handled.get(key, 0) or response.status_code != 200:
+                self.failed_streams.add(key)
+            handled[key] = page + 1
+            articles, keep_going = self.read_page(stream, url, response)
+            if articles:
+                on_page(articles)
+            if key not in self.failed_streams:
+                self.page_completed(key, articles, stream.first_page + page,
+                                    done=not keep_going or page == len(stream.urls) - 1)
+            return keep_going
+
+        if self.fetch_mode == 'async':
+            AsyncFetcher(self.get, per_host=self.concurrency).run_streams(streams, handle_page)
+            return
+
+        for stream in streams:
+            for url in stream.urls:
+                try:
+                    response = self.get(url)
+                except requests.RequestException as e:
+                    logging.info(f"Request failed: {e}")
+                    continue
+                if not handle_page(stream, url, response):
+                    break
+
+    @staticmethod
+    def stream_key(stream):
+        """
+        Name a stream's progress is saved under: its label and time window.
+        :type stream: PageStream
+        :rtype: str
+        """
+        end_date = stream.end_date.isoformat() if stream.end_date is not None else ''
+        return f'{stream.label}|{stream.start_date.isoformat()}|{end_date}'
+
+    def prepare_stream(self, key, stream):
+        """
+        What is left to fetch of a stream. When resuming, pages the interrupted crawl
+        completed are dropped, and so is the whole stream if it was finished. In
+        incremental mode the stream stops at the candidate's watermark, and windows that
+        end before it are dropped.
+        :param key: stream_key() of the stream
+        :type key: str
+        :type stream: PageStream
+        :rtype: PageStream or None
+        """
+        if self.state is None:
+            return stream
+
+        if self.mode in ('resume', 'backfill'):
+            last_page, done = self.state.stream_progress(self.run_id, key)
+            if done:
+                return None
+            if last_page >= stream.first_page:
+                stream = stream._replace(urls=stream.urls[last_page + 1 - stream.first_page:],
+                                         first_page=last_page + 1)
+                if not stream.urls:
+                    return None
+        elif self.mode == 'incremental':
+            watermark = self.state.watermark(self.source_name, stream.label)
+            if watermark is not None:
+                watermark = self._align(watermark, stream.start_date)
+                if stream.end_date is not None and stream.end_date <= watermark:
+                    return None
+                if stream.start_date is None or stream.start_date < watermark:
+                    stream = stream._replace(start_date=watermark)
+        return stream
+
+    def page_completed(self, key, articles, page, done=False):
+        """
+        Record that a page of a stream has been handed to on_page. Saved with the
+        next checkpoint.
+        :param key: stream_key() of the page's stream
+        :type key: str
+        :param articles: raw results on the page, for the watermark
+        :type articles: list of dict
+        :param page: page number within the stream
+        :type page: int
+        :param done: True if the stream will not fetch any more pages
+        :type done: bool
+        """
+        if self.state is None:
+            return
+        self.checkpoint_pages.append((key, page, done))
+        self.advance_watermark(key.split('|', 1)[0], articles)
+        if self.auto_checkpoint and len(self.checkpoint_pages) >= self.CHECKPOINT_PAGES:
+            self.checkpoint()
+
+    def advance_watermark(self, label, articles):
+        """
+        Move a stream's watermark up to the newest of 'articles'. Saved with the next checkpoint.
+        :param label: the stream's label, e.g. the candidate
+        :type label: str
+        :param articles: raw results handed to on_page
+        :type articles: list of dict
+        """
+        for article in articles:
+            date = as_datetime(self.article_date(article))
+            if date is not None and (label not in self.checkpoint_watermarks
+                                     or date > self.checkpoint_watermarks[label]):
+                self.checkpoint_watermarks[label] = date
+
+    def checkpoint(self):
+        """
+        Store everything scored so far, then save the progress of the crawl.
+        Pages are only marked done once their articles are stored.
+        """
+        if self.state is None:
+            return
+        pages, watermarks = self.checkpoint_pages, self.checkpoint_watermarks
+        self.checkpoint_pages, self.checkpoint_watermarks = [], {}
+        self.flush_results()
+        self.state.commit(self.source_name, self.run_id, pages, watermarks)
+        if os.environ.get('METRICS_FILE'):
+            self.metrics.write_prometheus(os.environ['METRICS_FILE'])
+
+    def read_page(self, stream, url, response):
+        """
+        Get the articles out of a response and decide whether the stream
+        should go on to its next page.
+        :param stream: stream the page belongs to
+        :type stream: PageStream
+        :param url: url that was requested
+        :type url: str
+        :param response: response from the news source's API
+        :type response: requests.Response
+        :return: raw articles (empty unless the request succeeded), and False to stop the stream
+        :rtype: tuple
+        """
+        code = response.status_code
+        logging.info(f"Response code: {code}")
+        if code == 429:
+            logging.info(f"Too many requests, giving up on {url}")
+        if code != 200:
+            return [], True
+
+        articles = self.parse_results(response)
+        # Counted before the page's urls are marked as pending
+        n_seen = sum(self.already_seen(self.article_url(article)) for article in articles)
+        oldest_date = self.article_date(articles[-1]) if articles else None
+        return articles, self.pagination.stop_reason(stream, len(articles), n_seen, oldest_date) is None
+
+    def parse_results(self, response):
+        """
+        Get the list of raw articles out of an API response.
+        Implemented by each news source.
+        :rtype: list of dict
+        """
+        raise NotImplementedError
+
+    def already_seen(self, url):
+        """
+        True if the article at 'url' has already been stored, by this run or an earlier one.
+        Always False when there is no seen url index.
+        :param url: article url
+        :type url: str
+        :rtype: bool
+        """
+        if self.seen_index is None:
+            return False
+        return url in self.pending_urls or url in self.seen_index
+
+    def mark_stored(self, urls):
+        """
+        Record urls that the sink has stored in the seen url index.
+        :param urls: article urls
+        :type urls: list of str
+        """
+        if self.seen_index is not None:
+            self.seen_index.add_many(urls)
+            self.pending_urls.difference_update(urls)
+
+    def mark_failed(self, urls):
+        """
+        Forget urls that could not be scored or stored, so they are not taken to be
+        already seen and a later page with them tries again.
+        :param urls: article urls
+        :type urls: list of str
+        """
+        self.pending_urls.difference_update(urls)
+
+    def article_url(self, article):
+        """
+        Url of a raw API result. Implemented by each paginated news source.
+        """
+        raise NotImplementedError
+
+    def article_date(self, article):
+        """
+        Publish date of a raw API result. Implemented by each paginated news source.
+        :rtype: str or datetime
+        """
+        raise NotImplementedError
+
+    def article_title(self, article):
+        """
+        Headline of a raw API result. Implemented by each news source.
+        :rtype: str
         """
-        return sum([1 if name in title.lower() else 0 for name in LAST_NAMES]) != 1
+        raise NotImplementedError
+
+    def extract_information(self, article):
+        """
+        Pull the fields to be stored out of a raw API result.
+        Its title has already been checked by filter_page(), a page at a time.
+        Implemented by each news source.
+        :param article: one result from the news source's API
+        :type article: dict
+        :return: article information, or None if the article should be skipped
+        :rtype: dict or None
+        """
+        raise NotImplementedError
+
+    def filter_page(self, articles):
+        """
+        Extract the information from every article on a page, dropping improper
+        titles and articles that were already stored.
+        :param articles: raw results from the news source's API
+        :type articles: list of dict
+        :return: article information for the articles worth scoring
+        :rtype: list of dict
+        """
+        # Every title on the page is checked in one pass of the candidate matcher
+        improper = self.improper_titles([self.article_title(article) for article in articles])
+        proper = [article for article, bad in zip(articles, improper) if not bad]
+        article_infos = [info for info in map(self.extract_information, proper) if info is not None]
+        if len(article_infos) < len(articles):
+            self.metrics.inc('sentinews_articles_total', len(proper) - len(article_infos),
+                             source=self.source_name, outcome='already_seen')
+            self.metrics.inc('sentinews_articles_total', len(articles) - len(proper),
+                             source=self.source_name, outcome='improper_title')
+        self.metrics.inc('sentinews_articles_total', len(article_infos), source=self.source_name, outcome='kept')
+        if self.seen_index is not None:
+            self.pending_urls.update(info['url'] for info in article_infos)
+        return article_infos
+
+    def process_page(self, articles):
+        """
+        Extract, filter and score every article from one page of API results.
+        The titles that pass improper_titles are scored together with analyze_titles
+        so each analyzer does one batched pass per page. With scoring_processes the
+        page is queued for the worker processes instead.
+        :param articles: raw results from the news source's API
+        :type articles: list of dict
+        """
+        start = time.perf_counter()
+        article_infos = self.filter_page(articles)
+        if not article_infos:
+            return
+
+        if self.scoring_stage is not None:
+            self.scoring_stage.submit(article_infos)
+        else:
+            scores = analyze_titles(self.analyzers, [info['title'] for info in article_infos],
+                                    cache=self.score_cache, metrics=self.metrics)
+            columns = {key: column.tolist() for key, column in scores.items()}
+            for i, article_info in enumerate(article_infos):
+                self.post_article_to_db(article_info=article_info,
+                                        scores={key: column[i] for key, column in columns.items()})
+        self.metrics.observe('sentinews_page_seconds', time.perf_counter() - start, source=self.source_name)
+
+    def _count_logged(self, records):
+        self.articles_logged += len(records)
+        self.mark_stored([record['url'] for record in records])
+
+    def _forget_failed(self, records):
+        self.mark_failed([record['url'] for record in records])
 
     def post_article_to_db(self, article_info, scores):
+        if self.save_type == 'api_bulk':
+            self.sink.add({**article_info, **scores})
+            return
+
         if self.save_type != 'api':
             self.frame.append({**article_info, **scores})
             self.articles_logged += 1
@@ -71,39 +602,106 @@ class BaseNews:
             'password': os.environ['AUTH_PASSWORD'],
         }
 
-        response = requests.post(DB_API_URL, params=payload, headers=header)
+        start = time.perf_counter()
+        response = self.session.post(os.environ['DB_API_URL'], params=payload, headers=header)
+        self.metrics.observe('sentinews_sink_seconds', time.perf_counter() - start, sink='api')
         logging.info(f"Made POST request to database API, response code: {response.status_code}")
         if response.status_code == 201:
             self.articles_logged += 1
+            self.mark_stored([article_info['url']])
+        else:
+            self.mark_failed([article_info['url']])
+        self.metrics.inc('sentinews_sink_rows_total', sink='api',
+                         outcome='stored' if response.status_code == 201 else 'failed')
 
     def get_articles_logged(self):
         return self.articles_logged
 
+    def flush_results(self):
+        """
+        Store every article scored so far and wait until the sink has them.
+        With save_type csv the rows are appended to this run's csv file.
+        """
+        if self.scoring_stage is not None:
+            self.scoring_stage.wait()
+        if self.save_type == 'api_bulk':
+            self.sink.wait()
+        elif self.save_type == 'csv':
+            for frame in self.frame.drain():
+                start = time.perf_counter()
+                first = self.csv_filename is None
+                if first:
+                    self.csv_filename = datetime.utcnow().isoformat() + '-sentinews-data.csv'
+                frame.to_csv(self.csv_filename, mode='w' if first else 'a', header=first, index=False)
+                self._record_write(start, frame)
+        elif self.save_type == 'db':
+            for frame in self.frame.drain():
+                start = time.perf_counter()
+                frame.to_sql("table_name",
+                             os.environ['DB_URL'],
+                             if_exists='append',
+                             index=False)
+                self._record_write(start, frame)
+
+    def _record_write(self, start, frame):
+        self.metrics.observe('sentinews_sink_seconds', time.perf_counter() - start, sink=self.save_type)
+        self.metrics.inc('sentinews_sink_rows_total', len(frame), sink=self.save_type, outcome='stored')
+        self.mark_stored(frame['url'].tolist())
+
     #todo: make more robust
     def store_results(self):
-        if self.save_type == 'csv':
-            filename = datetime.utcnow().isoformat() + '-sentinews-data.csv'
-            self.frame.to_csv(filename)
-        elif self.save_type == 'db':
-            self.frame.to_sql("table_name",
-                              os.environ['DB_URL'],
-                              if_exists='append')
+        if self.scoring_stage is not None:
+            self.scoring_stage.close()
+            self.scoring_stage = None
+        self.flush_results()
+        if self.save_type == 'api_bulk':
+            self.sink.close()
+        if self.state is not None:
+            self.checkpoint()
+            if self.failed_streams:
+                logging.warning(f"{self.source_name} crawl left unfinished, {len(self.failed_streams)} streams had "
+                                f"pages that failed. Crawl again with mode='resume' to fetch them.")
+            else:
+                self.state.finish_run(self.run_id)
+        self.report_metrics()
+
+    def report_metrics(self):
+        """
+        Write the metrics at the end of a run: Prometheus text to METRICS_FILE and
+        the JSON summary to METRICS_SUMMARY, for whichever of them is set.
+        """
+        if os.environ.get('METRICS_FILE'):
+            self.metrics.write_prometheus(os.environ['METRICS_FILE'])
+        if self.metrics_summary:
+            self.metrics.write_summary(self.metrics_summary,
+                                       source=self.source_name,
+                                       start_date=self.start_date,
+                                       end_date=self.end_date,
+                                       articles_logged=self.articles_logged)
 
 
 class CNN(BaseNews):
     RESULTS_SIZE = 100
+    PAGE_SIZE = RESULTS_SIZE
     PAGE_LIMIT = 15
     NEWS_CO = 'CNN'
+    FIELDS = ('url', 'firstPublishDate', 'headline', 'body')
 
-    def start(self):
-        for q in CANDIDATES:
-            for p in range(self.PAGE_LIMIT):
-                url = self.create_api_query(q, page=p)
-                response = requests.get(url)
-                if response.status_code == 200:
-                    for article in json.loads(response.text)['result']:
-                        self.extract_information(article)
-        self.store_results()
+    def build_streams(self):
+        # CNN's search has no date filter, so each candidate pages back through the
+        # newest results until it gets past start_date
+        return [PageStream([self.create_api_query(q, page=p) for p in range(self.PAGE_LIMIT)],
+                           self.start_date, q)
+                for q in CANDIDATES]
+
+    def parse_results(self, response):
+        return project(decode_response(response)['result'], self.FIELDS)
+
+    def article_url(self, article):
+        return article['url']
+
+    def article_date(self, article):
+        return article['firstPublishDate']
 
     def create_api_query(self, query, page):
         """
@@ -119,8 +717,14 @@ class CNN(BaseNews):
                f'&q={query}&type=article&sort=newest&page={page}' \
                f'&from={str(page * self.RESULTS_SIZE)}'
 
+    def article_title(self, article):
+        return article['headline']
+
     def extract_information(self, article):
 
+        if self.already_seen(article['url']):
+            return None
+
         # Pull information from article
         article_info = {
             'url': article['url'],
@@ -130,12 +734,7 @@ class CNN(BaseNews):
             'news_co': self.NEWS_CO,
         }
 
-        # Check if title has one and only one candidate name
-        if self.improper_title(article_info['title']):
-            return None
-
-        scores = analyze_title(analyzers, article_info['title'])
-        self.post_article_to_db(article_info=article_info, scores=scores)
+        return article_info
 
 
 class NYT(BaseNews):
@@ -147,31 +746,143 @@ class NYT(BaseNews):
     NEWS_CO = 'The New York Times'  # news company name
     name = 'nyt'  # spider name
     PAGE_LIMIT = 15
-
-    def start(self):
-
-        for n in range(self.num_steps):
-            self.end_date = self.start_date + self.increment
-
-            for q in CANDIDATES:
-                for p in range(self.PAGE_LIMIT):
-                    url = self.create_api_query(q, page=p)
-                    response = requests.get(url)
-
-                    # NYT API only allows 10 requests per minute
-                    time.sleep(10)
-                    code = response.status_code
-                    logging.info(f"Response code: {code}")
-                    if code == 200:
-                        for article in json.loads(response.text)['response']['docs']:
-                            self.extract_information(article)
-                    if code == 429:
-                        logging.info("Too many requests")
-
-            self.start_date += self.increment
-        self.store_results()
-
-    def create_api_query(self, query, page, sort='newest'):
+    # NYT API only allows 10 requests per minute
+    RATE_LIMIT = 10
+    FIELDS = ('web_url', 'pub_date', 'headline')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Windows found to have more hits than PAGE_LIMIT pages can hold, as
+        # (query, first day, last day, first page) of the windows that replace them
+        self.splits = []
+        self.split_keys = set()
+        # Urls handed on from the pages that windows were split on. A half that starts
+        # again from page 0 can get some of them a second time.
+        self.split_urls = set()
+        # stream key -> pages needed for all of the window's hits
+        self.window_pages = {}
+        # meta.hits of the page parse_results() read last. Pages are read one at a time.
+        self.last_hits = None
+
+    def crawl(self, on_page):
+        """
+        Fetch each window, splitting the ones with too many hits in half until every
+        window fits in PAGE_LIMIT pages or is a single day. The first page of a window
+        says how many hits it has, so pages past the last hit are never requested.
+        """
+        streams = self.build_streams()
+        while streams:
+            self.splits = []
+            self.fetch_streams(streams, on_page)
+            streams = [self.window_stream(*split) for split in self.splits]
+            streams = [stream for stream in streams if stream.urls]
+
+    def build_streams(self):
+        return [self.window_stream(q, first_day, last_day)
+                for first_day, last_day in self.day_windows()
+                for q in CANDIDATES]
+
+    def day_windows(self):
+        """
+        Split start_date to end_date into num_steps windows of whole days.
+        The API's begin_date and end_date are days, so shorter windows would only
+        ask for the same results again.
+        :return: first and last day of each window
+        :rtype: list of tuple
+        """
+        # An end_date at midnight does not include that day
+        first_day = self.start_date.date()
+        last_day = max((self.end_date - timedelta(microseconds=1)).date(), first_day)
+        n_days = (last_day - first_day).days + 1
+        n_windows = max(min(self.num_steps, n_days), 1)
+        bounds = [first_day + timedelta(days=n_days * i // n_windows) for i in range(n_windows + 1)]
+        return [(bounds[i], bounds[i + 1] - timedelta(days=1)) for i in range(n_windows)]
+
+    def window_stream(self, query, first_day, last_day, first_page=0):
+        """
+        Pages of a query's results from first_day to last_day, both included.
+        :param first_page: first page to request, when the ones before it were already handed on
+        :type first_page: int
+        :rtype: PageStream
+        """
+        urls = [self.create_api_query(query, page=p, begin_date=first_day, end_date=last_day)
+                for p in range(first_page, self.PAGE_LIMIT)]
+        tzinfo = self.start_date.tzinfo
+        return PageStream(urls,
+                          datetime.combine(first_day, day_time(), tzinfo=tzinfo),
+                          query,
+                          datetime.combine(last_day + timedelta(days=1), day_time(), tzinfo=tzinfo),
+                          first_page)
+
+    def read_page(self, stream, url, response):
+        articles, keep_going = super().read_page(stream, url, response)
+        if response.status_code != 200:
+            return articles, keep_going
+
+        key = self.stream_key(stream)
+        page = stream.first_page + stream.urls.index(url)
+        # Handed on already from the page a bigger window was split on
+        fresh = [article for article in articles if self.article_url(article) not in self.split_urls]
+        if page == stream.first_page:
+            hits = self.last_hits
+            if hits is not None:
+                first_day, last_day = stream.start_date.date(), (stream.end_date - timedelta(days=1)).date()
+                if hits > self.PAGE_SIZE * self.PAGE_LIMIT and first_day < last_day:
+                    self.split_window(stream, articles, page, first_day, last_day)
+                    self.split_keys.add(key)
+                    self.pagination.record(stream, 'split window')
+                    return fresh, False
+                self.window_pages[key] = math.ceil(hits / self.PAGE_SIZE)
+
+        if keep_going and page + 1 >= self.window_pages.get(key, self.PAGE_LIMIT):
+            self.pagination.record(stream, 'no more hits')
+            keep_going = False
+        return fresh, keep_going
+
+    def split_window(self, stream, articles, page, first_day, last_day):
+        """
+        Replace a window with its two halves. The page that showed it has too many hits
+        is handed on rather than fetched again: results come newest first, so while
+        all of them are in the newer half, that half carries on from the next page.
+        Otherwise the newer half has no more results than pages 0 to 'page' held, and
+        only the older half is left to fetch.
+        :param articles: results on the window's page 'page'
+        :type articles: list of dict
+        """
+        middle = first_day + (last_day - first_day) // 2
+        dates = [as_datetime(self.article_date(article)) for article in articles]
+        newer = [date for date in dates if date is not None and date.date() > middle]
+        self.split_urls.update(self.article_url(article) for article in articles)
+        if None in dates:
+            # Without every date it is not known which half the page belongs to
+            self.splits += [(stream.label, first_day, middle, 0), (stream.label, middle + timedelta(days=1), last_day, 0)]
+        elif len(newer) == len(articles):
+            self.splits += [(stream.label, first_day, middle, 0),
+                            (stream.label, middle + timedelta(days=1), last_day, page + 1)]
+        else:
+            # With nothing newer on the window's very first page, that page was the older half's first page
+            self.splits.append((stream.label, first_day, middle, 1 if page == 0 and not newer else 0))
+
+    def page_completed(self, key, articles, page, done=False):
+        # A window that was split is covered by its halves. Resuming re-reads its
+        # first page and splits it again.
+        if key not in self.split_keys:
+            super().page_completed(key, articles, page, done)
+        elif self.state is not None:
+            self.advance_watermark(key.split('|', 1)[0], articles)
+
+    def parse_results(self, response):
+        document = decode_response(response)['response']
+        self.last_hits = document.get('meta', {}).get('hits')
+        return project(document['docs'], self.FIELDS)
+
+    def article_url(self, article):
+        return article['web_url']
+
+    def article_date(self, article):
+        return article['pub_date']
+
+    def create_api_query(self, query, page, sort='newest', begin_date=None, end_date=None):
         """
         Since the url is a very long string, most of it the exact same for each request,
          this method makes it easier to create the api url.
@@ -181,11 +892,17 @@ class NYT(BaseNews):
         :type page: str or int
         :param sort: how to sort results: newest or relevance
         :type sort: str
+        :param begin_date: first day of results. Defaults to start_date.
+        :type begin_date: date
+        :param end_date: last day of results. Defaults to end_date.
+        :type end_date: date
         :return: the whole api url to be called
         :rtype: str
         """
         # Turn datetime objects to correct string representation
-        begin_date, end_date = self.make_date_strings()
+        default_begin, default_end = self.make_date_strings()
+        begin_date = begin_date.strftime('%Y%m%d') if begin_date is not None else default_begin
+        end_date = end_date.strftime('%Y%m%d') if end_date is not None else default_end
 
         # todo: incorporate fq=headline:("name")
         #   also fq=section_name:("Opinion")
@@ -205,13 +922,14 @@ class NYT(BaseNews):
         """
         return self.start_date.strftime('%Y%m%d'), self.end_date.strftime('%Y%m%d')
 
+    def article_title(self, article):
+        return article['headline']['main']
+
     def extract_information(self, article):
 
         title = article['headline']['main']
 
-        # Check if title has one and only one candidate name
-        if self.improper_title(title):
-            logging.info(f"Bad title: {title}")
+        if self.already_seen(article['web_url']):
             return None
 
         article_info = {
@@ -222,8 +940,7 @@ class NYT(BaseNews):
             'text': '',
         }
 
-        scores = analyze_title(analyzers, title)
-        self.post_article_to_db(article_info=article_info, scores=scores)
+        return article_info
 
 
 class FOX(BaseNews):
@@ -238,40 +955,50 @@ class FOX(BaseNews):
     PAGE_LIMIT = 20
 
     NEWS_CO = 'Fox News'
+    FIELDS = ('url', 'date', 'title')
 
-    def start(self):
-
+    def build_streams(self):
+        streams = []
         for n in range(self.num_steps):
-            self.end_date = self.start_date + self.increment
+            # start_date and end_date stay the whole crawl's, for its run record and metrics
+            step_start = self.start_date + n * self.increment
+            step_end = step_start + self.increment
 
             for query in CANDIDATES:
-                for start in range(0,
-                                   self.PAGE_SIZE * self.PAGE_LIMIT,
-                                   self.PAGE_SIZE):
-                    url = self.create_api_query(query, start=start)
-                    response = requests.get(url)
-                    code = response.status_code
-                    logging.info(f"Response code: {code}")
-                    if code == 200:
-                        for article in json.loads(response.text[21:-1])['response']['docs']:
-                            self.extract_information(article)
-                    if code == 429:
-                        logging.info("Too many requests")
-
-            self.start_date += self.increment
-        self.store_results()
-
-    def create_api_query(self, query, start):
+                urls = [self.create_api_query(query, start=start, min_date=step_start, max_date=step_end)
+                        for start in range(0,
+                                           self.PAGE_SIZE * self.PAGE_LIMIT,
+                                           self.PAGE_SIZE)]
+                streams.append(PageStream(urls, step_start, query, step_end))
+        return streams
+
+    def parse_results(self, response):
+        # The JSON is inside a JSONP wrapper: angular.callbacks._0( ... )
+        return project(decode_response(response, jsonp=True)['response']['docs'], self.FIELDS)
+
+    def article_url(self, article):
+        return article['url'][0]
+
+    def article_date(self, article):
+        return article['date']
+
+    def create_api_query(self, query, start, min_date=None, max_date=None):
         """
         Create string to be sent as a query to the API.
         :param query: candidate
         :type query: str
         :param start: the number of the article to start on
         :type start: str or int
+        :param min_date: first day of results. Defaults to start_date.
+        :type min_date: datetime
+        :param max_date: last day of results. Defaults to end_date.
+        :type max_date: datetime
         :return: query string
         :rtype: str
         """
-        min_date, max_date = self.make_date_strings()
+        default_min, default_max = self.make_date_strings()
+        min_date = min_date.strftime('%Y-%m-%d') if min_date is not None else default_min
+        max_date = max_date.strftime('%Y-%m-%d') if max_date is not None else default_max
         return f'https://api.foxnews.com/v1/content/search?q={query}' \
                f'&fields=date,description,title,url,image,type,taxonomy' \
                f'&sort=latest&section.path=fnc/politics,fnc/opinion,fnc/us&type=article' \
@@ -287,11 +1014,14 @@ class FOX(BaseNews):
         """
         return self.start_date.strftime('%Y-%m-%d'), self.end_date.strftime('%Y-%m-%d')
 
+    def article_title(self, article):
+        return article['title']
+
     def extract_information(self, article):
         title = article['title']
         logging.info(f"Checking:  {title}")
-        if self.improper_title(title):
-            return
+        if self.already_seen(article['url'][0]):
+            return None
 
         article_info = {
             'datetime': article['date'],
@@ -301,12 +1031,11 @@ class FOX(BaseNews):
             'text': '',
         }
 
-        scores = analyze_title(analyzers, title)
-        self.post_article_to_db(article_info=article_info, scores=scores)
+        return article_info
 
 
 class NEWSAPI(BaseNews):
-    news_client = NewsApiClient(api_key=os.environ['NEWS_API_KEY'])
+    _news_client = None
 
     PAGE_SIZE = 100
     QUERY = '(' + ') OR ('.join(CANDIDATES) + ')'
@@ -315,31 +1044,62 @@ class NEWSAPI(BaseNews):
     PAGE_NUM = 1  # with free version, can't go past page 1
     SOURCES = ','.join(['cnn', 'fox-news', 'the-new-york-times'])
 
-    def start(self):
-
-        for i in range(self.num_steps):
-            self.end_date = self.start_date + self.increment
+    @property
+    def news_client(self):
+        """
+        NewsApiClient is created the first time it is used so that importing
+        this module does not require NEWS_API_KEY. It makes its requests through
+        the source's session.
+        """
+        if self._news_client is None:
+            self._news_client = NewsApiClient(api_key=os.environ['NEWS_API_KEY'], session=self.session)
+        return self._news_client
 
-            results = self.news_client.get_everything(page=self.PAGE_NUM,
-                                                      from_param=self.start_date,
-                                                      page_size=self.PAGE_SIZE,
-                                                      qintitle=self.QUERY,
-                                                      language=self.LANG,
-                                                      sources=self.SOURCES,
-                                                      sort_by=self.SORT_BY)
+    def stream_labels(self):
+        # One query covers every candidate
+        return ['all']
 
-            if results['status'] == 'ok':
-                for article in results['articles']:
-                    self.extract_information(article)
+    def crawl(self, on_page):
 
-            self.start_date += self.increment
-        self.store_results()
+        for i in range(self.num_steps):
+            step_start = self.start_date + i * self.increment
+
+            # Each window is a one-page stream, so it can be checkpointed like the others
+            stream = PageStream([], step_start, 'all', step_start + self.increment)
+            key = self.stream_key(stream)
+            stream = self.prepare_stream(key, stream)
+            if stream is not None:
+                start = time.perf_counter()
+                results = self.news_client.get_everything(page=self.PAGE_NUM,
+                                                          from_param=stream.start_date,
+                                                          page_size=self.PAGE_SIZE,
+                                                          qintitle=self.QUERY,
+                                                          language=self.LANG,
+                                                          sources=self.SOURCES,
+                                                          sort_by=self.SORT_BY)
+                # NewsApiClient raises for anything but a 200
+                self.metrics.observe('sentinews_http_request_seconds', time.perf_counter() - start,
+                                     source=self.source_name)
+                self.metrics.inc('sentinews_http_responses_total', source=self.source_name, code=200)
+
+                if results['status'] == 'ok':
+                    on_page(results['articles'])
+                    self.page_completed(key, results['articles'], 0, done=True)
+
+    def article_url(self, article):
+        return article['url']
+
+    def article_date(self, article):
+        return article['publishedAt']
+
+    def article_title(self, article):
+        return article['title']
 
     def extract_information(self, article):
         title = article['title']
         logging.info(f"Checking:  {title}")
-        if self.improper_title(title):
-            return
+        if self.already_seen(article['url']):
+            return None
 
         article_info = {
             'url': article['url'],
@@ -349,31 +1109,104 @@ class NEWSAPI(BaseNews):
             'text': article.get('content', ''),
         }
 
-        scores = analyze_title(analyzers, title)
-        self.post_article_to_db(article_info=article_info, scores=scores)
+        return article_info
+
+
+def _warmup(analyzers):
+    if isinstance(analyzers, AnalyzerRegistry):
+        analyzers.warmup()
+
+
+def backfill(source_class, start_date, end_date, window=timedelta(days=7), workers=4, state=None, **kwargs):
+    """
+    Crawl a long stretch of history as consecutive windows, several at a time.
+    Each window is its own checkpointed crawl, so calling backfill() again with the
+    same arguments skips the windows that finished and resumes the others.
+    The windows share one rate limiter, so together they stay within the source's limit.
+    :param source_class: news source, e.g. NYT
+    :type source_class: type
+    :param window: length of each window
+    :type window: timedelta
+    :param workers: windows crawled at the same time
+    :type workers: int
+    :param state: crawl state. Defaults to CrawlState().
+    :type state: CrawlState
+    :param kwargs: passed on to source_class, e.g. save_type or num_steps per window
+    :return: number of articles logged
+    :rtype: int
+    """
+    state = state if state is not None else CrawlState()
+    rate_limiter = RateLimiter(source_class.RATE_LIMIT, source_class.RATE_BURST) if source_class.RATE_LIMIT else None
+
+    windows = []
+    window_start = start_date
+    while window_start < end_date:
+        window_end = min(window_start + window, end_date)
+        run = state.run_for(source_class.__name__, window_start, window_end)
+        if run is None or not run['finished']:
+            windows.append((window_start, window_end))
+        window_start = window_end
+    logging.info(f"Backfilling {len(windows)} windows of {source_class.__name__}")
+    # Loaded once here rather than by whichever windows score their first page together
+    _warmup(kwargs.get('analyzers', default_analyzers))
+
+    def crawl_window(dates):
+        source = source_class(start_date=dates[0], end_date=dates[1], state=state, mode='backfill', **kwargs)
+        source.rate_limiter = rate_limiter
+        source.start()
+        return source.get_articles_logged()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(crawl_window, windows))
+
+
+def crawl_sources(source_classes, start_date, end_date, **kwargs):
+    """
+    Crawl several news sources at the same time, one thread each.
+    Every source has its own rate limiter, so each stays within its own API's
+    limit while the others run, and the whole crawl takes about as long as the
+    slowest source instead of all of them added together.
+    A source that fails is logged and does not stop the others.
+    The sources share their analyzers and metrics, so with METRICS_SUMMARY set one
+    summary covering every source is written once they have all finished.
+    :param source_classes: e.g. [NYT, CNN]
+    :type source_classes: list of type
+    :param kwargs: passed on to every source, e.g. save_type or analyzers
+    :return: source name -> number of articles logged, or the exception that stopped it
+    :rtype: dict
+    """
+    _warmup(kwargs.get('analyzers', default_analyzers))
+
+    def crawl(source_class):
+        source = source_class(start_date=start_date, end_date=end_date, **kwargs)
+        source.metrics_summary = None
+        source.start()
+        logging.info(f"{source.source_name}: logged {source.get_articles_logged()} articles")
+        return source.get_articles_logged()
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(len(source_classes), 1)) as executor:
+        futures = {source_class.__name__: executor.submit(crawl, source_class) for source_class in source_classes}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logging.exception(f"Crawl of {name} failed")
+                results[name] = e
+    if os.environ.get('METRICS_SUMMARY'):
+        metrics = kwargs.get('metrics') or default_metrics
+        metrics.write_summary(os.environ['METRICS_SUMMARY'],
+                              sources={name: result if isinstance(result, int) else f'failed: {result}'
+                                       for name, result in results.items()},
+                              start_date=start_date,
+                              end_date=end_date)
+    return results
+
+
+SOURCES = {'nyt': NYT, 'cnn': CNN, 'fox': FOX, 'newsapi': NEWSAPI}
 
 
 if __name__ == '__main__':
-    num_divides = 30
-    today = datetime.now(tz=timezone.utc)
-    start_date = today - timedelta(days=7)
-
-    choice = input("Which API would you like to use?\n"
-                   "1. NYTimes\n"
-                   "2. CNN\n"
-                   "3. Fox News\n"
-                   "4. NewsAPIs\n")
-    if choice == '1':
-        api_choice = NYT(start_date=start_date, end_date=today, num_steps=num_divides, save_type='api')
-    elif choice == '2':
-        api_choice = CNN(start_date=start_date, end_date=today, num_steps=num_divides, save_type='api')
-    elif choice == '3':
-        api_choice = FOX(start_date=start_date, end_date=today, num_steps=num_divides, save_type='api')
-    elif choice == '4':
-        api_choice = NEWSAPI(start_date=start_date, end_date=today, num_steps=num_divides, save_type='api')
-    else:
-        import sys
-
-        sys.exit(0)
-
-    api_choice.start()
\ No newline at end of file
+    from sentinews.cli import main
+
+    main()
@@ -0,0 +1,176 @@
+import logging
+import os
+import pathlib
+
+import numpy as np
+
+from sentinews import cache_dir
+from sentinews._fs import staged
+from sentinews.lazy import LazyModule
+
+torch = LazyModule('torch')
+
+"""
+backends.py
+---
+How the LSTM and BERT analyzers run their models on CPU.
+    eager:     the model as it was trained, fp32 (default)
+    quantized: Linear and LSTM layers dynamically quantized to int8. BERT is also
+               traced to TorchScript once and saved, so later processes only load it.
+Pick one per analyzer with LSTM_BACKEND and BERT_BACKEND. Quantized scores are close
+to the eager ones but not identical: check_agreement() compares the two on a sample
+of titles before switching.
+length_buckets() and pad_rows() batch titles of similar length together, so short
+headlines are not padded out to the longest one.
+"""
+
+BACKENDS = ('eager', 'quantized')
+
+
+def backend_for(analyzer_name, backend=None):
+    """
+    The backend an analyzer should use.
+    :param analyzer_name: e.g. 'bert'
+    :type analyzer_name: str
+    :param backend: explicit choice. Defaults to <ANALYZER_NAME>_BACKEND, then to eager.
+    :type backend: str
+    :rtype: str
+    """
+    backend = backend or os.environ.get(f'{analyzer_name.upper()}_BACKEND', 'eager')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}' for {analyzer_name}. Choose from {list(BACKENDS)}")
+    return backend
+
+
+def inference_mode():
+    """
+    torch.inference_mode() where this version of torch has it, otherwise torch.no_grad().
+    """
+    return getattr(torch, 'inference_mode', torch.no_grad)()
+
+
+def quantize(model):
+    """
+    Copy of 'model' in eval mode with its Linear and LSTM layers quantized to int8.
+    Weights are quantized ahead of time and activations on the fly, so no calibration
+    data is needed.
+    :type model: torch.nn.Module
+    :rtype: torch.nn.Module
+    """
+    return torch.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+
+
+def export_dir():
+    """
+    Where exported models are kept: QUANTIZED_MODEL_DIR, or quantized in cache_dir().
+    Not inside a model's own directory, whose fingerprint is its version.
+    :rtype: Path
+    """
+    return pathlib.Path(os.environ.get('QUANTIZED_MODEL_DIR') or cache_dir() / 'quantized')
+
+
+def load_or_trace(model, example_inputs, path):
+    """
+    Load a quantized TorchScript model, quantizing and tracing 'model' first if it
+    has not been exported to 'path' yet. If the export cannot be saved, e.g. to a
+    read-only directory, the traced model is used without it.
+    :param model: eager model. It must return a tuple, e.g. a transformers model loaded with torchscript=True.
+    :type model: torch.nn.Module
+    :param example_inputs: positional inputs to trace with
+    :type example_inputs: tuple
+    :param path: file for the exported model. Name it after the model's version.
+    :type path: Path
+    :rtype: torch.jit.ScriptModule
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        logging.info(f"Exporting quantized model to {path}")
+        with inference_mode():
+            traced = torch.jit.trace(quantize(model), example_inputs, strict=False)
+        try:
+            with staged(path) as staging:
+                torch.jit.save(traced, str(staging))
+        except (OSError, RuntimeError) as e:
+            # torch reports a failed write as a RuntimeError
+            logging.warning(f"Could not save the quantized model to {path}, it will be traced again "
+                            f"next time: {e}")
+            return traced
+    return torch.jit.load(str(path)).eval()
+
+
+def length_buckets(lengths, batch_size):
+    """
+    Group rows of similar length: rows are sorted by length, shortest first, and cut
+    into batches of batch_size.
+    :param lengths: length of each row
+    :type lengths: list of int
+    :type batch_size: int
+    :return: row indices of each batch
+    :rtype: list of numpy.ndarray
+    """
+    order = np.argsort(np.asarray(lengths, dtype=np.int64), kind='stable')
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def pad_rows(sequences, rows, pad_id, width=None):
+    """
+    Token ids and attention mask for some of the sequences, padded to the longest of them.
+    :param sequences: token ids of every row
+    :type sequences: list of list of int
+    :param rows: which rows to take, e.g. one batch from length_buckets()
+    :type rows: numpy.ndarray
+    :param pad_id: id of the padding token
+    :type pad_id: int
+    :param width: pad to this length instead, for models that need a fixed shape
+    :type width: int
+    :return: input ids and attention mask, each of shape (len(rows), width)
+    :rtype: tuple of numpy.ndarray
+    """
+    width = width or max((len(sequences[row]) for row in rows), default=0)
+    input_ids = np.full((len(rows), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+    for i, row in enumerate(rows):
+        sequence = sequences[row][:width]
+        input_ids[i, :len(sequence)] = sequence
+        attention_mask[i, :len(sequence)] = 1
+    return input_ids, attention_mask
+
+
+def agreement(reference, candidate, texts):
+    """
+    Score 'texts' with two analyzers, e.g. the eager and quantized builds of the same model.
+    :param reference: analyzer whose scores are taken as correct
+    :param candidate: analyzer being checked
+    :param texts: sample of titles
+    :type texts: list of str
+    :return: 'max_abs_diff' per score key, and 'label_agreement': the share of texts
+    given the same most likely class by both
+    :rtype: dict
+    """
+    expected = reference.evaluate_batch(list(texts))
+    actual = candidate.evaluate_batch(list(texts))
+    keys = sorted(expected)
+    max_abs_diff = {key: float(np.max(np.abs(np.asarray(expected[key]) - np.asarray(actual[key])), initial=0.0))
+                    for key in keys}
+    expected_labels = np.argmax(np.column_stack([expected[key] for key in keys]), axis=1)
+    actual_labels = np.argmax(np.column_stack([actual[key] for key in keys]), axis=1)
+    label_agreement = float(np.mean(expected_labels == actual_labels)) if len(texts) else 1.0
+    return {'max_abs_diff': max_abs_diff, 'label_agreement': label_agreement}
+
+
+def check_agreement(reference, candidate, texts, max_diff=0.05, min_label_agreement=0.98):
+    """
+    agreement(), raising ValueError if the candidate is too far from the reference.
+    :param max_diff: largest difference allowed in any probability
+    :type max_diff: float
+    :param min_label_agreement: smallest share of texts that must get the same class
+    :type min_label_agreement: float
+    :return: the agreement report
+    :rtype: dict
+    """
+    report = agreement(reference, candidate, texts)
+    logging.info(f"Backend agreement for {candidate.name}: {report}")
+    worst = max(report['max_abs_diff'].values(), default=0.0)
+    if worst > max_diff or report['label_agreement'] < min_label_agreement:
+        raise ValueError(f"{candidate.name} backends disagree: {report}")
+    return report
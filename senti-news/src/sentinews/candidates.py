@@ -0,0 +1,64 @@
+import re
+from bisect import bisect_right
+
+"""
+candidates.py
+---
+Finds which candidate a headline is about.
+All of the candidate names are compiled into one case-insensitive regular expression
+with word boundaries, so a title is scanned once no matter how many candidates there
+are, and names inside other words (e.g. 'yang' in 'Pyongyang') do not count.
+"""
+
+
+class CandidateMatcher:
+
+    def __init__(self, names):
+        """
+        :param names: names to look for, e.g. candidates' last names
+        :type names: list of str
+        """
+        self.names = [name.strip().lower() for name in names if name.strip()]
+        # Longest names first so that a name that is a prefix of another cannot shadow it
+        alternation = '|'.join(re.escape(name) for name in sorted(set(self.names), key=len, reverse=True))
+        self.pattern = re.compile(rf'\b(?:{alternation})\b', re.IGNORECASE)
+
+    def matches(self, title):
+        """
+        Every distinct candidate named in the title.
+        :param title: headline
+        :type title: str
+        :rtype: set of str
+        """
+        return {match.lower() for match in self.pattern.findall(title)}
+
+    def match(self, title):
+        """
+        The candidate the title is about, if it names one and only one candidate.
+        :param title: headline
+        :type title: str
+        :return: lowercase candidate name, or None
+        :rtype: str or None
+        """
+        found = self.matches(title)
+        return found.pop() if len(found) == 1 else None
+
+    def match_many(self, titles):
+        """
+        match() for a whole page of titles in a single scan.
+        The titles are joined into one string and every regex match is mapped back
+        to the title it came from.
+        :param titles: headlines
+        :type titles: list of str
+        :return: candidate name or None for each title, in order
+        :rtype: list
+        """
+        starts = []
+        position = 0
+        for title in titles:
+            starts.append(position)
+            position += len(title) + 1
+        found = [set() for _ in titles]
+        for match in self.pattern.finditer('\n'.join(titles)):
+            found[bisect_right(starts, match.start()) - 1].add(match.group().lower())
+        return [names.pop() if len(names) == 1 else None for names in found]
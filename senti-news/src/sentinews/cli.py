@@ -0,0 +1,149 @@
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from dateutil.parser import isoparse
+
+from sentinews import api_tool
+from sentinews.metrics import serve_metrics
+from sentinews.models import ANALYZER_CLASSES, AnalyzerRegistry
+from sentinews.profiling import profiler_for
+
+"""
+cli.py
+---
+The sentinews command: crawl any of the news sources at the same time, score the
+titles and store them, without any prompts.
+
+    sentinews nyt cnn fox newsapi --days 7 --analyzers vader,textblob --save-type api_bulk
+    sentinews cnn --start 2020-01-01 --end 2020-02-01 --save-type csv
+    sentinews --daemon --interval 60 --mode incremental
+
+Each source runs in its own thread within its own rate limit, see api_tool.crawl_sources().
+With --daemon the crawl is repeated every --interval minutes, each time over the
+--days before it started (or, with --mode incremental and a crawl state, only what
+is new since the last run).
+"""
+
+
+def parse_date(text):
+    """
+    :param text: ISO 8601 date or datetime. Without a timezone it is taken to be UTC.
+    :type text: str
+    :rtype: datetime
+    """
+    date = isoparse(text)
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='sentinews', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', metavar='SOURCE',
+                        help=f"sources to crawl: {', '.join(api_tool.SOURCES)} (default: all)")
+    parser.add_argument('--start', type=parse_date, help='first date to crawl (default: --days before --end)')
+    parser.add_argument('--end', type=parse_date, help='last date to crawl (default: now)')
+    parser.add_argument('--days', type=float, default=7, help='days to crawl when --start is not given')
+    parser.add_argument('--num-steps', type=int, help='time windows per source (default: 3 a day)')
+    parser.add_argument('--analyzers', help=f"comma separated analyzers from {', '.join(ANALYZER_CLASSES)} "
+                                            f"(default: ACTIVE_ANALYZERS)")
+    parser.add_argument('--save-type', default='api', choices=['csv', 'db', 'api', 'api_bulk'],
+                        help='where scored articles go (default: api)')
+    parser.add_argument('--mode', default='full', choices=['full', 'resume', 'incremental'],
+                        help='see BaseNews; resume and incremental keep a crawl state')
+    parser.add_argument('--fetch-mode', default='async', choices=['sync', 'async'])
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight per host in async mode')
+    parser.add_argument('--daemon', action='store_true', help='crawl again every --interval minutes')
+    parser.add_argument('--interval', type=float, default=60, help='minutes between daemon runs')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port')
+    parser.add_argument('--profile', metavar='DIR', help='write a profile of each run to a new directory in DIR')
+    return parser
+
+
+def run_once(args, analyzers):
+    """
+    One crawl of every chosen source over the chosen dates.
+    :return: source name -> articles logged, or the exception that stopped it
+    :rtype: dict
+    """
+    end_date = args.end or datetime.now(tz=timezone.utc)
+    start_date = args.start or end_date - timedelta(days=args.days)
+    if start_date >= end_date:
+        raise ValueError(f"--start ({start_date}) must be before --end ({end_date})")
+    source_classes = [api_tool.SOURCES[name] for name in dict.fromkeys(args.sources or api_tool.SOURCES)]
+    logging.info(f"Crawling {', '.join(cls.__name__ for cls in source_classes)} "
+                 f"from {start_date.isoformat()} to {end_date.isoformat()}")
+    with profiler_for('crawl', args.profile):
+        return api_tool.crawl_sources(source_classes, start_date, end_date,
+                                      num_steps=args.num_steps,
+                                      analyzers=analyzers,
+                                      save_type=args.save_type,
+                                      mode=args.mode,
+                                      fetch_mode=args.fetch_mode,
+                                      concurrency=args.concurrency)
+
+
+def daemon(run, interval, rounds=None, clock=time.monotonic, sleep=time.sleep):
+    """
+    Call run() every 'interval' seconds, measured from the start of each call. A call
+    that takes longer than the interval is followed straight away by the next one.
+    Exceptions are logged and the next call goes ahead.
+    :param run: one round of crawling
+    :type run: callable
+    :param interval: seconds
+    :type interval: float
+    :param rounds: stop after this many calls (default: never)
+    :type rounds: int
+    """
+    done = 0
+    while rounds is None or done < rounds:
+        started = clock()
+        try:
+            run()
+        except Exception:
+            logging.exception("Crawl failed")
+        done += 1
+        if rounds is None or done < rounds:
+            wait = max(interval - (clock() - started), 0)
+            logging.info(f"Next crawl in {wait:.0f}s")
+            sleep(wait)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    args.sources = [name.lower() for name in args.sources]
+    unknown = [name for name in args.sources if name not in api_tool.SOURCES]
+    if unknown:
+        parser.error(f"unknown sources {unknown}, choose from {list(api_tool.SOURCES)}")
+    if args.daemon and (args.start or args.end):
+        parser.error('--daemon crawls the --days before each run, so it cannot take --start or --end')
+    if args.start and args.start >= (args.end or datetime.now(tz=timezone.utc)):
+        parser.error('--start must be before --end')
+    try:
+        analyzers = AnalyzerRegistry(args.analyzers)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+
+    # Built before the sources start, so concurrent sources never load the same model twice
+    analyzers.warmup()
+
+    if args.daemon:
+        try:
+            daemon(lambda: run_once(args, analyzers), args.interval * 60)
+        except KeyboardInterrupt:
+            logging.info("Stopped")
+        return 0
+
+    results = run_once(args, analyzers)
+    for name, result in results.items():
+        print(f"{name}: {'failed: ' + str(result) if isinstance(result, Exception) else f'{result} articles'}")
+    return 1 if any(isinstance(result, Exception) for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+decoding.py
+---
+Turns API responses into Python objects straight from the bytes that came over
+the network. json.loads(response.text) first decodes the whole body into a str,
+and slicing that str to strip a JSONP wrapper copies it again. Here the body is
+parsed as bytes with orjson when it is installed (the standard json module
+otherwise), and a JSONP wrapper is removed with a memoryview, which copies nothing.
+project() then keeps only the fields a source uses, so the rest of each result,
+which can be most of a page, is freed as soon as the page is parsed.
+"""
+
+# A JSONP callback name, e.g. angular.callbacks._0
+_CALLBACK = re.compile(rb'\s*[A-Za-z_$][\w$.]*\s*\(')
+
+
+def loads(data):
+    """
+    Parse JSON from bytes.
+    :param data: JSON text, e.g. response.content
+    :type data: bytes or bytearray or memoryview
+    :rtype: object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        # The json module cannot read a memoryview
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def jsonp_payload(data):
+    """
+    The JSON inside a JSONP response, e.g. the {...} in angular.callbacks._0({...}),
+    as a view of the same bytes. Data without a wrapper is returned whole.
+    :type data: bytes
+    :rtype: memoryview
+    """
+    view = memoryview(data)
+    match = _CALLBACK.match(data)
+    if match is None:
+        return view
+    end = data.rfind(b')')
+    if end < match.end():
+        raise ValueError('JSONP response has no closing parenthesis')
+    return view[match.end():end]
+
+
+def decode_response(response, jsonp=False):
+    """
+    Parse the body of a response.
+    :type response: requests.Response
+    :param jsonp: the body is wrapped in a JSONP callback
+    :type jsonp: bool
+    :rtype: object
+    """
+    data = response.content
+    return loads(jsonp_payload(data) if jsonp else data)
+
+
+def project(records, fields):
+    """
+    Copies of 'records' with only the keys in 'fields'. The values are not copied.
+    :param records: e.g. the articles on a page
+    :type records: list of dict
+    :param fields: keys to keep. None keeps the records as they are.
+    :type fields: tuple of str
+    :rtype: list of dict
+    """
+    if fields is None:
+        return records
+    return [{field: record[field] for field in fields if field in record} for record in records]
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+fetch.py
+---
+Concurrent page fetching for the news sources in api_tool.py.
+Pages are requested in parallel on an asyncio event loop, with a cap on how many
+requests can be open to the same host at once. Every response is handed to a
+callback on the event loop thread as soon as it arrives, so parsing and scoring
+one page overlaps with the network round trips of the others.
+
+Also holds the token bucket used to keep each source inside its API quota and
+the pooled HTTP session shared by every source and the database API sink.
+"""
+
+# (connect, read) timeouts in seconds for every request made through the shared session
+DEFAULT_TIMEOUT = (5, 30)
+# Keep-alive connections kept open per host
+POOL_MAXSIZE = 16
+# Hosts to keep connection pools for (the news APIs plus the database API)
+POOL_CONNECTIONS = 8
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session with a default timeout and larger per-host connection pools.
+    Connections are kept alive and reused between requests, so only the first
+    request to a host pays for the TCP and TLS handshakes. Responses are requested
+    gzip compressed.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_maxsize=POOL_MAXSIZE, pool_connections=POOL_CONNECTIONS):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The PooledSession shared by the whole process, created on first use.
+    :rtype: PooledSession
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = PooledSession()
+        return _session
+
+
+class AsyncFetcher:
+
+    def __init__(self, get, per_host=4, max_workers=None):
+        """
+        :param get: blocking function that takes a url and returns a requests.Response
+        :type get: callable
+        :param per_host: most requests that can be in flight to one host
+        :type per_host: int
+        :param max_workers: threads used to run 'get'. Defaults to 4 times per_host.
+        :type max_workers: int
+        """
+        self.get = get
+        self.per_host = per_host
+        self.max_workers = max_workers or per_host * 4
+
+    def run(self, urls, on_response):
+        """
+        Fetch every url and call on_response(url, response) in completion order.
+        Urls that fail with a requests exception are logged and skipped.
+        :param urls: urls to fetch
+        :type urls: list of str
+        :param on_response: called once per successful request
+        :type on_response: callable
+        :return: number of requests that completed
+        :rtype: int
+        """
+        def on_stream_response(stream, url, response):
+            on_response(url, response)
+            return True
+
+        return self.run_streams([[url] for url in urls], on_stream_response)
+
+    def run_streams(self, streams, on_response):
+        """
+        Fetch several sequences of pages at once.
+        Pages within a stream are requested one after another, because whether to ask
+        for the next page depends on the last one. Different streams run concurrently.
+        on_response(stream, url, response) is called for every page and returns False
+        to stop the rest of that stream.
+        :param streams: each stream is either a list of urls or has a 'urls' attribute
+        :type streams: list
+        :param on_response: called once per successful request
+        :type on_response: callable
+        :return: number of requests that completed
+        :rtype: int
+        """
+        return asyncio.run(self._run_streams(list(streams), on_response))
+
+    async def _run_streams(self, streams, on_response):
+        loop = asyncio.get_running_loop()
+        semaphores = {}
+        completed = 0
+
+        async def fetch(url):
+            host = urlparse(url).netloc
+            semaphore = semaphores.setdefault(host, asyncio.Semaphore(self.per_host))
+            async with semaphore:
+                return await loop.run_in_executor(executor, self.get, url)
+
+        async def follow(stream):
+            nonlocal completed
+            for url in getattr(stream, 'urls', stream):
+                try:
+                    response = await fetch(url)
+                except requests.RequestException as e:
+                    logging.info(f"Request failed: {e}")
+                    continue
+                completed += 1
+                # Runs on the event loop thread, so callbacks never overlap
+                if on_response(stream, url, response) is False:
+                    return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            await asyncio.gather(*(follow(stream) for stream in streams))
+        return completed
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every request a news source makes.
+    Tokens refill continuously at tokens_per_minute, and up to 'burst' of them can be
+    saved up. acquire() blocks until a token is free. It is safe to share across threads.
+    """
+
+    def __init__(self, tokens_per_minute, burst=1, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param tokens_per_minute: sustained request rate
+        :type tokens_per_minute: float
+        :param burst: most requests that can be made back to back
+        :type burst: int
+        :param clock: returns the current time in seconds
+        :param sleep: blocks for the given number of seconds
+        """
+        self.rate = tokens_per_minute / 60
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take one token, waiting for it if necessary.
+        :return: seconds spent waiting
+        :rtype: float
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            self.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """
+        Hold back every request for 'seconds', e.g. after the server answers 429.
+        The bucket is emptied so requests resume at the sustained rate.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = 0
+            self.updated = now
+            self.paused_until = max(self.paused_until, now + seconds)
+
+
+def retry_delay(response, attempt, base=2.0, cap=120.0):
+    """
+    How long to wait before repeating a request that got a 429 response.
+    The Retry-After header is honoured when present (in seconds or as an HTTP date),
+    otherwise the delay is an exponential backoff. Jitter is added to both so that
+    concurrent requests do not retry in lockstep.
+    :param response: the 429 response
+    :type response: requests.Response
+    :param attempt: number of retries already made for this request
+    :type attempt: int
+    :param base: backoff for the first retry, in seconds
+    :param cap: longest backoff, in seconds
+    :return: seconds to wait
+    :rtype: float
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            return max(seconds, 0) + random.uniform(0, base)
+
+    backoff = min(cap, base * 2 ** attempt)
+    return random.uniform(backoff / 2, backoff)
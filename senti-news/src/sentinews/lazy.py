@@ -0,0 +1,46 @@
+import importlib
+import sys
+
+"""
+lazy.py
+---
+Module proxies that delay heavy imports (torch, fastai, transformers, ...)
+until an attribute is first looked up on them.
+"""
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported the first time one of its attributes is used.
+    e.g. torch = LazyModule('torch') can sit at the top of a file and costs nothing
+    until torch.tensor(...) is called.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: full dotted name of the module to import
+        :type name: str
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def is_loaded(self):
+        """
+        True if the module has been imported, by this proxy or by anything else.
+        """
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.is_loaded() else 'not loaded'
+        return f"<LazyModule '{self._name}' ({state})>"
@@ -0,0 +1,278 @@
+import bisect
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sentinews._fs import write_atomic
+
+"""
+metrics.py
+---
+Counters and histograms for every stage of a crawl, so a slow crawl can be traced
+to the network, the rate limit, an analyzer or the sink.
+    sentinews_http_request_seconds          histogram per source: time of each API request
+    sentinews_http_responses_total          per source and status code
+    sentinews_http_response_bytes_total     per source: bytes downloaded
+    sentinews_rate_limit_wait_seconds_total per source: time spent waiting for the rate limiter
+    sentinews_retry_wait_seconds_total      per source: time spent waiting to retry a 429
+    sentinews_page_seconds                  histogram per source: filtering and scoring a page (only
+                                            filtering in a Pipeline, which scores in batches)
+    sentinews_articles_total                per source and outcome: kept, improper_title or already_seen
+    sentinews_analyzer_seconds              histogram per analyzer: scoring one batch of titles
+    sentinews_analyzer_titles_total         per analyzer
+    sentinews_sink_seconds                  histogram per sink: one write to the database, API or csv
+    sentinews_sink_rows_total               per sink and outcome: stored or failed
+Everything is kept in one MetricsRegistry per process, default_metrics. It can be read
+as Prometheus text from METRICS_FILE (rewritten at every checkpoint and at the end
+of a run) or from an HTTP endpoint on METRICS_PORT, and is written as a JSON summary
+to METRICS_SUMMARY at the end of a run.
+Titles scored in worker processes (scoring_processes) are timed in a registry of
+their own, which is sent back with the scores and merged into the parent's.
+"""
+
+# Upper bounds in seconds, like Prometheus' default buckets with longer ones for slow APIs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help)
+METRICS = {
+    'sentinews_http_request_seconds': ('histogram', 'Time of each request to a news API'),
+    'sentinews_http_responses_total': ('counter', 'Responses from the news APIs by status code'),
+    'sentinews_http_response_bytes_total': ('counter', 'Bytes downloaded from the news APIs'),
+    'sentinews_rate_limit_wait_seconds_total': ('counter', 'Time spent waiting for the rate limiter'),
+    'sentinews_retry_wait_seconds_total': ('counter', 'Time spent waiting to retry a 429 response'),
+    'sentinews_page_seconds': ('histogram', 'Time to filter and score one page of results'),
+    'sentinews_articles_total': ('counter', 'Articles on the pages fetched, by what happened to them'),
+    'sentinews_analyzer_seconds': ('histogram', 'Time for an analyzer to score one batch of titles'),
+    'sentinews_analyzer_titles_total': ('counter', 'Titles scored by each analyzer'),
+    'sentinews_sink_seconds': ('histogram', 'Time of one write to the sink'),
+    'sentinews_sink_rows_total': ('counter', 'Rows written to the sink, by outcome'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+
+class MetricsRegistry:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: upper bounds of the histogram buckets
+        :type buckets: tuple of float
+        """
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add to a counter.
+        :param name: key in METRICS
+        :type name: str
+        :param value: amount to add
+        :type value: int or float
+        :param labels: e.g. source='CNN'
+        """
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add a measurement to a histogram.
+        :param name: key in METRICS
+        :type name: str
+        :param value: e.g. seconds
+        :type value: float
+        :param labels: e.g. source='CNN'
+        """
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def value(self, name, **labels):
+        """
+        Current value of a counter, or the count of a histogram. 0 if nothing was recorded.
+        """
+        key = (name, _label_key(labels))
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key].count
+            return self.counters.get(key, 0)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def export(self):
+        """
+        Everything recorded so far, in a form that can be pickled, e.g. to send it from a
+        worker process to the parent's registry with merge().
+        :rtype: dict
+        """
+        with self.lock:
+            return {'buckets': self.buckets, 'counters': dict(self.counters), 'histograms': dict(self.histograms)}
+
+    def merge(self, exported):
+        """
+        Add what another registry recorded, from its export(), to this one.
+        :type exported: dict
+        """
+        if tuple(exported['buckets']) != self.buckets:
+            raise ValueError('Cannot merge histograms with different buckets')
+        with self.lock:
+            for key, value in exported['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, other in exported['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = _Histogram(self.buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, other.counts)]
+                histogram.sum += other.sum
+                histogram.count += other.count
+                histogram.max = max(histogram.max, other.max)
+
+    def to_prometheus(self):
+        """
+        Every metric in the Prometheus text exposition format.
+        :rtype: str
+        """
+        with self.lock:
+            series = {}
+            for (name, key), value in self.counters.items():
+                series.setdefault(name, []).append((key, value))
+            for (name, key), histogram in self.histograms.items():
+                series.setdefault(name, []).append((key, histogram))
+
+            lines = []
+            for name in sorted(series):
+                kind, help_text = METRICS.get(name, ('untyped', ''))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(series[name], key=lambda item: item[0]):
+                    if not isinstance(value, _Histogram):
+                        lines.append(f'{name}{_format_labels(key)} {_format_number(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (float('inf'),), value.counts):
+                        cumulative += count
+                        le = (('le', _format_number(float(bound))),)
+                        lines.append(f'{name}_bucket{_format_labels(key, le)} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {_format_number(value.sum)}')
+                    lines.append(f'{name}_count{_format_labels(key)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Every metric as a dict that can be written as JSON. Counters give their value
+        and histograms their count, sum, mean and max, for each set of labels.
+        :rtype: dict
+        """
+        summary = {}
+        with self.lock:
+            for (name, key), value in sorted(self.counters.items()):
+                summary.setdefault(name, []).append({'labels': dict(key), 'value': value})
+            for (name, key), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                summary.setdefault(name, []).append({'labels': dict(key),
+                                                     'count': histogram.count,
+                                                     'sum': histogram.sum,
+                                                     'mean': histogram.sum / histogram.count,
+                                                     'max': histogram.max})
+        return summary
+
+    def write_prometheus(self, path):
+        """
+        Write to_prometheus() to 'path', replacing the file in one step so that a
+        collector reading it never sees half of it.
+        :type path: str or Path
+        """
+        write_atomic(path, self.to_prometheus())
+
+    def write_summary(self, path, **extra):
+        """
+        Write summary() as JSON to 'path'.
+        :param extra: added at the top level, e.g. source='CNN'
+        """
+        write_atomic(path, json.dumps({**extra, 'metrics': self.summary()}, indent=2, default=str) + '\n')
+
+
+default_metrics = MetricsRegistry()
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def serve_metrics(port, registry=None):
+    """
+    Serve registry.to_prometheus() at /metrics on 'port' from a background thread.
+    Calling it again for the same port does nothing.
+    :param port: 0 for any free port
+    :type port: int
+    :param registry: defaults to default_metrics
+    :type registry: MetricsRegistry
+    :return: the server; its port is server.server_address[1]
+    :rtype: ThreadingHTTPServer
+    """
+    registry = registry if registry is not None else default_metrics
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _servers_lock:
+        if port and port in _servers:
+            return _servers[port]
+        server = ThreadingHTTPServer(('', port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        _servers[port or server.server_address[1]] = server
+    logging.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
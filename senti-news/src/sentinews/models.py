@@ -1,16 +1,27 @@
 import pathlib
 import logging
 import os
+import threading
+import time
 
-import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
-from textblob import TextBlob
-from textblob.sentiments import NaiveBayesAnalyzer
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from fastai.text import *
 
-from transformers import BertTokenizer, BertForSequenceClassification
-import torch
+from sentinews import locate_lstm_pkl, package_version
+from sentinews.backends import (backend_for, export_dir, inference_mode, length_buckets, load_or_trace, pad_rows,
+                                quantize)
+from sentinews.lazy import LazyModule
+from sentinews.metrics import default_metrics
+from sentinews.naive_bayes import NaiveBayesTable, title_tokens
+from sentinews.profiling import active_profiler
+from sentinews.score_cache import file_fingerprint
+
+# Each backend is only imported when its analyzer is built, so a process
+# that only uses VADER never pays for importing torch or fastai.
+vader_sentiment = LazyModule('vaderSentiment.vaderSentiment')
+fastai_text = LazyModule('fastai.text')
+transformers = LazyModule('transformers')
+torch = LazyModule('torch')
 
 
 """
@@ -34,8 +45,10 @@ logging.basicConfig(level=logging.INFO)
 class TextBlobAnalyzer:
 
     def __init__(self):
-        self.nb = NaiveBayesAnalyzer()
+        # TextBlob's NaiveBayesAnalyzer, trained once and saved as a table, see naive_bayes.py
+        self.table = NaiveBayesTable.load_or_train()
         self.name = 'textblob'
+        self.version = package_version('textblob')
 
     def evaluate(self, text):
         """
@@ -46,12 +59,19 @@ class TextBlobAnalyzer:
         p_pos and p_neg are the probabilities of those classifications.
         :rtype: dict
         """
+        return _first_row(self.evaluate_batch([text]))
 
-        sentiment = TextBlob(text, analyzer=self.nb).sentiment
-        return {
-            'p_pos': round(sentiment.p_pos, 3),
-            'p_neg': round(sentiment.p_neg, 3)
-        }
+    def evaluate_batch(self, texts):
+        """
+        Gives the sentiment scores for many texts at once.
+        :param texts: Texts to be scored for sentiment
+        :type texts: list of str
+        :return: dictionary with one array per score key, in the same order as texts
+        :rtype: dict
+        """
+        probabilities = self.table.probabilities([title_tokens(text) for text in texts])
+        labels = self.table.labels
+        return {f'p_{label}': _rounded(probabilities[:, labels.index(label)]) for label in ('pos', 'neg')}
 
 
 class VaderAnalyzer:
@@ -60,8 +80,9 @@ class VaderAnalyzer:
     """
 
     def __init__(self):
-        self.analyzer = SentimentIntensityAnalyzer()
+        self.analyzer = vader_sentiment.SentimentIntensityAnalyzer()
         self.name = 'vader'
+        self.version = package_version('vaderSentiment')
 
     def evaluate(self, text):
         """
@@ -81,8 +102,42 @@ class VaderAnalyzer:
             'compound': score['compound']
         }
 
+    def evaluate_batch(self, texts):
+        """
+        Gives the sentiment scores for many texts at once.
+        :param texts: Texts to be scored for sentiment
+        :type texts: list of str
+        :return: dictionary with one array per score key, in the same order as texts
+        :rtype: dict
+        """
+        return _columns([self.evaluate(text) for text in texts], ('p_pos', 'p_neg', 'p_neu', 'compound'))
 
-def analyze_title(analyzer_iter, text):
+
+def _columns(rows, keys):
+    """
+    Turn a list of score dicts into a dict of arrays, one per score key.
+    """
+    return {key: np.array([row[key] for row in rows], dtype=np.float64) for key in keys}
+
+
+def _rounded(probabilities):
+    """
+    Probabilities rounded to 3 places the way the single-title paths round them:
+    round() on each value as a Python float. np.round() on float32 model outputs
+    leaves values such as 0.33300000429 once they are turned into floats.
+    :rtype: numpy.ndarray of float64
+    """
+    return np.array([round(p, 3) for p in np.asarray(probabilities, dtype=np.float64).tolist()], dtype=np.float64)
+
+
+def _first_row(scores):
+    """
+    The scores of the first text from evaluate_batch(), as Python floats like evaluate() gives.
+    """
+    return {key: float(column[0]) for key, column in scores.items()}
+
+
+def analyze_title(analyzer_iter, text, cache=None, metrics=None):
     """
     Pass an iterable of analyzers to have each evaluate the passed text.
     Returns the scores in a dict of dicts
@@ -90,40 +145,107 @@ def analyze_title(analyzer_iter, text):
     :type text: str
     :param analyzer_iter: initialized Vader/TextBlob/LSTM Analyzer
     :type analyzer_iter: VaderAnalyzer, TextBlobAnalyzer, LSTMAnalyzer
+    :param cache: scores are looked up here before running the analyzers
+    :type cache: sentinews.score_cache.ScoreCache
+    :param metrics: where each analyzer's time is recorded. Defaults to default_metrics.
+    :type metrics: sentinews.metrics.MetricsRegistry
     :return: dictionary of dictionaries. Each sub-dictionary is a dictionary
     from each analyzer's evaluate() method.
     :rtype: dict
     """
+    metrics = metrics if metrics is not None else default_metrics
+    all_scores = {}
+    for func in analyzer_iter:
+        start = time.perf_counter()
+        scores = func.evaluate(text) if cache is None else cache.evaluate(func, text)
+        _record_scoring(metrics, func, 1, time.perf_counter() - start)
+        for key in scores:
+            all_scores[func.name + '_' + key] = scores[key]
+    return all_scores
+
+
+def analyze_titles(analyzer_iter, titles, cache=None, metrics=None):
+    """
+    Batched version of analyze_title.
+    Each analyzer scores all of the titles in one evaluate_batch() call.
+    :param titles: texts to get sentiment from
+    :type titles: list of str
+    :param analyzer_iter: initialized Vader/TextBlob/LSTM/BERT Analyzer
+    :type analyzer_iter: VaderAnalyzer, TextBlobAnalyzer, LSTMAnalyzer, BERTAnalyzer
+    :param cache: scores are looked up here and only uncached titles are evaluated
+    :type cache: sentinews.score_cache.ScoreCache
+    :param metrics: where each analyzer's time is recorded. Defaults to default_metrics.
+    :type metrics: sentinews.metrics.MetricsRegistry
+    :return: dictionary of arrays keyed like analyze_title(). Row i of every
+    array belongs to titles[i].
+    :rtype: dict
+    """
+    metrics = metrics if metrics is not None else default_metrics
+    titles = list(titles)
     all_scores = {}
     for func in analyzer_iter:
-        scores = func.evaluate(text)
+        if not titles:
+            scores = {}
+        else:
+            start = time.perf_counter()
+            scores = func.evaluate_batch(titles) if cache is None else cache.evaluate_batch(func, titles)
+            _record_scoring(metrics, func, len(titles), time.perf_counter() - start)
         for key in scores:
             all_scores[func.name + '_' + key] = scores[key]
     return all_scores
 
 
+def _record_scoring(metrics, analyzer, n_titles, seconds):
+    # Includes cache lookups, so a well cached analyzer looks fast
+    name = getattr(analyzer, 'name', type(analyzer).__name__)
+    metrics.observe('sentinews_analyzer_seconds', seconds, analyzer=name)
+    metrics.inc('sentinews_analyzer_titles_total', n_titles, analyzer=name)
+
+
 class LSTMAnalyzer:
 
-    def __init__(self, model_dir=None, model_name=None):
+    def __init__(self, model_dir=None, model_name=None, backend=None):
         """
         Load a fastai.Learner object that was made by export()
         :param model_dir: Directory that holds saved model
         :type model_dir: str or Path
         :param model_name: Name of model to load
         :type model_name: str
+        :param backend: eager or quantized, see backends.py. Defaults to LSTM_BACKEND.
+        :type backend: str
         """
+        self.backend = backend_for('lstm', backend)
+        # evaluate_batch() loads its titles as the Learner's test set, which threads
+        # scoring at the same time (e.g. backfill() windows) would replace under each other
+        self.lock = threading.Lock()
         if model_dir and model_name:
             self.model_dir = pathlib.Path(model_dir)
             self.model_name = model_name
         else:
+            locate_lstm_pkl()
             self.model_dir = pathlib.Path(os.environ.get("LSTM_PKL_MODEL_DIR"))
             self.model_name = os.environ.get('LSTM_PKL_FILENAME')
         try:
-            self.model = load_learner(self.model_dir, self.model_name)
+            self.model = fastai_text.load_learner(self.model_dir, self.model_name)
+            if self.backend == 'quantized':
+                # fastai's AWD_LSTM keeps Python-side hidden state and weight dropout
+                # hooks, so it is quantized in place rather than exported
+                self.model.model = quantize(self.model.model)
         except BaseException as e:
             logging.info("Failed to load LSTM model. " + str(e))
 
         self.name = 'lstm'
+        # Changes whenever the model file is replaced, which invalidates cached scores
+        self.version = file_fingerprint(self.model_dir / self.model_name)
+        if self.backend != 'eager':
+            self.version += f'-{self.backend}'
+
+    def options(self):
+        """
+        Arguments that build the same analyzer again, e.g. in a scoring worker process.
+        :rtype: dict
+        """
+        return {'model_dir': str(self.model_dir), 'model_name': self.model_name, 'backend': self.backend}
 
     def train(self, language_model=None, classifier_model=None):
 
@@ -145,21 +267,21 @@ class LSTMAnalyzer:
         # TextLMDataBunch can be used to train a language model
         # Save time by loading pre-existing DataBunch if one exists
         if language_model and (model_dir / language_model).isfile():
-            data_lm = load_data(model_dir, language_model)
+            data_lm = fastai_text.load_data(model_dir, language_model)
         else:
             # Create DataBunch from csv
-            data_lm = TextLMDataBunch.from_csv(data_dir, 'LM-news-data.csv')
+            data_lm = fastai_text.TextLMDataBunch.from_csv(data_dir, 'LM-news-data.csv')
 
         # TextClasDataBunch can be used to train a classifier
         # Save time by loading pre-existing DataBunch if one exists
         if classifier_model and (model_dir / classifier_model).isfile():
-            data_clf = load_data(model_dir, classifier_model, bs=16)
+            data_clf = fastai_text.load_data(model_dir, classifier_model, bs=16)
         else:
             # Create DataBunch from csv
-            data_clf = TextClasDataBunch.from_csv(data_dir, labeled_titles_data, vocab=data_lm.train_ds.vocab, bs=32)
+            data_clf = fastai_text.TextClasDataBunch.from_csv(data_dir, labeled_titles_data, vocab=data_lm.train_ds.vocab, bs=32)
 
         # Training the language model
-        learn_news = language_model_learner(data_lm, AWD_LSTM, drop_mult=0.5)
+        learn_news = fastai_text.language_model_learner(data_lm, fastai_text.AWD_LSTM, drop_mult=0.5)
         # Train using one cycle policy (search for leslie smith)
         learn_news.fit_one_cycle(1, 1e-2)
 
@@ -171,7 +293,7 @@ class LSTMAnalyzer:
         learn_news.save_encoder(data_dir / 'ft_enc_news')
 
         # Use TextClasDataBunch created earlier to train a classifier
-        learn_news = text_classifier_learner(data_clf, AWD_LSTM, drop_mult=0.5)
+        learn_news = fastai_text.text_classifier_learner(data_clf, fastai_text.AWD_LSTM, drop_mult=0.5)
         learn_news.load_encoder(data_dir / 'ft_enc_news')
 
         # Training classifier
@@ -205,29 +327,72 @@ class LSTMAnalyzer:
             'p_neg': round(float(prob_tensor[0]), 3)
         }
 
+    def evaluate_batch(self, texts):
+        """
+        Gives the sentiment scores for many texts with batched forward passes
+        instead of one Learner.predict() call per text.
+        :param texts: Texts to be scored for sentiment
+        :type texts: list of str
+        :return: dictionary with one array per score key, in the same order as texts
+        :rtype: dict
+        """
+        with self.lock:
+            self.model.data.add_test(list(texts))
+            # ordered=True undoes the length sorting done by the text DataLoader
+            with inference_mode():
+                prob_tensor, _ = self.model.get_preds(ds_type=fastai_text.DatasetType.Test, ordered=True)
+        probs = prob_tensor.numpy()
+
+        return {
+            'p_pos': _rounded(probs[:, 2]),
+            'p_neu': _rounded(probs[:, 1]),
+            'p_neg': _rounded(probs[:, 0]),
+        }
+
 
 class BERTAnalyzer:
 
-    def __init__(self, model_dir=None):
+    # Longest title, in word pieces, that the model sees
+    MAX_LENGTH = 25
+    # Titles per forward pass
+    BATCH_SIZE = 64
+
+    def __init__(self, model_dir=None, backend=None):
         """
         Load a BertForSequenceClassification Model from transformers
         :param model_dir: Directory that holds saved model
         :type model_dir: str or Path
-        :param model_name: Name of model to load
-        :type model_name: str
+        :param backend: eager or quantized, see backends.py. Defaults to BERT_BACKEND.
+        :type backend: str
         """
+        self.backend = backend_for('bert', backend)
         if model_dir:
             self.model_dir = pathlib.Path(model_dir)
         else:
             self.model_dir = pathlib.Path(os.environ.get("BERT_PKL_MODEL_DIR"))
+        self.name = 'bert'
+        # Changes whenever the model files are replaced, which invalidates cached scores
+        self.version = file_fingerprint(self.model_dir)
+        if self.backend != 'eager':
+            self.version += f'-{self.backend}'
         try:
-            self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-            self.model = BertForSequenceClassification.from_pretrained(self.model_dir)
+            # The Rust tokenizer encodes a whole list of titles in one call
+            self.tokenizer = transformers.BertTokenizerFast.from_pretrained('bert-base-uncased')
+            # torchscript=True makes the model return plain tuples, which tracing needs
+            self.model = transformers.BertForSequenceClassification.from_pretrained(
+                self.model_dir, torchscript=self.backend == 'quantized').eval()
+            if self.backend == 'quantized':
+                example = torch.ones((1, self.MAX_LENGTH), dtype=torch.int64)
+                self.model = load_or_trace(self.model, (example, example), export_dir() / f'bert-{self.version}.pt')
         except BaseException as e:
-            logging.info("Failed to load LSTM model. " + str(e))
-
-        self.name = 'bert'
+            logging.info("Failed to load BERT model. " + str(e))
 
+    def options(self):
+        """
+        Arguments that build the same analyzer again, e.g. in a scoring worker process.
+        :rtype: dict
+        """
+        return {'model_dir': str(self.model_dir), 'backend': self.backend}
 
     def evaluate(self, text):
         """
@@ -238,18 +403,130 @@ class BERTAnalyzer:
         'p_pos', 'p_neg', 'p_neu' are the probabilities of those classifications.
         :rtype: dict
         """
-        # Other variables returned are unnecessary
-        max_length = 25
-        encodings = self.tokenizer.encode_plus(text, add_special_tokens=True,
-                                            max_length=max_length,
-                                          pad_to_max_length=True)
-        input_tokens = torch.tensor([e['input_ids'] for e in encodings], dtype=torch.int64)
-        attn_masks = torch.tensor([e['attention_mask'] for e in encodings], dtype=torch.int64)
-        y_labels = torch.tensor([1], dtype=torch.int64, requires_grad=False)
-        loss, pred = self.model(input_ids=input_tokens, attention_mask=attn_masks, labels=y_labels)
+        return _first_row(self.evaluate_batch([text]))
+
+    def evaluate_batch(self, texts):
+        """
+        Gives the sentiment scores for many texts.
+        The titles are tokenized in one call, then sorted by length and run BATCH_SIZE
+        at a time, each batch padded only to its own longest title.
+        :param texts: Texts to be scored for sentiment
+        :type texts: list of str
+        :return: dictionary with one array per score key, in the same order as texts
+        :rtype: dict
+        """
+        texts = list(texts)
+        # Without truncation=True, max_length only warns and long titles come back whole
+        sequences = self.tokenizer.batch_encode_plus(texts, add_special_tokens=True, truncation=True,
+                                                     max_length=self.MAX_LENGTH)['input_ids']
+        # The traced model was exported at MAX_LENGTH, so it keeps that width
+        width = self.MAX_LENGTH if self.backend == 'quantized' else None
+        probs = np.zeros((len(texts), 3), dtype=np.float32)
+        for rows in length_buckets([len(sequence) for sequence in sequences], self.BATCH_SIZE):
+            input_ids, attention_mask = pad_rows(sequences, rows, self.tokenizer.pad_token_id, width)
+            with inference_mode():
+                # Positional, so the same call works for the eager and traced models
+                logits = self.model(torch.from_numpy(input_ids), torch.from_numpy(attention_mask))[0]
+            probs[rows] = torch.softmax(logits, dim=-1).numpy()
 
         return {
-            'p_pos': round(pred[2].item(), 3),
-            'p_neu': round(pred[1].item(), 3),
-            'p_neg': round(pred[0].item(), 3)
-        }
\ No newline at end of file
+            'p_pos': _rounded(probs[:, 2]),
+            'p_neu': _rounded(probs[:, 1]),
+            'p_neg': _rounded(probs[:, 0]),
+        }
+
+
+# Analyzers that can be turned on by name, e.g. ACTIVE_ANALYZERS=vader,textblob,lstm
+ANALYZER_CLASSES = {
+    'vader': VaderAnalyzer,
+    'textblob': TextBlobAnalyzer,
+    'lstm': LSTMAnalyzer,
+    'bert': BERTAnalyzer,
+}
+DEFAULT_ANALYZERS = 'vader,textblob,lstm'
+
+
+class AnalyzerRegistry:
+    """
+    Holds the active analyzers and only builds each one the first time it is needed.
+    Iterating over the registry builds and yields the active analyzers, so it can be
+    passed anywhere a list of analyzers is expected (e.g. analyze_titles()).
+    """
+
+    def __init__(self, names=None, options=None):
+        """
+        :param names: analyzer names to use. Defaults to the comma separated
+        ACTIVE_ANALYZERS environment variable, then to DEFAULT_ANALYZERS.
+        :type names: list of str or str
+        :param options: name -> keyword arguments to build that analyzer with, e.g.
+        {'bert': {'backend': 'quantized'}}
+        :type options: dict
+        """
+        if names is None:
+            names = os.environ.get('ACTIVE_ANALYZERS', DEFAULT_ANALYZERS)
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(',') if name.strip()]
+        unknown = [name for name in names if name not in ANALYZER_CLASSES]
+        if unknown:
+            raise ValueError(f"Unknown analyzers: {unknown}. Choose from {list(ANALYZER_CLASSES)}")
+        self.names = list(names)
+        self.options = dict(options or {})
+        self._loaded = {}
+        # Threads that ask for the same analyzer at once wait for one load
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Return the analyzer called 'name', building it on first use.
+        :param name: key in ANALYZER_CLASSES
+        :type name: str
+        """
+        if name not in self._loaded:
+            with self._lock:
+                if name not in self._loaded:
+                    logging.info(f"Loading {name} analyzer...")
+                    self._loaded[name] = ANALYZER_CLASSES[name](**self.options.get(name, {}))
+                    # Loading a model is where most of an analyzer's memory goes
+                    active_profiler().stage(f'loaded {name}')
+        return self._loaded[name]
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def warmup(self):
+        """
+        Build every active analyzer now instead of on first use.
+        :return: the registry
+        :rtype: AnalyzerRegistry
+        """
+        for name in self.names:
+            self.get(name)
+        return self
+
+    def __iter__(self):
+        return (self.get(name) for name in self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def analyzer_specs(analyzers):
+    """
+    Names and constructor arguments that build the same analyzers again in another
+    process, so a model directory or backend chosen for them is not lost.
+    :param analyzers: an AnalyzerRegistry, or analyzers that were already built
+    :type analyzers: AnalyzerRegistry or list
+    :return: names and name -> keyword arguments, as taken by AnalyzerRegistry
+    :rtype: tuple
+    """
+    if isinstance(analyzers, AnalyzerRegistry):
+        return list(analyzers.names), dict(analyzers.options)
+    names, options = [], {}
+    for analyzer in analyzers:
+        if analyzer.name not in ANALYZER_CLASSES:
+            raise ValueError(f"Analyzer '{analyzer.name}' cannot be built in another process. "
+                             f"Choose from {list(ANALYZER_CLASSES)}")
+        names.append(analyzer.name)
+        if hasattr(analyzer, 'options'):
+            options[analyzer.name] = analyzer.options()
+    return names, options
@@ -0,0 +1,202 @@
+import json
+import logging
+import math
+import os
+import pathlib
+import shutil
+
+import numpy as np
+
+from sentinews import cache_dir, package_version
+from sentinews._fs import staged
+from sentinews.lazy import LazyModule
+
+textblob_sentiments = LazyModule('textblob.sentiments')
+textblob_tokenizers = LazyModule('textblob.tokenizers')
+
+"""
+naive_bayes.py
+---
+Scores titles with TextBlob's NaiveBayesAnalyzer without retraining it in every process.
+The trained NLTK classifier comes down to one number per word and label:
+log2 P(word is present | label). Those are saved once as a numpy table next to the
+vocabulary and memory-mapped when they are loaded again. Scoring a batch of titles
+looks up the rows of their words and adds them up in one numpy call. The sums run in
+the same order as NLTK's, so the scores are exactly the same as NaiveBayesAnalyzer's.
+"""
+
+# Same cut-off as nltk.probability.add_logs
+_ADD_LOGS_MAX_DIFF = math.log(1e-30, 2)
+
+
+def title_tokens(text):
+    """
+    The words NaiveBayesAnalyzer.analyze() looks at: no punctuation, lowercase,
+    at least 3 characters long.
+    :param text: title
+    :type text: str
+    :rtype: list of str
+    """
+    tokens = textblob_tokenizers.word_tokenize(text, include_punc=False)
+    return [token.lower() for token in tokens if len(token) >= 3]
+
+
+def _add_logs(logx, logy):
+    if logx < logy + _ADD_LOGS_MAX_DIFF:
+        return logy
+    if logy < logx + _ADD_LOGS_MAX_DIFF:
+        return logx
+    base = min(logx, logy)
+    return base + math.log(2 ** (logx - base) + 2 ** (logy - base), 2)
+
+
+def _normalize(logprobs):
+    # Same arithmetic as nltk.probability.DictionaryProbDist(normalize=True, log=True)
+    total = logprobs[0]
+    for logprob in logprobs[1:]:
+        total = _add_logs(total, logprob)
+    return [2 ** (logprob - total) for logprob in logprobs]
+
+
+class NaiveBayesTable:
+
+    def __init__(self, labels, priors, vocabulary, logprobs):
+        """
+        :param labels: class labels, in the order the classifier lists them
+        :type labels: list of str
+        :param priors: log2 P(label) for each label
+        :type priors: list of float
+        :param vocabulary: every word the classifier was trained on
+        :type vocabulary: list of str
+        :param logprobs: log2 P(word is present | label), one row per word and then a row of zeros
+        :type logprobs: numpy.ndarray
+        """
+        self.labels = list(labels)
+        self.priors = np.asarray(priors, dtype=np.float64)
+        self.vocabulary = vocabulary
+        self.index = {word: i for i, word in enumerate(vocabulary)}
+        self.logprobs = logprobs
+        # Row of zeros that pads short titles in a batch
+        self.padding = len(vocabulary)
+
+    @classmethod
+    def from_classifier(cls, classifier):
+        """
+        Read the table out of a trained classifier.
+        :param classifier: trained with features of the form {word: True}
+        :type classifier: nltk.classify.NaiveBayesClassifier
+        :rtype: NaiveBayesTable
+        """
+        labels = classifier.labels()
+        vocabulary = sorted({fname for _, fname in classifier._feature_probdist})
+        logprobs = np.zeros((len(vocabulary) + 1, len(labels)), dtype=np.float64)
+        for i, word in enumerate(vocabulary):
+            for j, label in enumerate(labels):
+                logprobs[i, j] = classifier._feature_probdist[label, word].logprob(True)
+        priors = [classifier._label_probdist.logprob(label) for label in labels]
+        return cls(labels, priors, vocabulary, logprobs)
+
+    @classmethod
+    def train(cls):
+        """
+        Train TextBlob's NaiveBayesAnalyzer on the NLTK movie_reviews corpus and read its table.
+        :rtype: NaiveBayesTable
+        """
+        analyzer = textblob_sentiments.NaiveBayesAnalyzer()
+        analyzer.train()
+        return cls.from_classifier(analyzer._classifier)
+
+    def save(self, path):
+        """
+        Write the table to the directory 'path'. The directory is replaced in one step,
+        so processes loading it at the same time never see half of it.
+        :type path: str or Path
+        """
+        path = pathlib.Path(path)
+        with staged(path, directory=True) as staging:
+            np.save(staging / 'logprobs.npy', np.asarray(self.logprobs))
+            with open(staging / 'vocabulary.json', 'w', encoding='utf-8') as f:
+                json.dump(self.vocabulary, f)
+            with open(staging / 'meta.json', 'w') as f:
+                json.dump({'labels': self.labels, 'priors': self.priors.tolist(),
+                           'textblob_version': package_version('textblob')}, f)
+            if (path / 'meta.json').exists():
+                # Out of date table
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a saved table, memory-mapping the log probabilities.
+        :type path: str or Path
+        :rtype: NaiveBayesTable
+        """
+        path = pathlib.Path(path)
+        with open(path / 'meta.json') as f:
+            meta = json.load(f)
+        with open(path / 'vocabulary.json', encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        logprobs = np.load(path / 'logprobs.npy', mmap_mode='r')
+        return cls(meta['labels'], meta['priors'], vocabulary, logprobs)
+
+    @classmethod
+    def load_or_train(cls, path=None):
+        """
+        Load the saved table, training and saving it first if there is none
+        or it was made with another version of textblob.
+        If it cannot be saved, e.g. to a read-only directory, the trained table is still returned.
+        :param path: table directory. Defaults to TEXTBLOB_NB_DIR, then to textblob_nb in cache_dir().
+        :type path: str or Path
+        :rtype: NaiveBayesTable
+        """
+        path = pathlib.Path(path or os.environ.get('TEXTBLOB_NB_DIR') or cache_dir() / 'textblob_nb')
+        try:
+            with open(path / 'meta.json') as f:
+                if json.load(f).get('textblob_version') == package_version('textblob'):
+                    return cls.load(path)
+        except (OSError, ValueError):
+            pass
+        logging.info(f"Training the TextBlob NaiveBayes table, saving it to {path}")
+        table = cls.train()
+        try:
+            table.save(path)
+        except OSError as e:
+            logging.warning(f"Could not save the TextBlob NaiveBayes table to {path}, it will be trained again "
+                            f"next time: {e}")
+        return table
+
+    def log_scores(self, token_lists):
+        """
+        log2 P(label) + the sum of log2 P(word | label) over the distinct known words of each title.
+        Words are added left to right like NaiveBayesClassifier.prob_classify(), so the
+        sums are bit for bit the same.
+        :param token_lists: words of each title, e.g. from title_tokens()
+        :type token_lists: list of list of str
+        :return: one row per title, one column per label
+        :rtype: numpy.ndarray
+        """
+        rows = []
+        for tokens in token_lists:
+            # A word counts once, in the order it first appears
+            rows.append([self.index[word] for word in dict.fromkeys(tokens) if word in self.index])
+        width = max(map(len, rows), default=0)
+        indices = np.full((len(rows), width), self.padding, dtype=np.int64)
+        for i, row in enumerate(rows):
+            indices[i, :len(row)] = row
+
+        terms = np.empty((len(rows), width + 1, len(self.labels)), dtype=np.float64)
+        terms[:, 0] = self.priors
+        terms[:, 1:] = self.logprobs[indices]
+        # cumsum adds in order, unlike sum(), and the padding zeros leave the total unchanged
+        return np.cumsum(terms, axis=1)[:, -1]
+
+    def probabilities(self, token_lists):
+        """
+        P(label | words) for each title.
+        :param token_lists: words of each title
+        :type token_lists: list of list of str
+        :return: one row per title, one column per label
+        :rtype: numpy.ndarray
+        """
+        return np.array([_normalize(row) for row in self.log_scores(token_lists).tolist()],
+                        dtype=np.float64).reshape(len(token_lists), len(self.labels))
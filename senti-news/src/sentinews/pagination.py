@@ -0,0 +1,102 @@
+import logging
+from collections import namedtuple
+from datetime import timezone
+
+from dateutil.parser import isoparse
+
+"""
+pagination.py
+---
+Decides when to stop paging through a query's results.
+Each candidate (and time window) is a PageStream: the urls of its pages, in order,
+and the start of the window it covers. After every page the PaginationController
+looks at what came back and stops the stream early if the rest of its pages
+would not be useful.
+"""
+
+# urls: page urls in the order they should be requested
+# start_date: start of the time window, results older than this are not wanted
+# label: name for logging, e.g. the candidate
+# end_date: end of the time window, if the query has one
+# first_page: page number of urls[0], for a stream that resumes part-way through
+PageStream = namedtuple('PageStream', ['urls', 'start_date', 'label', 'end_date', 'first_page'],
+                        defaults=(None, 0))
+
+
+class PaginationController:
+
+    def __init__(self, page_size, stop_on_short_page=True, stop_when_all_seen=True,
+                 stop_before_start_date=True):
+        """
+        :param page_size: results on a full page
+        :type page_size: int
+        :param stop_on_short_page: stop after a page with fewer than page_size results
+        :type stop_on_short_page: bool
+        :param stop_when_all_seen: stop after a page where every url was already stored
+        :type stop_when_all_seen: bool
+        :param stop_before_start_date: stop after a page whose oldest result is older
+        than the stream's start_date. Results are assumed to be sorted newest first.
+        :type stop_before_start_date: bool
+        """
+        self.page_size = page_size
+        self.stop_on_short_page = stop_on_short_page
+        self.stop_when_all_seen = stop_when_all_seen
+        self.stop_before_start_date = stop_before_start_date
+        self.stopped = {}  # reason -> number of streams stopped for it
+
+    def stop_reason(self, stream, n_results, n_seen, oldest_date):
+        """
+        Why the stream should stop after this page, or None to keep going.
+        :param stream: stream the page belongs to
+        :type stream: PageStream
+        :param n_results: results on the page
+        :type n_results: int
+        :param n_seen: results whose url was already stored
+        :type n_seen: int
+        :param oldest_date: publish date of the last (oldest) result, as a string or datetime
+        :type oldest_date: str or datetime or None
+        :rtype: str or None
+        """
+        reason = None
+        if n_results == 0:
+            reason = 'empty page'
+        elif self.stop_on_short_page and n_results < self.page_size:
+            reason = 'short page'
+        elif self.stop_when_all_seen and n_seen == n_results:
+            reason = 'all results already seen'
+        elif self.stop_before_start_date and stream.start_date is not None and oldest_date is not None:
+            oldest = as_datetime(oldest_date)
+            if oldest is not None and oldest < _aware(stream.start_date):
+                reason = 'older than start date'
+
+        if reason is not None:
+            self.record(stream, reason)
+        return reason
+
+    def record(self, stream, reason):
+        """
+        Count a stream that was stopped, for reasons a source decides itself.
+        """
+        self.stopped[reason] = self.stopped.get(reason, 0) + 1
+        logging.info(f"Stopping {stream.label}: {reason}")
+
+
+def _aware(dt):
+    # Dates without a timezone are taken to be UTC
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def as_datetime(value):
+    """
+    Parse an API date string. Dates without a timezone are taken to be UTC.
+    :param value: ISO 8601 string or datetime
+    :type value: str or datetime
+    :return: timezone aware datetime, or None if the string is not a date
+    :rtype: datetime or None
+    """
+    if isinstance(value, str):
+        try:
+            value = isoparse(value)
+        except ValueError:
+            return None
+    return _aware(value)
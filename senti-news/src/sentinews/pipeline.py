@@ -0,0 +1,207 @@
+import logging
+import queue
+import threading
+import time
+
+from sentinews.models import analyze_titles
+from sentinews.profiling import profiler_for
+
+"""
+pipeline.py
+---
+Streaming version of BaseNews.start(): source -> filter -> score -> sink.
+Every stage is a generator that pulls from the one before it, so articles flow
+through one batch at a time instead of being collected until the end of the crawl.
+bounded() runs a stage in its own thread behind a small queue. When a stage falls
+behind, the queue in front of it fills up and the stages before it wait, so memory
+use stays flat however long the crawl is.
+
+    from sentinews.pipeline import Pipeline
+    Pipeline(CNN(start_date=start_date, end_date=end_date, num_steps=1)).run()
+
+Any BaseNews source works, including new ones: a source only has to implement
+crawl() (or build_streams()) and extract_information() to get batching, concurrent
+fetching and back-pressure. The pipeline does its own scoring, in a thread, so it
+does not take a source built with scoring_processes.
+"""
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """
+    Raised inside a producer when the stage consuming its output has stopped.
+    """
+
+
+class _Failure:
+    # Carries an exception from a producer thread to the consumer
+    def __init__(self, error):
+        self.error = error
+
+
+def callback_stream(run, maxsize=4, name='pipeline-stage'):
+    """
+    Turn a function that reports results through a callback, like BaseNews.crawl(),
+    into a generator. run(emit) is called in a background thread and every emit(item)
+    blocks while maxsize items are waiting to be consumed. Exceptions in run are
+    re-raised in the consumer.
+    :param run: called once with the emit function
+    :type run: callable
+    :param maxsize: items buffered between the producer and the consumer
+    :type maxsize: int
+    :param name: thread name, for debugging
+    :type name: str
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def emit(item):
+        # Give up if the consumer has gone away instead of blocking forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped(name)
+
+    def produce():
+        try:
+            run(emit)
+            emit(_DONE)
+        except PipelineStopped:
+            return
+        except BaseException as e:
+            try:
+                emit(_Failure(e))
+            except PipelineStopped:
+                return
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def bounded(iterable, maxsize=4, name='pipeline-stage'):
+    """
+    Iterate over 'iterable' in a background thread, holding at most maxsize items
+    that the consumer has not taken yet.
+    :param iterable: stage to run in the background
+    :type iterable: iterable
+    """
+    def run(emit):
+        for item in iterable:
+            emit(item)
+
+    return callback_stream(run, maxsize=maxsize, name=name)
+
+
+def pages(source, maxsize=4):
+    """
+    Source stage: the raw articles of each page the source fetches.
+    :param source: news source
+    :type source: sentinews.api_tool.BaseNews
+    """
+    return callback_stream(source.crawl, maxsize=maxsize, name=f'{type(source).__name__}-fetch')
+
+
+def filtered(source, page_iter):
+    """
+    Filter stage: article information for every article worth scoring.
+    """
+    for page in page_iter:
+        start = time.perf_counter()
+        article_infos = source.filter_page(page)
+        # Only filtering: the page's titles are scored later, in batches
+        source.metrics.observe('sentinews_page_seconds', time.perf_counter() - start, source=source.source_name)
+        yield from article_infos
+
+
+def batched(items, size):
+    """
+    Group items into lists of 'size' (the last one may be shorter).
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def scored(batch_iter, analyzers, cache=None, metrics=None):
+    """
+    Score stage: (article_info, scores) for every article, scoring a batch of
+    titles at a time with analyze_titles().
+    :param metrics: where the analyzer timings go, e.g. the source's. Defaults to default_metrics.
+    :type metrics: sentinews.metrics.MetricsRegistry
+    """
+    for batch in batch_iter:
+        scores = analyze_titles(analyzers, [info['title'] for info in batch], cache=cache, metrics=metrics)
+        columns = {key: column.tolist() for key, column in scores.items()}
+        for i, article_info in enumerate(batch):
+            yield article_info, {key: column[i] for key, column in columns.items()}
+
+
+class Pipeline:
+
+    def __init__(self, source, batch_size=64, queue_size=4):
+        """
+        :param source: news source to crawl. Its analyzers, score cache, seen url index,
+        metrics and save_type are used. It must not have scoring_processes, since the
+        pipeline scores the titles itself.
+        :type source: sentinews.api_tool.BaseNews
+        :param batch_size: titles scored together
+        :type batch_size: int
+        :param queue_size: items buffered between two stages
+        :type queue_size: int
+        """
+        if source.scoring_stage is not None:
+            raise ValueError(f"{source.source_name} was built with scoring_processes, which a Pipeline does not use. "
+                             f"Build it with scoring_processes=0.")
+        self.source = source
+        # Articles are still in the pipeline after their page is read, so crawl
+        # progress is only saved once everything is stored, by store_results()
+        source.auto_checkpoint = False
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def __iter__(self):
+        """
+        Every scored article as (article_info, scores). Fetching, filtering and
+        scoring each run in their own thread.
+        """
+        source = self.source
+        stage = pages(source, maxsize=self.queue_size)
+        stage = bounded(batched(filtered(source, stage), self.batch_size), self.queue_size, 'pipeline-filter')
+        stage = bounded(scored(stage, source.analyzers, cache=source.score_cache, metrics=source.metrics),
+                        self.queue_size, 'pipeline-score')
+        return iter(stage)
+
+    def run(self):
+        """
+        Run the whole crawl, sending each article to the source's sink as soon as it is scored.
+        :return: number of articles logged
+        :rtype: int
+        """
+        with profiler_for(self.source.source_name) as profiler:
+            profiler.stage('started')
+            for article_info, scores in self:
+                self.source.post_article_to_db(article_info=article_info, scores=scores)
+            profiler.stage('crawled')
+            self.source.store_results()
+            profiler.stage('stored')
+        logging.info(f"{type(self.source).__name__}: logged {self.source.get_articles_logged()} articles")
+        return self.source.get_articles_logged()
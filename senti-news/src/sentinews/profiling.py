@@ -0,0 +1,235 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pathlib
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+"""
+profiling.py
+---
+Opt-in profiling of crawls and analyzers. Set PROFILE_DIR (or pass --profile to the
+benchmark scripts) and every BaseNews.start() or Pipeline.run() writes a directory
+named after the time and the source into it, with:
+    profile.pstats     cProfile of the thread that ran the crawl, for pstats or snakeviz
+    profile.txt        the 50 functions with the most cumulative time
+    stacks.collapsed   wall-clock stack samples of every thread, one 'frame;frame count'
+                       line per stack, for flamegraph.pl or speedscope
+    memory.json        traced and peak memory at each stage boundary, with the lines
+                       that allocated the most
+    NN-<stage>.tracemalloc  tracemalloc snapshot at each boundary, for Snapshot.load()
+Only one profile runs at a time: a crawl started while another is being profiled,
+e.g. one window of backfill(), is not profiled on its own.
+Profiling slows everything down, tracemalloc most of all, so compare profiles with
+each other rather than with unprofiled timings.
+"""
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+# Frames kept for each traced allocation
+TRACEMALLOC_FRAMES = 16
+# Allocation sites listed per stage in memory.json
+TOP_ALLOCATIONS = 10
+
+_active = None
+_active_lock = threading.Lock()
+
+
+class _StackSampler:
+    """
+    Records the stack of every other thread every 'interval' seconds.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                # Pool threads share a root, e.g. ThreadPoolExecutor-0_3 -> ThreadPoolExecutor-N_N
+                thread_name = re.sub(r'\d+', 'N', names.get(ident, 'thread'))
+                self.counts[';'.join([thread_name] + stack[::-1])] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+
+class Profiler:
+
+    def __init__(self, name, directory, interval=SAMPLE_INTERVAL):
+        """
+        :param name: what is profiled, e.g. the source's name. Used in the directory name.
+        :type name: str
+        :param directory: the profile goes in a new timestamped directory in here
+        :type directory: str or Path
+        :param interval: seconds between stack samples
+        :type interval: float
+        """
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        self.path = pathlib.Path(directory) / f'{stamp}-{re.sub(r"[^A-Za-z0-9_.-]+", "-", name)}-{os.getpid()}'
+        self.profile = cProfile.Profile()
+        self.sampler = _StackSampler(interval)
+        self.stages = []
+        self.started = None
+        self.thread = None
+        # Seconds spent taking snapshots, left out of the stage times
+        self.overhead = 0.0
+        self.stop_tracemalloc = False
+
+    def start(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.stop_tracemalloc = True
+        self.started = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.sampler.start()
+        self.profile.enable()
+        return self
+
+    def stage(self, name):
+        """
+        Record memory use at the end of a stage, e.g. 'crawled', and save a tracemalloc snapshot.
+        The peak is reset, so each stage's peak only covers that stage.
+        :type name: str
+        """
+        # Going through the snapshot is slow, and is not part of what is being profiled.
+        # cProfile only follows the thread that started it.
+        profiling = threading.get_ident() == self.thread
+        if profiling:
+            self.profile.disable()
+        stage_start = time.perf_counter()
+        seconds = stage_start - self.started - self.overhead
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        file_name = f'{len(self.stages):02d}-{re.sub(r"[^A-Za-z0-9_.-]+", "-", name)}.tracemalloc'
+        snapshot.dump(str(self.path / file_name))
+        top = [statistic for statistic in snapshot.statistics('lineno')[:TOP_ALLOCATIONS + 1]
+               if statistic.traceback[0].filename != tracemalloc.__file__][:TOP_ALLOCATIONS]
+        self.stages.append({'stage': name,
+                            'seconds': seconds,
+                            'current_bytes': current,
+                            'peak_bytes': peak,
+                            'snapshot': file_name,
+                            'top_allocations': [str(statistic) for statistic in top]})
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.overhead += time.perf_counter() - stage_start
+        if profiling:
+            self.profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write every file.
+        :return: the profile's directory
+        :rtype: Path
+        """
+        self.profile.disable()
+        self.sampler.stop()
+        if self.stop_tracemalloc:
+            tracemalloc.stop()
+
+        self.profile.dump_stats(str(self.path / 'profile.pstats'))
+        text = io.StringIO()
+        pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(50)
+        (self.path / 'profile.txt').write_text(text.getvalue())
+        (self.path / 'stacks.collapsed').write_text(self.sampler.collapsed())
+        (self.path / 'memory.json').write_text(json.dumps(self.stages, indent=2) + '\n')
+        logging.info(f"Profile written to {self.path}")
+        return self.path
+
+    def __enter__(self):
+        try:
+            return self.start()
+        except Exception:
+            self._release()
+            raise
+
+    def __exit__(self, *exc):
+        try:
+            self.stop()
+        finally:
+            self._release()
+
+    def _release(self):
+        global _active
+        with _active_lock:
+            if _active is self:
+                _active = None
+
+
+class _NullProfiler:
+    """
+    Stands in for a Profiler when profiling is off.
+    """
+
+    path = None
+
+    def stage(self, name):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def profiler_for(name, directory=None):
+    """
+    A Profiler to use as a context manager, or one that does nothing if profiling is
+    off or another profile is already running.
+    :param name: what is profiled, e.g. the source's name
+    :type name: str
+    :param directory: where profiles go. Defaults to PROFILE_DIR; profiling is off without either.
+    :type directory: str or Path
+    :rtype: Profiler
+    """
+    global _active
+    directory = directory or os.environ.get('PROFILE_DIR')
+    if not directory:
+        return NULL_PROFILER
+    with _active_lock:
+        if _active is not None:
+            return NULL_PROFILER
+        _active = Profiler(name, directory)
+        return _active
+
+
+def active_profiler():
+    """
+    The profile that is running, so a stage boundary can be recorded from anywhere
+    (e.g. when an analyzer has been loaded). Does nothing when there is none.
+    :rtype: Profiler
+    """
+    return _active or NULL_PROFILER
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+score_cache.py
+---
+Cache of sentiment scores keyed by the title text, the analyzer and the analyzer's
+model version. The same headline often shows up under several urls and sources,
+so it only needs to be scored once.
+There is an in-process LRU tier and an optional SQLite tier on disk. Each analyzer
+has a 'version' string; for the LSTM and BERT analyzers it is a fingerprint of the
+model files, so replacing a model automatically stops old scores from being used.
+"""
+
+
+def normalize_title(text):
+    """
+    Normalize a title for use in a cache key without changing how it would be scored:
+    unicode NFC form, surrounding whitespace removed and inner whitespace collapsed.
+    Case and punctuation are kept because VADER scores them.
+    :param text: title
+    :type text: str
+    :rtype: str
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def file_fingerprint(path):
+    """
+    Short fingerprint of a model file, or of every file in a model directory,
+    built from names, sizes and modification times.
+    :param path: file or directory
+    :type path: str or Path
+    :return: hex digest, or 'missing' if the path does not exist
+    :rtype: str
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        return 'missing'
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    digest = hashlib.sha1()
+    for file in files:
+        stat = file.stat()
+        digest.update(f'{file.name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:16]
+
+
+class ScoreCache:
+
+    def __init__(self, maxsize=100_000, path=None):
+        """
+        :param maxsize: entries kept in memory
+        :type maxsize: int
+        :param path: SQLite file for the on-disk tier. None keeps scores in memory only.
+        :type path: str or Path
+        """
+        self.maxsize = maxsize
+        self.path = str(path) if path else None
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self._connection = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def connection(self):
+        # Opened on first use so creating a cache costs nothing
+        if self._connection is None and self.path is not None:
+            # Scoring worker processes share the file: WAL lets them read while one writes,
+            # and the timeout makes a writer wait for another instead of failing
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS scores '
+                                     '(key TEXT PRIMARY KEY, analyzer TEXT, version TEXT, scores TEXT)')
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def make_key(analyzer_name, version, text):
+        raw = f'{analyzer_name}\0{version}\0{normalize_title(text)}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        :return: cached scores for 'key', or None
+        :rtype: dict or None
+        """
+        with self.lock:
+            scores = self.memory.get(key)
+            if scores is not None:
+                self.memory.move_to_end(key)
+                return scores
+            if self.connection is None:
+                return None
+            row = self.connection.execute('SELECT scores FROM scores WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        scores = json.loads(row[0])
+        self._remember(key, scores)
+        return scores
+
+    def put_many(self, entries, analyzer_name, version):
+        """
+        :param entries: (key, scores) pairs
+        :type entries: list of tuple
+        """
+        for key, scores in entries:
+            self._remember(key, scores)
+        with self.lock:
+            if self.connection is not None and entries:
+                with self.connection:
+                    self.connection.executemany(
+                        'INSERT OR REPLACE INTO scores (key, analyzer, version, scores) VALUES (?, ?, ?, ?)',
+                        [(key, analyzer_name, version, json.dumps(scores)) for key, scores in entries])
+
+    def _remember(self, key, scores):
+        with self.lock:
+            self.memory[key] = scores
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.maxsize:
+                self.memory.popitem(last=False)
+
+    def evaluate(self, analyzer, text):
+        """
+        analyzer.evaluate(text), answered from the cache when possible.
+        :rtype: dict
+        """
+        return {key: float(column[0]) for key, column in self.evaluate_batch(analyzer, [text]).items()}
+
+    def evaluate_batch(self, analyzer, texts):
+        """
+        analyzer.evaluate_batch(texts), answered from the cache when possible.
+        Only titles that are not cached are sent to the analyzer, each distinct one once.
+        :return: dictionary with one array per score key, in the same order as texts
+        :rtype: dict
+        """
+        if not texts:
+            return {}
+        version = getattr(analyzer, 'version', '')
+        keys = [self.make_key(analyzer.name, version, text) for text in texts]
+        rows = [self.get(key) for key in keys]
+
+        # Titles to score, with duplicates removed
+        missing = {}
+        for key, text, row in zip(keys, texts, rows):
+            if row is None and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - sum(row is None for row in rows)
+        self.misses += sum(row is None for row in rows)
+
+        if missing:
+            fresh = analyzer.evaluate_batch(list(missing.values()))
+            fresh_rows = [{name: float(column[i]) for name, column in fresh.items()}
+                          for i in range(len(missing))]
+            scored = dict(zip(missing, fresh_rows))
+            self.put_many(list(scored.items()), analyzer.name, version)
+            rows = [row if row is not None else scored[key] for key, row in zip(keys, rows)]
+
+        return {name: np.array([row[name] for row in rows], dtype=np.float64) for name in rows[0]}
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.connection is not None:
+                with self.connection:
+                    self.connection.execute('DELETE FROM scores')
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def cache_from_env():
+    """
+    ScoreCache configured by SCORE_CACHE_SIZE (entries in memory, default 100000)
+    and SCORE_CACHE_DB (SQLite file for the on-disk tier, off by default).
+    """
+    path = os.environ.get('SCORE_CACHE_DB')
+    if path:
+        logging.info(f"Caching sentiment scores in {path}")
+    return ScoreCache(maxsize=int(os.environ.get('SCORE_CACHE_SIZE', 100_000)), path=path)
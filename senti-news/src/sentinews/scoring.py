@@ -0,0 +1,129 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from sentinews.metrics import MetricsRegistry, default_metrics
+from sentinews.models import AnalyzerRegistry, analyze_titles
+from sentinews.score_cache import cache_from_env
+
+"""
+scoring.py
+---
+Scores titles in worker processes so that fetching and scoring run side by side.
+The fetching side hands each page of parsed articles to ScoringStage.submit(), which
+only blocks when too many pages are already waiting. Each worker process builds and
+warms up its own analyzers once. A single sink thread takes the finished pages in
+the order they were submitted and passes every article and its scores on.
+Each page's analyzer timings come back with its scores and are added to the
+parent's metrics, since the workers' own registries are never read.
+"""
+
+# Set in each worker process by _init_worker
+_worker_analyzers = None
+_worker_cache = None
+
+
+def _init_worker(analyzer_names, analyzer_options):
+    global _worker_analyzers, _worker_cache
+    _worker_analyzers = AnalyzerRegistry(analyzer_names, options=analyzer_options).warmup()
+    _worker_cache = cache_from_env()
+
+
+def _score_titles(titles):
+    metrics = MetricsRegistry()
+    scores = analyze_titles(_worker_analyzers, titles, cache=_worker_cache, metrics=metrics)
+    return {key: column.tolist() for key, column in scores.items()}, metrics.export()
+
+
+class ScoringStage:
+
+    def __init__(self, analyzer_names, on_scored, processes=None, max_pending=8, on_failed=None, metrics=None,
+                 analyzer_options=None):
+        """
+        :param analyzer_names: analyzers each worker builds, see models.ANALYZER_CLASSES
+        :type analyzer_names: list of str
+        :param on_scored: called as on_scored(article_info, scores) for every article,
+        in submission order, from the sink thread
+        :type on_scored: callable
+        :param processes: worker processes. Defaults to the number of CPUs.
+        :type processes: int
+        :param max_pending: pages that can be waiting to be scored before submit() blocks
+        :type max_pending: int
+        :param on_failed: called with the articles of a page that could not be scored,
+        or with an article that on_scored raised for
+        :type on_failed: callable
+        :param metrics: where the workers' analyzer timings are added. Defaults to default_metrics.
+        :type metrics: sentinews.metrics.MetricsRegistry
+        :param analyzer_options: name -> keyword arguments each worker builds that analyzer with,
+        e.g. from models.analyzer_specs()
+        :type analyzer_options: dict
+        """
+        self.on_scored = on_scored
+        self.on_failed = on_failed
+        self.metrics = metrics if metrics is not None else default_metrics
+        # spawn rather than fork: workers load torch themselves instead of inheriting
+        # a copy of the parent's threads and locks
+        self.pool = ProcessPoolExecutor(max_workers=processes,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker,
+                                        initargs=(list(analyzer_names), dict(analyzer_options or {})))
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.failed_pages = 0
+        self.sink_thread = threading.Thread(target=self._drain, name='scoring-sink', daemon=True)
+        self.sink_thread.start()
+
+    def submit(self, article_infos):
+        """
+        Queue a page of articles to be scored by their titles.
+        Blocks while max_pending pages are already waiting.
+        :param article_infos: articles from extract_information()
+        :type article_infos: list of dict
+        """
+        if not article_infos:
+            return
+        future = self.pool.submit(_score_titles, [info['title'] for info in article_infos])
+        self.pending.put((article_infos, future))
+
+    def _drain(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                self._hand_on(*item)
+            finally:
+                self.pending.task_done()
+
+    def _hand_on(self, article_infos, future):
+        try:
+            columns, recorded = future.result()
+        except Exception as e:
+            logging.exception(f"Scoring a page of {len(article_infos)} articles failed: {e}")
+            self.failed_pages += 1
+            if self.on_failed is not None:
+                self.on_failed(article_infos)
+            return
+        self.metrics.merge(recorded)
+        for i, article_info in enumerate(article_infos):
+            try:
+                self.on_scored(article_info, {key: column[i] for key, column in columns.items()})
+            except Exception as e:
+                logging.exception(f"Could not store {article_info.get('url')}: {e}")
+                if self.on_failed is not None:
+                    self.on_failed([article_info])
+
+    def wait(self):
+        """
+        Block until every page submitted so far has been scored and handed on.
+        """
+        self.pending.join()
+
+    def close(self):
+        """
+        Wait for every queued page to be scored and handed on, then stop the workers.
+        """
+        self.pending.put(None)
+        self.sink_thread.join()
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+"""
+seen.py
+---
+Persistent index of article urls that have already been stored.
+The urls live in a SQLite file so they survive between runs. A Bloom filter
+held in memory answers most lookups for new urls without touching the database;
+only urls the filter thinks it has seen are confirmed with a query.
+"""
+
+
+class BloomFilter:
+
+    def __init__(self, capacity=1_000_000, error_rate=0.01):
+        """
+        :param capacity: number of items the filter is sized for
+        :type capacity: int
+        :param error_rate: false positive rate at capacity
+        :type error_rate: float
+        """
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: position i is h1 + i * h2
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.n_bits for i in range(self.n_hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class SeenUrlIndex:
+
+    def __init__(self, path=None, capacity=1_000_000, error_rate=0.01):
+        """
+        Open (or create) the index and load its urls into the Bloom filter.
+        :param path: SQLite file. Defaults to the SEEN_URLS_DB environment variable.
+        :type path: str or Path
+        :param capacity: urls the Bloom filter is sized for
+        :type capacity: int
+        :param error_rate: Bloom filter false positive rate at capacity
+        :type error_rate: float
+        """
+        self.path = str(path or os.environ['SEEN_URLS_DB'])
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS seen_urls (url TEXT PRIMARY KEY)')
+        self.connection.commit()
+
+        self.bloom = BloomFilter(capacity=capacity, error_rate=error_rate)
+        count = 0
+        for (url,) in self.connection.execute('SELECT url FROM seen_urls'):
+            self.bloom.add(url)
+            count += 1
+        logging.info(f"Loaded {count} seen urls from {self.path}")
+
+    def __contains__(self, url):
+        if url not in self.bloom:
+            return False
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM seen_urls WHERE url = ?', (url,)).fetchone()
+        return row is not None
+
+    def add_many(self, urls):
+        """
+        Record urls as stored.
+        :param urls: article urls
+        :type urls: iterable of str
+        """
+        urls = [url for url in urls if url]
+        if not urls:
+            return
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR IGNORE INTO seen_urls (url) VALUES (?)',
+                                            [(url,) for url in urls])
+            for url in urls:
+                self.bloom.add(url)
+
+    def add(self, url):
+        self.add_many([url])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
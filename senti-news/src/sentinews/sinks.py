@@ -0,0 +1,342 @@
+import json
+import logging
+import pathlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sentinews.lazy import LazyModule
+from sentinews.metrics import default_metrics
+
+pd = LazyModule('pandas')
+
+"""
+sinks.py
+---
+Destinations for scored articles.
+ColumnarBuffer collects articles for the csv and db save types and builds
+DataFrames once at the end, spilling to disk so long runs stay in bounded memory.
+BulkApiSink buffers records and sends them to the database API as JSON arrays,
+several batches at a time, instead of making one POST per article.
+"""
+
+# Columns that come first in stored results. Score columns follow in the order they appear.
+BASE_COLUMNS = ['url', 'news_co', 'datetime', 'title', 'text']
+
+
+class ColumnarBuffer:
+    """
+    Append-only store of article records, kept as one list per column.
+    Appending a record is O(1), unlike DataFrame.append which copies the whole frame.
+    Once spill_rows records are held in memory they are written to a pickled
+    DataFrame chunk in a temporary directory and the lists start over.
+    """
+
+    def __init__(self, spill_rows=50000, spill_dir=None):
+        """
+        :param spill_rows: records held in memory before they are written to disk.
+        None never spills.
+        :type spill_rows: int or None
+        :param spill_dir: directory for chunk files. Defaults to a temporary directory
+        that is removed by close().
+        :type spill_dir: str or Path
+        """
+        self.spill_rows = spill_rows
+        self.columns = {name: [] for name in BASE_COLUMNS}
+        self.n_rows = 0  # rows in memory
+        self.chunks = []  # paths of spilled chunks
+        self.spilled_rows = 0
+        self._tempdir = None
+        self.spill_dir = pathlib.Path(spill_dir) if spill_dir else None
+
+    def __len__(self):
+        return self.spilled_rows + self.n_rows
+
+    def append(self, record):
+        """
+        :param record: article information and scores
+        :type record: dict
+        """
+        for key, value in record.items():
+            column = self.columns.get(key)
+            if column is None:
+                # New column: earlier rows did not have it
+                column = self.columns[key] = [None] * self.n_rows
+            column.append(value)
+        self.n_rows += 1
+        for column in self.columns.values():
+            if len(column) < self.n_rows:
+                column.append(None)
+
+        if self.spill_rows is not None and self.n_rows >= self.spill_rows:
+            self.spill()
+
+    def _frame(self):
+        return pd.DataFrame(self.columns, columns=list(self.columns))
+
+    def spill(self):
+        """
+        Write the in-memory rows to a chunk file and clear them.
+        """
+        if self.n_rows == 0:
+            return
+        if self.spill_dir is None:
+            self._tempdir = tempfile.TemporaryDirectory(prefix='sentinews-')
+            self.spill_dir = pathlib.Path(self._tempdir.name)
+        path = self.spill_dir / f'chunk-{len(self.chunks):05d}.pkl'
+        self._frame().to_pickle(path)
+        self.chunks.append(path)
+        self.spilled_rows += self.n_rows
+        logging.info(f"Spilled {self.n_rows} rows to {path}")
+
+        self.columns = {name: [] for name in self.columns}
+        self.n_rows = 0
+
+    def iter_frames(self):
+        """
+        Yield the stored rows as DataFrames, one per spilled chunk and one for the rows
+        still in memory. Every frame has the same columns in the same order, so they can
+        be appended to one csv file or sql table.
+        """
+        columns = list(self.columns)
+        for path in self.chunks:
+            yield pd.read_pickle(path).reindex(columns=columns)
+        if self.n_rows:
+            yield self._frame()
+
+    def drain(self):
+        """
+        iter_frames(), then forget the rows so the buffer can be reused. Column names
+        are kept, so later frames line up with the ones already written.
+        """
+        yield from self.iter_frames()
+        self.close()
+        self.columns = {name: [] for name in self.columns}
+        self.n_rows = 0
+
+    def to_frame(self):
+        """
+        All stored rows as a single DataFrame.
+        :rtype: pandas.DataFrame
+        """
+        frames = list(self.iter_frames())
+        if not frames:
+            return pd.DataFrame(columns=list(self.columns))
+        return pd.concat(frames, ignore_index=True)
+
+    def to_arrow(self):
+        """
+        All stored rows as a pyarrow Table. Requires pyarrow.
+        :rtype: pyarrow.Table
+        """
+        import pyarrow as pa
+
+        return pa.concat_tables([pa.Table.from_pandas(frame, preserve_index=False)
+                                 for frame in self.iter_frames()])
+
+    def close(self):
+        """
+        Remove spilled chunks.
+        """
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+            self._tempdir = None
+            self.spill_dir = None
+        else:
+            for path in self.chunks:
+                path.unlink()
+        self.chunks = []
+        self.spilled_rows = 0
+
+
+def _json_default(obj):
+    # datetimes from isoparse() are sent as ISO 8601 strings
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return str(obj)
+
+
+class BulkApiSink:
+
+    def __init__(self, url, session, password, batch_size=100, flush_interval=5.0, max_workers=4,
+                 on_logged=None, on_failed=None, metrics=None):
+        """
+        :param url: database API endpoint that accepts a JSON array of articles
+        :type url: str
+        :param session: session used for the POST requests
+        :type session: requests.Session
+        :param password: sent in the 'password' header, like the per-article POST
+        :type password: str
+        :param batch_size: records per POST. A batch is sent as soon as it is full.
+        :type batch_size: int
+        :param flush_interval: seconds after which a partly filled batch is sent, even if
+        no more records arrive. None only sends full batches and whatever is left at wait().
+        :type flush_interval: float
+        :param max_workers: batches that can be in flight at once
+        :type max_workers: int
+        :param on_logged: called with the list of records stored after each batch
+        :type on_logged: callable
+        :param on_failed: called with the list of records the API did not store after each batch
+        :type on_failed: callable
+        :param metrics: where the time of each POST and the rows stored are recorded. Defaults to default_metrics.
+        :type metrics: sentinews.metrics.MetricsRegistry
+        """
+        self.url = url
+        self.session = session
+        self.password = password
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_logged = on_logged
+        self.on_failed = on_failed
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.logged = 0
+        # (record, reason) for every row the API did not store
+        self.failures = []
+        # Records are added from the fetch threads in async mode and results recorded
+        # from the sending threads, so the buffer and the counts are only touched under it
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = []
+        self.stopped = threading.Event()
+        self.timer = None
+        if flush_interval is not None:
+            self.timer = threading.Thread(target=self._flush_when_due, name='bulk-sink-timer', daemon=True)
+            self.timer.start()
+
+    def add(self, record):
+        """
+        Buffer one article. Sends the buffer as soon as it is full.
+        :param record: article information and scores
+        :type record: dict
+        """
+        with self.lock:
+            self.buffer.append(record)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Send whatever is buffered as one batch without waiting for the response.
+        """
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.buffer:
+                return
+            batch, self.buffer = self.buffer, []
+            self.pending = [future for future in self.pending if not future.done()]
+            self.pending.append(self.executor.submit(self._send, batch))
+
+    def _flush_when_due(self):
+        # Sends a partly filled batch once flush_interval has passed since the last send
+        while True:
+            with self.lock:
+                due = self.last_flush + self.flush_interval - time.monotonic()
+            if due > 0:
+                if self.stopped.wait(due):
+                    return
+            else:
+                self.flush()
+
+    def wait(self):
+        """
+        Send the last batch and wait for every batch to finish.
+        """
+        self.flush()
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """
+        wait(), then stop the sending threads.
+        :return: number of rows the API stored
+        :rtype: int
+        """
+        self.stopped.set()
+        if self.timer is not None:
+            self.timer.join()
+        self.wait()
+        self.executor.shutdown(wait=True)
+        return self.logged
+
+    def _send(self, batch):
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.url,
+                                         data=json.dumps(batch, default=_json_default),
+                                         headers={'password': self.password,
+                                                  'Content-Type': 'application/json'})
+        except Exception as e:
+            logging.info(f"Bulk POST to database API failed: {e}")
+            self._record(batch, [str(e)] * len(batch))
+            return
+        finally:
+            self.metrics.observe('sentinews_sink_seconds', time.perf_counter() - start, sink='api_bulk')
+
+        logging.info(f"Made bulk POST of {len(batch)} articles to database API, "
+                     f"response code: {response.status_code}")
+        self._record(batch, row_errors(response, len(batch)))
+
+    def _record(self, batch, errors):
+        stored = [record for record, error in zip(batch, errors) if error is None]
+        failed = [(record, error) for record, error in zip(batch, errors) if error is not None]
+        for record, error in failed:
+            logging.info(f"Database API did not store {record.get('url')}: {error}")
+        self.metrics.inc('sentinews_sink_rows_total', len(stored), sink='api_bulk', outcome='stored')
+        self.metrics.inc('sentinews_sink_rows_total', len(failed), sink='api_bulk', outcome='failed')
+        with self.lock:
+            self.logged += len(stored)
+            self.failures.extend(failed)
+            if self.on_logged is not None:
+                self.on_logged(stored)
+            if self.on_failed is not None and failed:
+                self.on_failed([record for record, _ in failed])
+
+
+def row_errors(response, n_rows):
+    """
+    Work out which rows of a bulk POST were stored.
+    The database API can report per-row results in either of these forms:
+        a list with one status code (or {'status': code, 'error': ...}) per row
+        {'errors': [{'index': i, 'error': ...}, ...]} listing only the failed rows
+    Without per-row results, every row shares the status of the response.
+    :param response: response to the bulk POST
+    :type response: requests.Response
+    :param n_rows: number of rows that were sent
+    :type n_rows: int
+    :return: None for each stored row, otherwise the reason it failed
+    :rtype: list
+    """
+    ok = response.status_code in (200, 201, 207)
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+
+    if isinstance(body, list) and len(body) == n_rows:
+        errors = []
+        for row in body:
+            status = row.get('status') if isinstance(row, dict) else row
+            if status in (200, 201):
+                errors.append(None)
+            else:
+                errors.append(row.get('error', status) if isinstance(row, dict) else status)
+        return errors
+
+    if ok and isinstance(body, dict) and isinstance(body.get('errors'), list):
+        errors = [None] * n_rows
+        for error in body['errors']:
+            index = error.get('index')
+            if isinstance(index, int) and 0 <= index < n_rows:
+                errors[index] = error.get('error', 'rejected')
+        return errors
+
+    if ok and response.status_code != 207:
+        return [None] * n_rows
+    return [f"response code {response.status_code}"] * n_rows
@@ -0,0 +1,136 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+"""
+state.py
+---
+Crawl progress kept in a local SQLite file, so a crawl that stops part-way through
+can pick up where it left off and a regular crawl only fetches what is new.
+    runs:       one row per crawl of a source: its date range and whether it finished
+    streams:    per run, the last page completed for each candidate / time window
+    watermarks: per source and candidate, the newest article seen by any run
+Progress is only written at checkpoints, after everything scored so far has been
+handed to the sink, so a page is never marked done before its articles are stored.
+"""
+
+DEFAULT_STATE_DB = 'sentinews-state.sqlite'
+
+
+class CrawlState:
+
+    def __init__(self, path=None):
+        """
+        :param path: SQLite file. Defaults to CRAWL_STATE_DB, then to sentinews-state.sqlite.
+        :type path: str or Path
+        """
+        self.path = str(path or os.environ.get('CRAWL_STATE_DB', DEFAULT_STATE_DB))
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT, start_date TEXT, end_date TEXT, num_steps INTEGER,
+                    started TEXT, finished TEXT);
+                CREATE TABLE IF NOT EXISTS streams (
+                    run_id INTEGER, stream_key TEXT, last_page INTEGER, done INTEGER,
+                    PRIMARY KEY (run_id, stream_key));
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    source TEXT, label TEXT, newest TEXT,
+                    PRIMARY KEY (source, label));
+            ''')
+
+    def start_run(self, source, start_date, end_date, num_steps):
+        """
+        Record a new crawl.
+        :return: run id
+        :rtype: int
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (source, start_date, end_date, num_steps, started) VALUES (?, ?, ?, ?, ?)',
+                (source, start_date.isoformat(), end_date.isoformat(), num_steps, datetime.utcnow().isoformat()))
+            return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE runs SET finished = ? WHERE run_id = ?',
+                                    (datetime.utcnow().isoformat(), run_id))
+
+    def unfinished_run(self, source):
+        """
+        The most recent crawl of 'source' that did not finish.
+        :return: see run_for(), or None
+        :rtype: dict or None
+        """
+        return self._find_run('WHERE source = ? AND finished IS NULL ORDER BY run_id DESC LIMIT 1', (source,))
+
+    def run_for(self, source, start_date, end_date):
+        """
+        The most recent crawl of 'source' over exactly this date range.
+        :return: dict with run_id, start_date, end_date, num_steps and finished, or None
+        :rtype: dict or None
+        """
+        return self._find_run('WHERE source = ? AND start_date = ? AND end_date = ? ORDER BY run_id DESC LIMIT 1',
+                              (source, start_date.isoformat(), end_date.isoformat()))
+
+    def _find_run(self, where, params):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT run_id, start_date, end_date, num_steps, finished FROM runs ' + where, params).fetchone()
+        if row is None:
+            return None
+        return {'run_id': row[0],
+                'start_date': datetime.fromisoformat(row[1]),
+                'end_date': datetime.fromisoformat(row[2]),
+                'num_steps': row[3],
+                'finished': row[4] is not None}
+
+    def stream_progress(self, run_id, stream_key):
+        """
+        :return: (last completed page, whether the stream is done). (-1, False) if it was never started.
+        :rtype: tuple
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT last_page, done FROM streams WHERE run_id = ? AND stream_key = ?',
+                                          (run_id, stream_key)).fetchone()
+        return (row[0], bool(row[1])) if row else (-1, False)
+
+    def watermark(self, source, label):
+        """
+        Newest article date seen for a source and candidate, in UTC.
+        :rtype: datetime or None
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT newest FROM watermarks WHERE source = ? AND label = ?',
+                                          (source, label)).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def commit(self, source, run_id, pages, watermarks):
+        """
+        Save a checkpoint in one transaction.
+        :param pages: (stream_key, page, done) for every page completed since the last checkpoint
+        :type pages: list of tuple
+        :param watermarks: label -> newest article datetime seen since the last checkpoint
+        :type watermarks: dict
+        """
+        with self.lock, self.connection:
+            for stream_key, page, done in pages:
+                self.connection.execute(
+                    'INSERT INTO streams (run_id, stream_key, last_page, done) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (run_id, stream_key) DO UPDATE SET '
+                    'last_page = MAX(last_page, excluded.last_page), done = MAX(done, excluded.done)',
+                    (run_id, stream_key, page, int(done)))
+            for label, newest in watermarks.items():
+                self.connection.execute(
+                    'INSERT INTO watermarks (source, label, newest) VALUES (?, ?, ?) '
+                    'ON CONFLICT (source, label) DO UPDATE SET newest = MAX(newest, excluded.newest)',
+                    (source, label, newest.astimezone(timezone.utc).isoformat()))
+        logging.info(f"Checkpoint for {source}: {len(pages)} pages")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
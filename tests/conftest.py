@@ -0,0 +1,10 @@
+"""
+The stand-in server (replay.py) and the synthetic headlines (synthetic.py) are
+benchmark tools that are not part of the installed package, so the tests import
+them from benchmarks/.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
@@ -0,0 +1,1123 @@
+"""
+Tests for the fetching and filtering machinery behind sentinews.api_tool.
+These do not call any of the news APIs.
+"""
+
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+from sentinews.api_tool import CNN, FOX, NYT, BaseNews, backfill, crawl_sources
+from sentinews import decoding
+from sentinews.candidates import CandidateMatcher
+from sentinews.cli import daemon, main
+from sentinews.models import AnalyzerRegistry
+from sentinews.pagination import PageStream, PaginationController
+from sentinews.pipeline import Pipeline, bounded
+from sentinews.profiling import NULL_PROFILER, active_profiler, profiler_for
+from replay import Cassette, StandInServer
+from sentinews.metrics import MetricsRegistry, serve_metrics
+from sentinews.fetch import AsyncFetcher, PooledSession, RateLimiter, retry_delay
+from sentinews.seen import BloomFilter, SeenUrlIndex
+from sentinews.sinks import BulkApiSink, ColumnarBuffer, row_errors
+from sentinews.state import CrawlState
+
+
+class TestAsyncFetcher:
+
+    urls = [f'https://{host}/page/{p}' for host in ['a.example.com', 'b.example.com'] for p in range(6)]
+
+    def test_fetches_every_url_with_bounded_concurrency(self):
+        """
+        Test for:
+        AsyncFetcher.run()
+        Every url should be handed to the callback once, and no more than
+        per_host requests should be open to one host at a time.
+        """
+        lock = threading.Lock()
+        in_flight = {}
+        most_in_flight = {}
+
+        def get(url):
+            host = url.split('/')[2]
+            with lock:
+                in_flight[host] = in_flight.get(host, 0) + 1
+                most_in_flight[host] = max(most_in_flight.get(host, 0), in_flight[host])
+            time.sleep(0.02)
+            with lock:
+                in_flight[host] -= 1
+            return url.upper()
+
+        seen = []
+        completed = AsyncFetcher(get, per_host=2).run(self.urls, lambda url, response: seen.append(url))
+
+        assert completed == len(self.urls)
+        assert sorted(seen) == sorted(self.urls)
+        assert max(most_in_flight.values()) <= 2
+
+    def test_failed_requests_are_skipped(self):
+        def get(url):
+            if url.endswith('/0'):
+                raise requests.ConnectionError('boom')
+            return url
+
+        seen = []
+        completed = AsyncFetcher(get).run(self.urls, lambda url, response: seen.append(response))
+        assert completed == len(self.urls) - 2
+        assert all(not url.endswith('/0') for url in seen)
+
+
+class FakeClock:
+    """
+    Clock for RateLimiter whose sleep() just moves time forward.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeResponse:
+
+    def __init__(self, status_code=200, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.text = json.dumps(body)
+        self.content = self.text.encode('utf-8')
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('No JSON body')
+        return self.body
+
+
+class TestRateLimiter:
+
+    def test_burst_then_sustained_rate(self):
+        """
+        Test for:
+        RateLimiter.acquire()
+        The first 'burst' tokens are free, after that one token every 60/rate seconds.
+        """
+        clock = FakeClock()
+        limiter = RateLimiter(tokens_per_minute=10, burst=3, clock=clock, sleep=clock.sleep)
+
+        waits = [limiter.acquire() for _ in range(5)]
+        assert waits[:3] == [0, 0, 0]
+        assert waits[3] == pytest.approx(6)
+        assert waits[4] == pytest.approx(6)
+
+    def test_pause(self):
+        clock = FakeClock()
+        limiter = RateLimiter(tokens_per_minute=60, burst=5, clock=clock, sleep=clock.sleep)
+        limiter.pause(30)
+        assert limiter.acquire() == pytest.approx(30)
+
+    @pytest.mark.parametrize("headers, low, high", [({'Retry-After': '20'}, 20, 22),
+                                                    ({}, 8, 16)])
+    def test_retry_delay(self, headers, low, high):
+        delay = retry_delay(FakeResponse(429, headers), attempt=3)
+        assert low <= delay <= high
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    client_ports = []
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+        self.client_ports.append(self.client_address[1])
+        body = b'{"result": []}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPooledSession:
+
+    @pytest.fixture
+    def server(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def test_connections_are_reused(self, server):
+        """
+        Test for:
+        PooledSession
+        Sequential requests to one host should share a single keep-alive connection.
+        """
+        KeepAliveHandler.client_ports = []
+        session = PooledSession()
+        url = f'http://127.0.0.1:{server.server_address[1]}/content'
+        for _ in range(5):
+            assert session.get(url).status_code == 200
+
+        assert len(KeepAliveHandler.client_ports) == 5
+        assert len(set(KeepAliveHandler.client_ports)) == 1
+
+    def test_default_timeout(self, server):
+        session = PooledSession(timeout=0.1)
+        with pytest.raises(requests.Timeout):
+            session.get(f'http://127.0.0.1:{server.server_address[1]}/slow')
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in database API that rejects the first row of every batch.
+    """
+    batches = []
+
+    def do_POST(self):
+        batch = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.batches.append(batch)
+        body = json.dumps({'errors': [{'index': 0, 'error': 'duplicate url'}]}).encode()
+        self.send_response(201)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBulkApiSink:
+
+    def test_batches_and_partial_failures(self):
+        """
+        Test for:
+        BulkApiSink.add()
+        BulkApiSink.close()
+        Records should go out in batches of batch_size, and rows the API rejects
+        should not be counted as logged.
+        """
+        BulkHandler.batches = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), BulkHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            logged = []
+            sink = BulkApiSink(f'http://127.0.0.1:{server.server_address[1]}/articles',
+                               session=PooledSession(), password='secret',
+                               batch_size=3, flush_interval=60, on_logged=logged.append)
+            for i in range(7):
+                sink.add({'url': f'example.com/{i}', 'title': 'Trump'})
+            assert sink.close() == 4
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert sorted(len(batch) for batch in BulkHandler.batches) == [1, 3, 3]
+        assert sum(len(records) for records in logged) == 4
+        assert all(record['url'] != 'example.com/0' for records in logged for record in records)
+        assert len(sink.failures) == 3
+
+    def test_partial_batch_sent_after_flush_interval(self):
+        """
+        Test for:
+        BulkApiSink.add()
+        A partly filled batch should be sent once flush_interval has passed, without
+        another record arriving, and records added from several threads should all be sent.
+        """
+        posted = []
+        session = FakeSession({})
+        session.post = lambda url, data, headers: posted.append(json.loads(data)) or FakeResponse(201)
+        sink = BulkApiSink('https://db.example.com/articles', session=session, password='secret',
+                           batch_size=1000, flush_interval=0.05)
+        threads = [threading.Thread(target=lambda t=t: [sink.add({'url': f'example.com/{t}/{i}'}) for i in range(50)])
+                   for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        deadline = time.monotonic() + 5
+        while sum(map(len, posted)) < 200 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sum(map(len, posted)) == 200
+        assert sink.close() == 200
+        assert len({record['url'] for batch in posted for record in batch}) == 200
+
+    @pytest.mark.parametrize("response, errors", [
+        (FakeResponse(201), [None, None]),
+        (FakeResponse(500), ['response code 500'] * 2),
+        (FakeResponse(207, body=[201, {'status': 409, 'error': 'duplicate'}]), [None, 'duplicate']),
+        (FakeResponse(201, body={'errors': [{'index': 1, 'error': 'bad date'}]}), [None, 'bad date']),
+    ])
+    def test_row_errors(self, response, errors):
+        assert row_errors(response, 2) == errors
+
+
+class TestColumnarBuffer:
+
+    @pytest.mark.parametrize("spill_rows", [None, 2])
+    def test_to_frame(self, spill_rows):
+        """
+        Test for:
+        ColumnarBuffer.append()
+        ColumnarBuffer.spill()
+        ColumnarBuffer.to_frame()
+        The frame should hold every record in order, whether or not rows were spilled,
+        with missing values for columns a record did not have.
+        """
+        buffer = ColumnarBuffer(spill_rows=spill_rows)
+        for i in range(5):
+            record = {'url': f'example.com/{i}', 'title': f'title {i}', 'vader_p_pos': i / 10}
+            if i >= 3:
+                record['lstm_p_pos'] = 1.0
+            buffer.append(record)
+
+        assert len(buffer) == 5
+        assert len(buffer.chunks) == (2 if spill_rows else 0)
+
+        frame = buffer.to_frame()
+        assert list(frame.columns[:5]) == ['url', 'news_co', 'datetime', 'title', 'text']
+        assert list(frame['url']) == [f'example.com/{i}' for i in range(5)]
+        assert list(frame['vader_p_pos']) == [0, .1, .2, .3, .4]
+        assert frame['lstm_p_pos'].isna().sum() == 3
+
+        chunks = list(buffer.chunks)
+        buffer.close()
+        assert not any(path.exists() for path in chunks)
+
+
+class TestSeenUrlIndex:
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=100, error_rate=0.01)
+        for i in range(100):
+            bloom.add(f'example.com/{i}')
+        assert all(f'example.com/{i}' in bloom for i in range(100))
+        # Well above the 1% false positive rate would mean the sizing is wrong
+        assert sum(f'other.com/{i}' in bloom for i in range(1000)) < 50
+
+    def test_persists_between_runs(self, tmp_path):
+        """
+        Test for:
+        SeenUrlIndex.add_many()
+        SeenUrlIndex.__contains__()
+        Urls added in one run should be found by a new index on the same file.
+        """
+        path = tmp_path / 'seen.sqlite'
+        index = SeenUrlIndex(path)
+        index.add_many(['example.com/1', 'example.com/2'])
+        index.close()
+
+        index = SeenUrlIndex(path)
+        assert 'example.com/1' in index
+        assert 'example.com/2' in index
+        assert 'example.com/3' not in index
+
+    def test_seen_articles_are_skipped(self, tmp_path):
+        """
+        Test for:
+        BaseNews.already_seen()
+        CNN.extract_information()
+        """
+        index = SeenUrlIndex(tmp_path / 'seen.sqlite')
+        index.add('cnn.com/old')
+        end_date = datetime.now(tz=timezone.utc)
+        cnn = CNN(start_date=end_date - timedelta(days=1), end_date=end_date, num_steps=1, seen_index=index)
+
+        article = {'url': 'cnn.com/old', 'firstPublishDate': 'not parsed',
+                   'headline': 'Trump speaks', 'body': ''}
+        assert cnn.extract_information(article) is None
+
+        article.update(url='cnn.com/new', firstPublishDate=end_date.isoformat())
+        assert cnn.extract_information(article)['url'] == 'cnn.com/new'
+
+    def test_pending_urls_cleared_when_stored_or_failed(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        BaseNews.mark_stored()
+        BaseNews.mark_failed()
+        Urls should only be pending until the sink has them. A row the API rejected
+        should not count as seen, so a later page with it tries again.
+        """
+        monkeypatch.setenv('DB_API_URL', 'https://db.example.com/articles')
+        monkeypatch.setenv('AUTH_PASSWORD', 'test')
+        session = FakeSession({})
+        # Rejects the first row of every batch
+        session.post = lambda url, data, headers: FakeResponse(201, body={'errors': [{'index': 0,
+                                                                                      'error': 'duplicate url'}]})
+        end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        cnn = CNN(start_date=end_date - timedelta(days=1), end_date=end_date, num_steps=1,
+                  analyzers=AnalyzerRegistry('vader'), save_type='api_bulk', session=session,
+                  seen_index=SeenUrlIndex(tmp_path / 'seen.sqlite'))
+        articles = cnn_results(3, end_date)['result']
+        urls = [article['url'] for article in articles]
+
+        cnn.process_page(articles)
+        assert cnn.pending_urls == set(urls)
+        cnn.flush_results()
+        assert cnn.pending_urls == set()
+        assert [cnn.already_seen(url) for url in urls] == [False, True, True]
+        assert cnn.filter_page(articles)[0]['url'] == urls[0]
+        cnn.store_results()
+
+
+class TestCandidateMatcher:
+
+    titles = ['Only trump',
+              'only BuTTigieg',
+              "Trump's rally",
+              'trump and biden',
+              'Trump, trump and more Trump',
+              'A trumpet player in Pyongyang',
+              'a bunch of nonsense not related']
+    candidates = ['trump', 'buttigieg', 'trump', None, 'trump', None, None]
+
+    @pytest.mark.parametrize("title, candidate", list(zip(titles, candidates)))
+    def test_match(self, title, candidate):
+        """
+        Test for:
+        CandidateMatcher.match()
+        BaseNews.improper_title()
+        Names only count as whole words, and a title must name exactly one candidate.
+        """
+        assert BaseNews.title_candidate(title) == candidate
+        assert BaseNews.improper_title(title) == (candidate is None)
+
+    def test_match_many(self):
+        assert BaseNews.improper_titles(self.titles) == [c is None for c in self.candidates]
+        assert CandidateMatcher(['trump', 'biden']).match_many(self.titles) == self.candidates[:1] + [None] + \
+            self.candidates[2:]
+        assert CandidateMatcher(['trump']).match_many([]) == []
+
+    def test_filter_page_checks_titles_once(self, monkeypatch):
+        """
+        Test for:
+        BaseNews.filter_page()
+        The titles of a page should be checked in one call, not one at a time.
+        """
+        end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        cnn = CNN(start_date=end_date - timedelta(days=1), end_date=end_date, num_steps=1)
+        calls = []
+        monkeypatch.setattr(BaseNews, 'improper_title', None)
+        monkeypatch.setattr(BaseNews, 'improper_titles', staticmethod(
+            lambda titles: calls.append(titles) or [title.startswith('A') for title in titles]))
+        page = cnn_results(len(self.titles), end_date)
+        for article, title in zip(page['result'], self.titles):
+            article['headline'] = title
+        article_infos = cnn.filter_page(page['result'])
+        assert calls == [self.titles]
+        assert [info['title'] for info in article_infos] == [title for title in self.titles if title[0] != 'A']
+
+
+class FakeSession:
+    """
+    Answers GET requests from a dict of url -> FakeResponse and records the urls asked for.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    def get(self, url, **kwargs):
+        self.requested.append(url)
+        return self.responses.get(url, FakeResponse(404))
+
+
+def cnn_results(n, newest, step=timedelta(hours=1)):
+    return {'result': [{'url': f'cnn.com/{newest.isoformat()}/{i}',
+                        'firstPublishDate': (newest - i * step).isoformat(),
+                        'headline': 'Trump gives a speech',
+                        'body': ''} for i in range(n)]}
+
+
+class TestPagination:
+
+    start_date = datetime(2020, 1, 10, tzinfo=timezone.utc)
+    stream = PageStream(['page-0', 'page-1'], start_date, 'trump')
+
+    @pytest.mark.parametrize("n_results, n_seen, oldest, reason", [
+        (10, 0, '2020-01-11T00:00:00Z', None),
+        (0, 0, None, 'empty page'),
+        (4, 0, '2020-01-11T00:00:00Z', 'short page'),
+        (10, 10, '2020-01-11T00:00:00Z', 'all results already seen'),
+        (10, 3, '2020-01-09T23:00:00Z', 'older than start date'),
+        (10, 3, '2020-01-09T23:00:00', 'older than start date'),
+    ])
+    def test_stop_reason(self, n_results, n_seen, oldest, reason):
+        controller = PaginationController(page_size=10)
+        assert controller.stop_reason(self.stream, n_results, n_seen, oldest) == reason
+
+    def test_disabled_conditions(self):
+        controller = PaginationController(page_size=10, stop_on_short_page=False, stop_when_all_seen=False,
+                                          stop_before_start_date=False)
+        assert controller.stop_reason(self.stream, 4, 4, '2019-01-01') is None
+
+    @pytest.mark.parametrize("fetch_mode", ['sync', 'async'])
+    def test_cnn_stops_on_short_page(self, fetch_mode):
+        """
+        Test for:
+        BaseNews.fetch_streams()
+        BaseNews.handle_page()
+        A candidate's pages should stop after the first short page.
+        """
+        end_date = datetime.now(tz=timezone.utc)
+        cnn = CNN(start_date=end_date - timedelta(days=30), end_date=end_date, num_steps=1,
+                  analyzers=AnalyzerRegistry('vader'), fetch_mode=fetch_mode)
+        session = FakeSession({
+            cnn.create_api_query('Donald Trump', page=0): FakeResponse(body=cnn_results(100, end_date)),
+            cnn.create_api_query('Donald Trump', page=1): FakeResponse(body=cnn_results(20, end_date - timedelta(days=5))),
+        })
+        cnn.session = session
+        cnn.fetch_streams([PageStream([cnn.create_api_query('Donald Trump', page=p) for p in range(15)],
+                                      cnn.start_date, 'Donald Trump')])
+
+        assert len(session.requested) == 2
+        assert cnn.get_articles_logged() == 120
+        assert cnn.pagination.stopped == {'short page': 1}
+
+
+class NYTSession(FakeSession):
+    """
+    Answers NYT article searches from a dict of day -> number of articles published
+    that day, newest first like the real API.
+    """
+
+    def __init__(self, per_day):
+        super().__init__({})
+        self.per_day = per_day
+
+    def get(self, url, **kwargs):
+        self.requested.append(url)
+        query = parse_qs(urlparse(url).query)
+        begin_date, end_date = (datetime.strptime(query[name][0], '%Y%m%d').date() for name in ('begin_date', 'end_date'))
+        page = int(query['page'][0])
+        results = [{'web_url': f'nytimes.com/{day.isoformat()}/{i}',
+                    'pub_date': (datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+                                 + timedelta(hours=12, minutes=-i)).isoformat(),
+                    'headline': {'main': 'Trump gives a speech'}}
+                   for day in sorted(self.per_day, reverse=True) if begin_date <= day <= end_date
+                   for i in range(self.per_day[day])]
+        docs = results[page * 10:page * 10 + 10]
+        return FakeResponse(body={'response': {'docs': docs, 'meta': {'hits': len(results), 'offset': page * 10}}})
+
+
+class TestNYTWindows:
+
+    def crawl(self, monkeypatch, per_day):
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        monkeypatch.setenv('NYT_API_KEY', 'test')
+        nyt = NYT(start_date=datetime(2020, 1, 1, tzinfo=timezone.utc), end_date=datetime(2020, 1, 5, tzinfo=timezone.utc),
+                  num_steps=1, analyzers=AnalyzerRegistry('vader'), save_type='csv')
+        nyt.RATE_LIMIT, nyt.rate_limiter = None, None
+        nyt.session = NYTSession({date(2020, 1, day): n for day, n in per_day.items()})
+        nyt.crawl(nyt.process_page)
+        urls = nyt.frame.to_frame()['url'].tolist()
+        assert len(urls) == len(set(urls))
+        return nyt, urls
+
+    def test_windows_split_by_hits(self, monkeypatch):
+        """
+        Test for:
+        NYT.crawl()
+        NYT.read_page()
+        NYT.split_window()
+        Windows with more hits than PAGE_LIMIT pages should be split in half, and pages
+        past a window's last hit should not be requested. The page a window is split on
+        is kept, and the half it belongs to carries on from the page after it.
+        """
+        nyt, urls = self.crawl(monkeypatch, {1: 10, 2: 20, 3: 5, 4: 150})
+
+        # 1 request for the whole range, 3 for the first half, 1 for pages 1 on of the second half,
+        # 1 for Jan 3 and pages 2 to 14 of Jan 4
+        assert len(nyt.session.requested) == 19
+        assert len(urls) == 185
+        assert nyt.pagination.stopped == {'split window': 2, 'no more hits': 2, 'short page': 1}
+
+    def test_split_page_in_both_halves(self, monkeypatch):
+        """
+        Test for:
+        NYT.split_window()
+        When the page a window is split on reaches into the older half, the newer half
+        is already complete and the results on that page are not handed on twice.
+        """
+        nyt, urls = self.crawl(monkeypatch, {1: 200, 3: 2, 4: 3})
+
+        # The whole range, then Jan 1 to 2 (split again), then pages 1 to 14 of Jan 1
+        assert len(nyt.session.requested) == 16
+        assert len(urls) == 3 + 2 + 150
+        assert not any('begin_date=20200103' in url for url in nyt.session.requested)
+
+    @pytest.mark.parametrize("num_steps, windows", [
+        (1, [(1, 4)]),
+        (2, [(1, 2), (3, 4)]),
+        (12, [(1, 1), (2, 2), (3, 3), (4, 4)]),
+    ])
+    def test_day_windows(self, num_steps, windows):
+        nyt = NYT(start_date=datetime(2020, 1, 1, 8), end_date=datetime(2020, 1, 5), num_steps=num_steps,
+                  analyzers=AnalyzerRegistry('vader'))
+        assert nyt.day_windows() == [(date(2020, 1, first), date(2020, 1, last)) for first, last in windows]
+
+
+class TestPipeline:
+
+    def test_bounded_applies_back_pressure(self):
+        """
+        Test for:
+        bounded()
+        The producer should never get more than the queue size ahead of the consumer.
+        """
+        produced = []
+
+        def numbers():
+            for i in range(50):
+                produced.append(i)
+                yield i
+
+        lead = []
+        for i in bounded(numbers(), maxsize=3):
+            time.sleep(0.001)
+            lead.append(len(produced) - i)
+        assert max(lead) <= 3 + 2
+
+    def test_bounded_reraises(self):
+        def broken():
+            yield 1
+            raise KeyError('bad page')
+
+        with pytest.raises(KeyError):
+            list(bounded(broken()))
+
+    def test_cnn_pipeline(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        Pipeline.run()
+        Every proper title should be scored and end up in the csv file.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        end_date = datetime.now(tz=timezone.utc)
+        metrics = MetricsRegistry()
+        cnn = CNN(start_date=end_date - timedelta(days=30), end_date=end_date, num_steps=1,
+                  analyzers=AnalyzerRegistry('vader'), metrics=metrics)
+        page = cnn_results(100, end_date)
+        page['result'][0]['headline'] = 'Trump and Biden debate'
+        cnn.session = FakeSession({
+            cnn.create_api_query('Donald Trump', page=0): FakeResponse(body=page),
+            cnn.create_api_query('Donald Trump', page=1): FakeResponse(body=cnn_results(30, end_date - timedelta(days=5))),
+        })
+
+        assert Pipeline(cnn, batch_size=16, queue_size=2).run() == 129
+        frame = pd.read_csv(next(tmp_path.glob('*-sentinews-data.csv')))
+        assert len(frame) == 129
+        assert 'vader_compound' in frame.columns
+        # Recorded in the source's own metrics, like a crawl without the pipeline
+        assert metrics.value('sentinews_analyzer_titles_total', analyzer='vader') == 129
+        assert metrics.value('sentinews_page_seconds', source='CNN') == 2
+
+    def test_scoring_processes_rejected(self):
+        """
+        Test for:
+        Pipeline.__init__()
+        A source that would score in worker processes should not be handed to a
+        Pipeline, which scores the titles itself.
+        """
+        end_date = datetime.now(tz=timezone.utc)
+        cnn = CNN(start_date=end_date - timedelta(days=1), end_date=end_date, num_steps=1,
+                  analyzers=AnalyzerRegistry('vader'), scoring_processes=1)
+        try:
+            with pytest.raises(ValueError):
+                Pipeline(cnn)
+        finally:
+            cnn.scoring_stage.close()
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestCrawlState:
+
+    end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+
+    def cnn(self, state, **kwargs):
+        cnn = CNN(start_date=self.end_date - timedelta(days=30), end_date=self.end_date, num_steps=1,
+                  analyzers=AnalyzerRegistry('vader'), state=state, **kwargs)
+        cnn.CHECKPOINT_PAGES = 1
+        return cnn
+
+    def test_resume_after_interruption(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        BaseNews.checkpoint()
+        BaseNews.prepare_stream()
+        Pages stored before a crash should not be fetched again when the crawl is resumed.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        state = CrawlState(tmp_path / 'state.sqlite')
+        cnn = self.cnn(state)
+        url = lambda page: cnn.create_api_query('Donald Trump', page=page)
+        session = FakeSession({
+            url(0): FakeResponse(body=cnn_results(100, self.end_date)),
+            url(1): FakeResponse(body=cnn_results(100, self.end_date - timedelta(days=5))),
+        })
+
+        def get(requested_url, **kwargs):
+            if requested_url == url(2):
+                raise Interrupted()
+            return FakeSession.get(session, requested_url)
+
+        session.get = get
+        cnn.session = session
+        with pytest.raises(Interrupted):
+            cnn.start()
+        assert len(pd.read_csv(next(tmp_path.glob('*-sentinews-data.csv')))) == 200
+        assert state.unfinished_run('CNN')['run_id'] == cnn.run_id
+
+        # The dates given are replaced by the interrupted crawl's
+        resumed = CNN(start_date=self.end_date, end_date=self.end_date + timedelta(days=1), num_steps=1,
+                      analyzers=AnalyzerRegistry('vader'), state=state, mode='resume')
+        resumed.session = FakeSession({url(2): FakeResponse(body=cnn_results(30, self.end_date - timedelta(days=10)))})
+        resumed.start()
+        assert resumed.run_id == cnn.run_id
+        assert resumed.session.requested == [url(2)]
+        assert resumed.get_articles_logged() == 30
+        assert state.unfinished_run('CNN') is None
+
+    @pytest.mark.parametrize('fetch_mode', ['sync', 'async'])
+    def test_resume_fetches_failed_page(self, tmp_path, monkeypatch, fetch_mode):
+        """
+        Test for:
+        BaseNews.fetch_streams()
+        BaseNews.store_results()
+        A page that failed should not be skipped on resume because a later page of its
+        stream succeeded.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        state = CrawlState(tmp_path / 'state.sqlite')
+        cnn = self.cnn(state, fetch_mode=fetch_mode)
+        url = lambda page: cnn.create_api_query('Donald Trump', page=page)
+        pages = {
+            url(0): FakeResponse(body=cnn_results(100, self.end_date)),
+            url(1): FakeResponse(body=cnn_results(100, self.end_date - timedelta(days=5))),
+            url(2): FakeResponse(body=cnn_results(30, self.end_date - timedelta(days=10))),
+        }
+        session = FakeSession(pages)
+
+        def get(requested_url, **kwargs):
+            if requested_url == url(1):
+                session.requested.append(requested_url)
+                raise requests.ConnectionError('Connection reset')
+            return FakeSession.get(session, requested_url)
+
+        session.get = get
+        cnn.session = session
+        cnn.start()
+        assert session.requested == [url(0), url(1), url(2)]
+        assert state.stream_progress(cnn.run_id, cnn.stream_key(cnn.build_streams()[0])) == (0, False)
+        assert state.unfinished_run('CNN')['run_id'] == cnn.run_id
+
+        resumed = self.cnn(state, mode='resume', fetch_mode=fetch_mode)
+        resumed.session = FakeSession(pages)
+        resumed.start()
+        assert resumed.run_id == cnn.run_id
+        assert resumed.session.requested == [url(1), url(2)]
+        assert state.unfinished_run('CNN') is None
+
+    def test_incremental_stops_at_watermark(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        CrawlState.watermark()
+        An incremental crawl should stop paging once it reaches articles older than the last crawl's newest.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        state = CrawlState(tmp_path / 'state.sqlite')
+        cnn = self.cnn(state)
+        cnn.session = FakeSession({cnn.create_api_query('Donald Trump', page=0):
+                                   FakeResponse(body=cnn_results(20, self.end_date))})
+        cnn.start()
+        assert state.watermark('CNN', 'Donald Trump') == self.end_date
+
+        newer = self.cnn(state, mode='incremental')
+        newer.session = FakeSession({newer.create_api_query('Donald Trump', page=0):
+                                     FakeResponse(body=cnn_results(100, self.end_date + timedelta(hours=2)))})
+        newer.start()
+        assert len(newer.session.requested) == 1
+        assert newer.pagination.stopped == {'older than start date': 1}
+        assert state.watermark('CNN', 'Donald Trump') == self.end_date + timedelta(hours=2)
+
+    def test_fox_keeps_the_requested_dates(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        FOX.build_streams()
+        A crawl in several steps should cover them one after another and record the
+        run under the dates it was asked for, not those of its last step.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        state = CrawlState(tmp_path / 'state.sqlite')
+        start_date = self.end_date - timedelta(days=3)
+        with StandInServer(results_per_query=5, now=self.end_date) as server:
+            fox = FOX(start_date=start_date, end_date=self.end_date, num_steps=3,
+                      analyzers=AnalyzerRegistry('vader'), state=state, session=server.session())
+            streams = fox.build_streams()
+            fox.start()
+
+        assert [(stream.start_date, stream.end_date) for stream in streams] == [
+            (start_date + timedelta(days=i), start_date + timedelta(days=i + 1)) for i in range(3)]
+        assert (fox.start_date, fox.end_date) == (start_date, self.end_date)
+        assert state.run_for('FOX', start_date, self.end_date)['finished']
+
+    def test_backfill_skips_finished_windows(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        backfill()
+        Every window should be crawled once, even when backfill() is called twice.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        monkeypatch.setattr(NYT, 'RATE_LIMIT', None)
+        monkeypatch.setenv('NYT_API_KEY', 'test')
+        state = CrawlState(tmp_path / 'state.sqlite')
+        session = FakeSession({})
+        session.get = lambda url, **kwargs: session.requested.append(url) or \
+            FakeResponse(body={'response': {'docs': []}})
+
+        start_date = self.end_date - timedelta(days=21)
+        registry = AnalyzerRegistry('vader')
+        for _ in range(2):
+            backfill(NYT, start_date, self.end_date, window=timedelta(days=7), workers=3, state=state,
+                     session=session, num_steps=1, analyzers=registry)
+        assert len(session.requested) == 3
+        # Loaded before the windows started, even though none of them had a title to score
+        assert registry.is_loaded('vader')
+        assert all(state.run_for('NYT', start_date + timedelta(days=7 * i),
+                                 start_date + timedelta(days=7 * (i + 1)))['finished'] for i in range(3))
+
+
+class TestReplay:
+
+    end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+
+    def test_provider_shapes(self, monkeypatch):
+        """
+        Test for:
+        StandInServer
+        The sources should parse the server's responses like the real APIs'.
+        """
+        monkeypatch.setenv('NYT_API_KEY', 'test')
+        with StandInServer(results_per_query=25, now=self.end_date) as server:
+            fox = FOX(start_date=self.end_date - timedelta(days=1), end_date=self.end_date, num_steps=1,
+                      session=server.session())
+            docs = fox.parse_results(fox.get(fox.create_api_query('Joe Biden', start=20)))
+            assert len(docs) == 5
+            assert all(fox.title_candidate(doc['title']) == 'biden' and len(doc['url']) == 1 for doc in docs)
+
+            nyt = NYT(start_date=self.end_date - timedelta(days=1), end_date=self.end_date, num_steps=1,
+                      session=server.session())
+            nyt.rate_limiter = None
+            response = nyt.get(nyt.create_api_query('Joe Biden', page=0))
+            assert json.loads(response.text)['response']['meta']['hits'] == 25
+            assert nyt.parse_results(response) == nyt.parse_results(nyt.get(nyt.create_api_query('Joe Biden', page=0)))
+
+    def test_cnn_crawl_into_bulk_sink(self, monkeypatch):
+        """
+        Test for:
+        StandInServer.store()
+        A crawl should get every result despite 429s and store them all with bulk POSTs.
+        """
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        monkeypatch.setenv('DB_API_URL', 'https://db.example.com/articles')
+        monkeypatch.setenv('AUTH_PASSWORD', 'test')
+        with StandInServer(results_per_query=150, throttle_every=2, now=self.end_date) as server:
+            cnn = CNN(start_date=self.end_date - timedelta(days=30), end_date=self.end_date, num_steps=1,
+                      analyzers=AnalyzerRegistry('vader'), save_type='api_bulk', fetch_mode='async',
+                      session=server.session())
+            cnn.start()
+
+        assert cnn.get_articles_logged() == 150
+        assert server.stats['stored'] == 150
+        assert server.stats['throttled'] == 1
+        assert cnn.pagination.stopped == {'short page': 1}
+
+    def test_cassette_replay(self, tmp_path):
+        """
+        Test for:
+        Cassette
+        Recorded responses should be served whatever the order of their query
+        parameters, without their api keys, and nothing else when synthetic is off.
+        """
+        path = tmp_path / 'cassette.jsonl'
+        Cassette(path).record('GET', 'https://api.nytimes.com/svc/search?q=Joe%20Biden&page=0&api-key=secret',
+                              200, 'application/json', '{"response": {"docs": []}}')
+        assert 'secret' not in path.read_text()
+
+        with StandInServer(cassette=Cassette(path), synthetic=False) as server:
+            session = server.session()
+            response = session.get('https://api.nytimes.com/svc/search?page=0&q=Joe%20Biden&api-key=other')
+            assert response.status_code == 200
+            assert response.json() == {'response': {'docs': []}}
+            assert session.get('https://api.nytimes.com/svc/search?page=1&q=Joe%20Biden').status_code == 404
+        assert server.stats['replayed'] == 1
+
+
+class TestMetrics:
+
+    def test_prometheus_text(self):
+        """
+        Test for:
+        MetricsRegistry.to_prometheus()
+        Counters should be written with their labels and histograms with cumulative buckets.
+        """
+        metrics = MetricsRegistry(buckets=(0.1, 1.0))
+        metrics.inc('sentinews_http_responses_total', source='CNN', code=200)
+        metrics.inc('sentinews_http_responses_total', 2, source='CNN', code=200)
+        for seconds in [0.05, 0.5, 5.0]:
+            metrics.observe('sentinews_http_request_seconds', seconds, source='Say "hi"')
+
+        lines = metrics.to_prometheus().splitlines()
+        assert '# TYPE sentinews_http_responses_total counter' in lines
+        assert 'sentinews_http_responses_total{code="200",source="CNN"} 3' in lines
+        assert lines[lines.index('# TYPE sentinews_http_request_seconds histogram') + 1:][:5] == [
+            'sentinews_http_request_seconds_bucket{source="Say \\"hi\\"",le="0.1"} 1',
+            'sentinews_http_request_seconds_bucket{source="Say \\"hi\\"",le="1.0"} 2',
+            'sentinews_http_request_seconds_bucket{source="Say \\"hi\\"",le="+Inf"} 3',
+            'sentinews_http_request_seconds_sum{source="Say \\"hi\\""} 5.55',
+            'sentinews_http_request_seconds_count{source="Say \\"hi\\""} 3',
+        ]
+        assert metrics.summary()['sentinews_http_request_seconds'][0]['max'] == 5.0
+
+    def test_crawl_metrics(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        BaseNews.get()
+        BaseNews.filter_page()
+        BaseNews.report_metrics()
+        Every stage of a crawl should be counted, and the summary written at the end.
+        """
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        monkeypatch.setenv('DB_API_URL', 'https://db.example.com/articles')
+        monkeypatch.setenv('AUTH_PASSWORD', 'test')
+        monkeypatch.setenv('METRICS_SUMMARY', str(tmp_path / 'summary.json'))
+        end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        metrics = MetricsRegistry()
+        with StandInServer(results_per_query=150, now=end_date) as server:
+            cnn = CNN(start_date=end_date - timedelta(days=30), end_date=end_date, num_steps=1,
+                      analyzers=AnalyzerRegistry('vader'), save_type='api_bulk', session=server.session(),
+                      metrics=metrics)
+            cnn.improper_titles = lambda titles: [title.startswith('A') for title in titles]
+            cnn.start()
+
+        assert metrics.value('sentinews_http_request_seconds', source='CNN') == 2
+        assert metrics.value('sentinews_http_responses_total', source='CNN', code=200) == 2
+        kept = metrics.value('sentinews_articles_total', source='CNN', outcome='kept')
+        assert kept + metrics.value('sentinews_articles_total', source='CNN', outcome='improper_title') == 150
+        assert metrics.value('sentinews_sink_rows_total', sink='api_bulk', outcome='stored') == kept
+        assert metrics.value('sentinews_analyzer_titles_total', analyzer='vader') == kept
+
+        summary = json.loads((tmp_path / 'summary.json').read_text())
+        assert summary['source'] == 'CNN' and summary['articles_logged'] == kept
+        assert summary['metrics']['sentinews_analyzer_seconds'][0]['labels'] == {'analyzer': 'vader'}
+
+        server = serve_metrics(0, metrics)
+        try:
+            text = requests.get(f'http://127.0.0.1:{server.server_address[1]}/metrics').text
+        finally:
+            server.shutdown()
+        assert f'sentinews_articles_total{{outcome="kept",source="CNN"}} {kept}' in text
+
+
+class TestProfiling:
+
+    def test_profiled_start(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        BaseNews.start()
+        Profiler
+        With PROFILE_DIR set, a run should write its profile in every format, and only
+        one profile should run at a time.
+        """
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        monkeypatch.setenv('PROFILE_DIR', str(tmp_path / 'profiles'))
+        end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        with StandInServer(results_per_query=150, now=end_date) as server:
+            cnn = CNN(start_date=end_date - timedelta(days=30), end_date=end_date, num_steps=1,
+                      analyzers=AnalyzerRegistry('vader'), session=server.session())
+            with profiler_for('outer', tmp_path / 'outer'):
+                assert profiler_for('inner') is NULL_PROFILER
+            assert active_profiler() is NULL_PROFILER
+            cnn.start()
+
+        assert (tmp_path / 'outer').exists()
+        profile, = (tmp_path / 'profiles').iterdir()
+        assert profile.name.endswith(f'-CNN-{os.getpid()}')
+        stages = json.loads((profile / 'memory.json').read_text())
+        assert [stage['stage'] for stage in stages] == ['started', 'loaded vader', 'crawled', 'stored']
+        assert all(stage['peak_bytes'] >= stage['current_bytes'] for stage in stages)
+        tracemalloc.Snapshot.load(str(profile / stages[-1]['snapshot']))
+        assert pstats.Stats(str(profile / 'profile.pstats')).total_calls > 0
+        assert 'process_page' in (profile / 'profile.txt').read_text()
+        for line in (profile / 'stacks.collapsed').read_text().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            assert ';' in stack and int(count) > 0
+        assert not tracemalloc.is_tracing()
+
+
+class TestCLI:
+
+    def test_sources_run_concurrently(self):
+        """
+        Test for:
+        crawl_sources()
+        Sources should run at the same time, and one failing should not stop the others.
+        """
+        barrier = threading.Barrier(2, timeout=5)
+
+        class Waiting:
+            def __init__(self, start_date, end_date, **kwargs):
+                self.source_name = type(self).__name__
+
+            def start(self):
+                # Only passes if the other source is running too
+                barrier.wait()
+
+            def get_articles_logged(self):
+                return 3
+
+        class First(Waiting):
+            pass
+
+        class Second(Waiting):
+            pass
+
+        class Broken(Waiting):
+            def start(self):
+                raise RuntimeError('API is down')
+
+        end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        results = crawl_sources([First, Broken, Second], end_date - timedelta(days=1), end_date,
+                                analyzers=AnalyzerRegistry('vader'))
+        assert results['First'] == results['Second'] == 3
+        assert isinstance(results['Broken'], RuntimeError)
+
+    def test_main(self, monkeypatch, capsys, tmp_path):
+        """
+        Test for:
+        main()
+        The command should crawl every source it is given, store what they found and
+        write one metrics summary covering all of them.
+        """
+        monkeypatch.setenv('METRICS_SUMMARY', str(tmp_path / 'summary.json'))
+        monkeypatch.setattr('sentinews.api_tool.CANDIDATES', ['Donald Trump'])
+        monkeypatch.setattr(NYT, 'RATE_LIMIT', None)
+        monkeypatch.setenv('NYT_API_KEY', 'test')
+        monkeypatch.setenv('DB_API_URL', 'https://db.example.com/articles')
+        monkeypatch.setenv('AUTH_PASSWORD', 'test')
+        with StandInServer(results_per_query=20) as server:
+            monkeypatch.setattr('sentinews.api_tool.get_session', server.session)
+            assert main(['cnn', 'NYT', '--days', '2', '--num-steps', '1', '--analyzers', 'vader',
+                         '--save-type', 'api_bulk']) == 0
+
+        lines = sorted(capsys.readouterr().out.splitlines())
+        assert lines == ['CNN: 20 articles', 'NYT: 20 articles']
+        assert server.stats['stored'] == 40
+        summary = json.loads((tmp_path / 'summary.json').read_text())
+        assert summary['sources'] == {'CNN': 20, 'NYT': 20}
+        sources = {entry['labels']['source'] for entry in summary['metrics']['sentinews_http_request_seconds']}
+        assert {'CNN', 'NYT'} <= sources
+
+    @pytest.mark.parametrize("argv", [['bbc'], ['--start', '2020-02-01', '--end', '2020-01-01'],
+                                      ['--daemon', '--start', '2020-01-01'], ['--analyzers', 'nope']])
+    def test_bad_arguments(self, argv):
+        with pytest.raises(SystemExit):
+            main(argv)
+
+    def test_daemon(self):
+        """
+        Test for:
+        daemon()
+        Runs should start every interval, and one failing should not stop the next.
+        """
+        now = [0.0]
+        sleeps = []
+        calls = []
+
+        def run():
+            calls.append(now[0])
+            now[0] += 10
+            if len(calls) == 2:
+                raise RuntimeError('API is down')
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        daemon(run, interval=60, rounds=3, clock=lambda: now[0], sleep=sleep)
+        assert calls == [0, 60, 120]
+        assert sleeps == [50, 50]
+
+
+class TestDecoding:
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_jsonp(self, monkeypatch, use_orjson):
+        """
+        Test for:
+        jsonp_payload()
+        loads()
+        The JSON inside a JSONP wrapper should be parsed from a view of the response bytes.
+        """
+        if not use_orjson:
+            monkeypatch.setattr(decoding, 'orjson', None)
+        elif decoding.orjson is None:
+            pytest.skip('orjson is not installed')
+        data = b'angular.callbacks._0({"response": {"docs": [{"title": "Biden (again)"}]}});\n'
+        payload = decoding.jsonp_payload(data)
+        assert payload.obj is data
+        assert decoding.loads(payload) == {'response': {'docs': [{'title': 'Biden (again)'}]}}
+        assert decoding.loads(decoding.jsonp_payload(b'{"a": [1]}')) == {'a': [1]}
+        with pytest.raises(ValueError):
+            decoding.jsonp_payload(b'callback({"a": 1}')
+
+    def test_sources_keep_only_their_fields(self):
+        """
+        Test for:
+        CNN.parse_results()
+        FOX.parse_results()
+        Fields that extract_information() does not use should be dropped.
+        """
+        end_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        cnn = CNN(start_date=end_date - timedelta(days=1), end_date=end_date, num_steps=1)
+        page = cnn_results(2, end_date)
+        page['result'][0]['thumbnail'] = 'https://cdn.cnn.com/thumbnail.jpg'
+        articles = cnn.parse_results(FakeResponse(body=page))
+        assert [set(article) for article in articles] == [set(CNN.FIELDS)] * 2
+        assert cnn.extract_information(articles[0])['title'] == 'Trump gives a speech'
+
+        fox = FOX(start_date=end_date - timedelta(days=1), end_date=end_date, num_steps=1)
+        response = FakeResponse()
+        response.content = (b'angular.callbacks._0({"response": {"docs": [{"title": "Trump speaks", "url": ["u"], '
+                            b'"date": "2020-01-31T12:00:00Z", "image": {"url": "i"}}]}})')
+        assert fox.parse_results(response) == [{'url': ['u'], 'date': '2020-01-31T12:00:00Z',
+                                                'title': 'Trump speaks'}]
@@ -0,0 +1,53 @@
+"""
+Import-time benchmark for sentinews.
+Guards against heavy backends (torch, fastai, transformers, ...) sneaking back into
+module-level imports. Each check runs in a fresh interpreter so earlier imports
+in the test session do not hide a regression.
+
+IMPORT_TIME_BUDGET (seconds) can be set to tighten or loosen the time limit.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that should only be imported once an analyzer that needs them is built
+HEAVY_MODULES = ['torch', 'fastai', 'transformers', 'textblob', 'nltk', 'vaderSentiment', 'pandas']
+
+IMPORT_TIME_BUDGET = float(os.environ.get('IMPORT_TIME_BUDGET', 3.0))
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def time_import(module):
+    """
+    Import 'module' in a new interpreter.
+    :return: seconds the import took and every module loaded by it
+    :rtype: dict
+    """
+    result = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ['sentinews', 'sentinews.models', 'sentinews.api_tool'])
+def test_no_heavy_imports(module):
+    loaded = time_import(module)['modules']
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    assert heavy == []
+
+
+@pytest.mark.parametrize("module", ['sentinews.models', 'sentinews.api_tool'])
+def test_import_time_budget(module):
+    # Best of three to smooth out a cold disk cache
+    seconds = min(time_import(module)['seconds'] for _ in range(3))
+    assert seconds < IMPORT_TIME_BUDGET
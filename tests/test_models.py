@@ -0,0 +1,673 @@
+"""
+Tests for sentinews.models.
+"""
+
+import json
+import pathlib
+import random
+import subprocess
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from sentinews.candidates import CandidateMatcher
+from sentinews import models
+from sentinews.models import (AnalyzerRegistry, BERTAnalyzer, LSTMAnalyzer, TextBlobAnalyzer, VaderAnalyzer,
+                              analyze_title, analyze_titles, analyzer_specs)
+from sentinews.backends import backend_for, check_agreement, length_buckets, pad_rows
+from sentinews.metrics import MetricsRegistry
+from sentinews.naive_bayes import NaiveBayesTable
+from sentinews.score_cache import ScoreCache, normalize_title
+from synthetic import synthetic_headlines
+from sentinews.scoring import ScoringStage
+
+
+class TestBatchScoring:
+
+    titles = ['Trump signs the bill',
+              'Biden wins a great victory',
+              'Warren campaign suffers a terrible loss']
+
+    @pytest.fixture
+    def vader_analyzer(self):
+        return VaderAnalyzer()
+
+    def test_analyze_titles_matches_analyze_title(self, vader_analyzer):
+        """
+        Test for:
+        analyze_titles()
+        VaderAnalyzer.evaluate_batch()
+        Row i of each column should equal the single-title scores for titles[i].
+        """
+        columns = analyze_titles([vader_analyzer], self.titles)
+
+        for i, title in enumerate(self.titles):
+            single = analyze_title([vader_analyzer], title)
+            assert set(single) == set(columns)
+            for key, value in single.items():
+                assert columns[key][i] == value
+
+    def test_analyze_titles_empty(self, vader_analyzer):
+        assert analyze_titles([vader_analyzer], []) == {}
+
+
+class TestAnalyzerRegistry:
+
+    def test_lazy_loading(self):
+        """
+        Test for:
+        AnalyzerRegistry.get()
+        AnalyzerRegistry.warmup()
+        Analyzers should only be built on first use.
+        """
+        registry = AnalyzerRegistry(names='vader')
+        assert registry.is_loaded('vader') is False
+
+        registry.warmup()
+        assert registry.is_loaded('vader') is True
+        assert [analyzer.name for analyzer in registry] == ['vader']
+
+    def test_loaded_once_across_threads(self, monkeypatch):
+        """
+        Test for:
+        AnalyzerRegistry.get()
+        Threads asking for an analyzer that is not loaded yet should share one load.
+        """
+        built = []
+
+        class SlowAnalyzer:
+            def __init__(self):
+                time.sleep(0.05)
+                built.append(self)
+
+        monkeypatch.setitem(models.ANALYZER_CLASSES, 'slow', SlowAnalyzer)
+        registry = AnalyzerRegistry(names='slow')
+        got = []
+        threads = [threading.Thread(target=lambda: got.append(registry.get('slow'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(built) == 1
+        assert got == built * 4
+
+    def test_active_analyzers_from_env(self, monkeypatch):
+        monkeypatch.setenv('ACTIVE_ANALYZERS', 'vader, bert')
+        assert AnalyzerRegistry().names == ['vader', 'bert']
+
+    def test_unknown_analyzer(self):
+        with pytest.raises(ValueError):
+            AnalyzerRegistry(names=['vader', 'not-an-analyzer'])
+
+
+class CountingAnalyzer:
+    """
+    Wraps an analyzer and remembers every title it was asked to score.
+    """
+
+    def __init__(self, analyzer, version='1'):
+        self.analyzer = analyzer
+        self.name = analyzer.name
+        self.version = version
+        self.scored = []
+
+    def evaluate_batch(self, texts):
+        self.scored.extend(texts)
+        return self.analyzer.evaluate_batch(texts)
+
+
+class TestScoreCache:
+
+    titles = ['Trump signs the bill', 'Biden wins  a great victory', ' Trump signs the bill ']
+
+    def test_normalize_title(self):
+        assert normalize_title(' Biden wins  a\tgreat victory\n') == 'Biden wins a great victory'
+        # Case matters to VADER, so it is kept
+        assert normalize_title('GREAT') != normalize_title('great')
+
+    def test_cached_scores_match(self):
+        """
+        Test for:
+        ScoreCache.evaluate_batch()
+        analyze_titles(cache=...)
+        Cached scores should equal fresh ones, and each distinct title should only
+        be scored once.
+        """
+        analyzer = CountingAnalyzer(VaderAnalyzer())
+        cache = ScoreCache()
+
+        first = analyze_titles([analyzer], self.titles, cache=cache)
+        second = analyze_titles([analyzer], self.titles, cache=cache)
+        fresh = analyze_titles([analyzer.analyzer], self.titles)
+
+        assert analyzer.scored == ['Trump signs the bill', 'Biden wins  a great victory']
+        for key in fresh:
+            assert list(first[key]) == list(fresh[key])
+            assert list(second[key]) == list(fresh[key])
+        assert analyze_title([analyzer], self.titles[1], cache=cache) == analyze_title([analyzer.analyzer],
+                                                                                      self.titles[1])
+
+    def test_disk_tier_and_version(self, tmp_path):
+        path = tmp_path / 'scores.sqlite'
+        analyzer = CountingAnalyzer(VaderAnalyzer())
+        analyze_titles([analyzer], self.titles, cache=ScoreCache(path=path))
+
+        # A new process reads the scores back from disk
+        analyzer.scored = []
+        analyze_titles([analyzer], self.titles, cache=ScoreCache(path=path))
+        assert analyzer.scored == []
+
+        # A new model version means the old scores are not used
+        analyzer.version = '2'
+        analyze_titles([analyzer], self.titles, cache=ScoreCache(path=path))
+        assert len(analyzer.scored) == 2
+
+    def test_lru_eviction(self):
+        cache = ScoreCache(maxsize=1)
+        analyzer = CountingAnalyzer(VaderAnalyzer())
+        cache.evaluate_batch(analyzer, ['first'])
+        cache.evaluate_batch(analyzer, ['second'])
+        cache.evaluate_batch(analyzer, ['first'])
+        assert analyzer.scored == ['first', 'second', 'first']
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    nltk = pytest.importorskip('nltk')
+    rng = random.Random(0)
+    words = [f'word{i}' for i in range(300)]
+    documents = []
+    for label in ('neg', 'pos'):
+        for _ in range(rng.randint(40, 60)):
+            documents.append((dict((word, True) for word in rng.sample(words, 40)), label))
+    return nltk.classify.NaiveBayesClassifier.train(documents)
+
+
+class TestNaiveBayesTable:
+    """
+    The movie_reviews corpus is not needed: a classifier trained the way
+    NaiveBayesAnalyzer trains one, on random documents, is enough to check the table.
+    """
+
+    def titles(self):
+        rng = random.Random(1)
+        titles = [[f'word{rng.randrange(320)}' for _ in range(rng.randint(0, 12))] for _ in range(200)]
+        return titles + [[], ['unknown'], ['word1', 'word1', 'word2', 'word1']]
+
+    def test_same_as_nltk(self, classifier):
+        """
+        Test for:
+        NaiveBayesTable.probabilities()
+        Every probability should be exactly the one NLTK gives, including titles with
+        repeated words, unknown words or no words at all.
+        """
+        table = NaiveBayesTable.from_classifier(classifier)
+        titles = self.titles()
+        probabilities = table.probabilities(titles)
+        for tokens, row in zip(titles, probabilities.tolist()):
+            expected = classifier.prob_classify(dict((word, True) for word in tokens))
+            assert row == [expected.prob(label) for label in table.labels]
+
+    def test_analyzer_gives_floats(self, classifier, monkeypatch):
+        """
+        Test for:
+        TextBlobAnalyzer.evaluate()
+        The single-title scores should be Python floats equal to the batched ones.
+        """
+        # The punkt tokenizer is not needed for words like these
+        monkeypatch.setattr(models, 'title_tokens', str.split)
+        analyzer = TextBlobAnalyzer.__new__(TextBlobAnalyzer)
+        analyzer.table = NaiveBayesTable.from_classifier(classifier)
+        single = analyzer.evaluate('word1 word2 word3')
+        batch = analyzer.evaluate_batch(['word1 word2 word3'])
+        assert all(type(value) is float for value in single.values())
+        assert single == {key: column.tolist()[0] for key, column in batch.items()}
+
+    def test_save_and_load(self, classifier, tmp_path):
+        """
+        Test for:
+        NaiveBayesTable.save()
+        NaiveBayesTable.load()
+        A loaded table should be memory-mapped and give the same scores.
+        """
+        table = NaiveBayesTable.from_classifier(classifier)
+        table.save(tmp_path / 'table')
+        loaded = NaiveBayesTable.load(tmp_path / 'table')
+        assert isinstance(loaded.logprobs, np.memmap)
+        assert loaded.labels == table.labels
+        titles = self.titles()
+        assert np.array_equal(loaded.probabilities(titles), table.probabilities(titles))
+
+    def test_trains_when_it_cannot_save(self, classifier, tmp_path, monkeypatch):
+        """
+        Test for:
+        NaiveBayesTable.load_or_train()
+        A table that cannot be saved, e.g. in a read-only install, should still be
+        trained and returned instead of raising.
+        """
+        table = NaiveBayesTable.from_classifier(classifier)
+        monkeypatch.setattr(NaiveBayesTable, 'train', classmethod(lambda cls: table))
+        # A file where the table's parent directory should be, so making it fails
+        blocker = tmp_path / 'blocker'
+        blocker.write_text('')
+        assert NaiveBayesTable.load_or_train(blocker / 'textblob_nb') is table
+        assert list(tmp_path.iterdir()) == [blocker]
+
+    def test_default_dir_is_user_cache(self, classifier, tmp_path, monkeypatch):
+        """
+        Test for:
+        NaiveBayesTable.load_or_train()
+        Without TEXTBLOB_NB_DIR the table should be saved in the user's cache directory.
+        """
+        table = NaiveBayesTable.from_classifier(classifier)
+        monkeypatch.setattr(NaiveBayesTable, 'train', classmethod(lambda cls: table))
+        monkeypatch.delenv('TEXTBLOB_NB_DIR', raising=False)
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        NaiveBayesTable.load_or_train()
+        assert (tmp_path / 'sentinews' / 'textblob_nb' / 'meta.json').exists()
+
+
+class FixedAnalyzer:
+    """
+    Gives the same scores to every text, shifted by 'offset'.
+    """
+
+    def __init__(self, offset=0.0):
+        self.name = 'fixed'
+        self.offset = offset
+
+    def evaluate_batch(self, texts):
+        n = len(texts)
+        return {'p_pos': np.full(n, 0.6 + self.offset), 'p_neu': np.full(n, 0.3), 'p_neg': np.full(n, 0.1 - self.offset)}
+
+
+class FakeLearner:
+    """
+    Stands in for a fastai Learner: add_test() replaces the one test set and
+    get_preds() scores whatever is in it, the length of each title as p_pos.
+    """
+
+    def __init__(self):
+        self.data = self
+        self.test_set = []
+
+    def add_test(self, texts):
+        self.test_set = texts
+
+    def get_preds(self, ds_type, ordered):
+        # Long enough for another thread to call add_test() in between
+        time.sleep(0.01)
+        lengths = np.array([len(text) / 1000 for text in self.test_set])
+        probs = np.stack([1 - lengths, np.zeros_like(lengths), lengths], axis=1)
+        return SimpleNamespace(numpy=lambda: probs), None
+
+
+class TestLSTMAnalyzer:
+
+    def test_threads_score_their_own_titles(self, monkeypatch, tmp_path):
+        """
+        Test for:
+        LSTMAnalyzer.evaluate_batch()
+        Two threads scoring different batches at the same time should each get the
+        scores of their own titles, in order.
+        """
+        monkeypatch.setattr(models, 'fastai_text', SimpleNamespace(load_learner=lambda *args: FakeLearner(),
+                                                                    DatasetType=SimpleNamespace(Test='test')))
+        monkeypatch.setattr(models, 'inference_mode', nullcontext)
+        analyzer = LSTMAnalyzer(model_dir=tmp_path, model_name='model.pkl')
+        batches = [['a' * n for n in range(1, 20)], ['b' * n for n in range(100, 150)]]
+        results = [[] for _ in batches]
+
+        def score(i):
+            for _ in range(5):
+                results[i].append(analyzer.evaluate_batch(batches[i])['p_pos'].tolist())
+
+        threads = [threading.Thread(target=score, args=(i,)) for i in range(len(batches))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for batch, scores in zip(batches, results):
+            assert scores == [[round(len(text) / 1000, 3) for text in batch]] * 5
+
+
+class FakeTokenizer:
+    """
+    Word-level stand-in for BertTokenizerFast, which like the real one only cuts a
+    sequence down to max_length when truncation=True.
+    """
+    pad_token_id = 0
+
+    def batch_encode_plus(self, texts, add_special_tokens, max_length, truncation=False):
+        sequences = [[101] + [1000 + len(word) for word in text.split()] + [102] for text in texts]
+        if truncation:
+            sequences = [sequence[:max_length - 1] + [102] if len(sequence) > max_length else sequence
+                         for sequence in sequences]
+        return {'input_ids': sequences}
+
+
+class FakeBert:
+    """
+    Stand-in for BertForSequenceClassification with position embeddings for 'positions' tokens.
+    """
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.widths = []
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        self.widths.append(input_ids.shape[1])
+        if input_ids.shape[1] > self.positions:
+            raise IndexError('index out of range in self')
+        return (np.zeros((len(input_ids), 3)),)
+
+
+class TestBERTAnalyzer:
+
+    @pytest.fixture
+    def model(self, monkeypatch):
+        model = FakeBert(BERTAnalyzer.MAX_LENGTH)
+        monkeypatch.setattr(models, 'transformers', SimpleNamespace(
+            BertTokenizerFast=SimpleNamespace(from_pretrained=lambda name: FakeTokenizer()),
+            BertForSequenceClassification=SimpleNamespace(from_pretrained=lambda *args, **kwargs: model)))
+        # float32, like the real model's outputs
+        monkeypatch.setattr(models, 'torch', SimpleNamespace(
+            from_numpy=lambda array: array,
+            softmax=lambda logits, dim: SimpleNamespace(numpy=lambda: np.full(logits.shape, 1 / 3, np.float32))))
+        monkeypatch.setattr(models, 'inference_mode', nullcontext)
+        return model
+
+    def test_long_title_is_truncated(self, model, tmp_path):
+        """
+        Test for:
+        BERTAnalyzer.evaluate_batch()
+        A title longer than MAX_LENGTH word pieces should be cut down to MAX_LENGTH,
+        not passed to the model whole.
+        """
+        analyzer = BERTAnalyzer(model_dir=tmp_path)
+        long_title = 'Trump ' + 'says a lot of things ' * 20
+        analyzer.evaluate_batch(['Biden wins', long_title])
+        assert model.widths == [BERTAnalyzer.MAX_LENGTH]
+
+    def test_options_build_the_same_analyzer(self, model, tmp_path):
+        """
+        Test for:
+        BERTAnalyzer.options()
+        AnalyzerRegistry.get()
+        An analyzer built again from options() should load the same model the same way.
+        """
+        analyzer = BERTAnalyzer(model_dir=tmp_path, backend='eager')
+        names, options = analyzer_specs([analyzer])
+        rebuilt = AnalyzerRegistry(names, options=options).get('bert')
+        assert (rebuilt.model_dir, rebuilt.backend, rebuilt.version) == \
+            (analyzer.model_dir, analyzer.backend, analyzer.version)
+
+    def test_evaluate_matches_batch(self, model, tmp_path):
+        """
+        Test for:
+        BERTAnalyzer.evaluate()
+        BERTAnalyzer.evaluate_batch()
+        Both should give the same rounded Python floats, not float32 leftovers.
+        """
+        analyzer = BERTAnalyzer(model_dir=tmp_path)
+        single = analyzer.evaluate('Biden wins')
+        batch = analyzer.evaluate_batch(['Biden wins'])
+        assert single == {key: column.tolist()[0] for key, column in batch.items()} == \
+            {'p_pos': 0.333, 'p_neu': 0.333, 'p_neg': 0.333}
+        assert all(type(value) is float for value in single.values())
+
+
+class TestBackends:
+
+    def test_backend_for(self, monkeypatch):
+        assert backend_for('bert') == 'eager'
+        monkeypatch.setenv('BERT_BACKEND', 'quantized')
+        assert backend_for('bert') == 'quantized'
+        assert backend_for('bert', 'eager') == 'eager'
+        monkeypatch.setenv('LSTM_BACKEND', 'onnx')
+        with pytest.raises(ValueError):
+            backend_for('lstm')
+
+    def test_check_agreement(self):
+        """
+        Test for:
+        check_agreement()
+        Small differences should pass, and a flipped class should not.
+        """
+        texts = ['Trump signs the bill'] * 4
+        report = check_agreement(FixedAnalyzer(), FixedAnalyzer(0.01), texts)
+        assert report['label_agreement'] == 1.0
+        assert report['max_abs_diff']['p_pos'] == pytest.approx(0.01)
+        with pytest.raises(ValueError):
+            check_agreement(FixedAnalyzer(), FixedAnalyzer(-0.4), texts, max_diff=1.0)
+
+    def test_length_buckets(self):
+        """
+        Test for:
+        length_buckets()
+        pad_rows()
+        Every row should be in exactly one batch, batches should be padded to their own
+        longest row, and results scattered back by row index should be in the original order.
+        """
+        rng = random.Random(0)
+        sequences = [[101] + [rng.randrange(1000, 2000) for _ in range(rng.randint(1, 23))] + [102]
+                     for _ in range(50)]
+        buckets = length_buckets([len(sequence) for sequence in sequences], batch_size=8)
+        assert sorted(np.concatenate(buckets).tolist()) == list(range(50))
+        assert [len(rows) for rows in buckets] == [8] * 6 + [2]
+
+        totals = np.zeros(50, dtype=np.int64)
+        for rows in buckets:
+            input_ids, attention_mask = pad_rows(sequences, rows, pad_id=0)
+            assert input_ids.shape[1] == max(len(sequences[row]) for row in rows)
+            assert attention_mask.sum(axis=1).tolist() == [len(sequences[row]) for row in rows]
+            totals[rows] = input_ids.sum(axis=1)
+        assert totals.tolist() == [sum(sequence) for sequence in sequences]
+
+        input_ids, _ = pad_rows(sequences, buckets[0], pad_id=0, width=25)
+        assert input_ids.shape == (8, 25)
+
+    def test_export_that_cannot_be_saved(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        load_or_trace()
+        When the export cannot be written, the traced model should be returned and no
+        staging file left behind.
+        """
+        from sentinews import backends
+
+        traced = object()
+
+        def save(module, path):
+            with open(path, 'wb') as f:
+                f.write(b'half a model')
+            raise RuntimeError('No space left on device')
+
+        monkeypatch.setattr(backends, 'torch', SimpleNamespace(
+            inference_mode=nullcontext,
+            no_grad=nullcontext,
+            nn=SimpleNamespace(Linear='Linear', LSTM='LSTM'),
+            qint8='qint8',
+            quantization=SimpleNamespace(quantize_dynamic=lambda model, layers, dtype: model),
+            jit=SimpleNamespace(trace=lambda model, inputs, strict: traced, save=save)))
+        model = SimpleNamespace(eval=lambda: model)
+        assert backends.load_or_trace(model, (), tmp_path / 'model.pt') is traced
+        assert list(tmp_path.iterdir()) == []
+
+    def test_staged(self, tmp_path):
+        """
+        Test for:
+        staged()
+        A write that fails should leave the old file as it was and nothing else, and a
+        directory another process moved into place first should be kept.
+        """
+        from sentinews._fs import staged, write_atomic
+
+        write_atomic(tmp_path / 'file', 'old')
+        with pytest.raises(ValueError):
+            with staged(tmp_path / 'file') as staging:
+                staging.write_text('new')
+                raise ValueError
+        assert [path.name for path in tmp_path.iterdir()] == ['file']
+        assert (tmp_path / 'file').read_text() == 'old'
+
+        (tmp_path / 'table').mkdir()
+        (tmp_path / 'table' / 'meta.json').write_text('theirs')
+        with staged(tmp_path / 'table', directory=True) as staging:
+            (staging / 'meta.json').write_text('ours')
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['file', 'table']
+        assert (tmp_path / 'table' / 'meta.json').read_text() == 'theirs'
+
+    def test_quantized_model_agrees(self, tmp_path):
+        """
+        Test for:
+        load_or_trace()
+        A quantized TorchScript export should give nearly the same outputs as the eager model.
+        """
+        torch = pytest.importorskip('torch')
+        from sentinews.backends import load_or_trace
+
+        class Classifier(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.embedding = torch.nn.Embedding(100, 32)
+                self.linear = torch.nn.Linear(32, 3)
+
+            def forward(self, input_ids, attention_mask):
+                hidden = (self.embedding(input_ids) * attention_mask.unsqueeze(-1)).mean(dim=1)
+                return (self.linear(hidden),)
+
+        torch.manual_seed(0)
+        model = Classifier().eval()
+        example = torch.randint(0, 100, (4, 25))
+        mask = torch.ones_like(example)
+        exported = load_or_trace(model, (example, mask), tmp_path / 'model.pt')
+        assert (tmp_path / 'model.pt').exists()
+        with torch.no_grad():
+            expected = torch.softmax(model(example, mask)[0], dim=-1)
+            actual = torch.softmax(exported(example, mask)[0], dim=-1)
+        assert torch.allclose(expected, actual, atol=0.05)
+
+
+class TestScoringStage:
+
+    def test_scores_match_inline_and_keep_order(self):
+        """
+        Test for:
+        ScoringStage.submit()
+        ScoringStage.close()
+        Scores from the worker processes should equal inline scores, and articles
+        should come out in the order their pages were submitted.
+        """
+        pages = [[{'url': f'example.com/{page}/{i}', 'title': title}
+                  for i, title in enumerate(TestBatchScoring.titles)] for page in range(4)]
+        results = []
+        stage = ScoringStage(['vader'], on_scored=lambda info, scores: results.append((info, scores)),
+                             processes=2, max_pending=2)
+        for page in pages:
+            stage.submit(page)
+        stage.close()
+
+        expected = [info for page in pages for info in page]
+        assert [info for info, scores in results] == expected
+        vader = VaderAnalyzer()
+        for info, scores in results:
+            assert scores == analyze_title([vader], info['title'])
+
+    def test_worker_metrics_and_shared_cache(self, tmp_path, monkeypatch):
+        """
+        Test for:
+        ScoringStage
+        MetricsRegistry.merge()
+        Analyzer timings from every worker should reach the parent's metrics, and
+        workers sharing one SQLite score cache should all be able to write to it.
+        """
+        monkeypatch.setenv('SCORE_CACHE_DB', str(tmp_path / 'scores.sqlite'))
+        metrics = MetricsRegistry()
+        results = []
+        stage = ScoringStage(['vader'], on_scored=lambda info, scores: results.append(info),
+                             processes=2, metrics=metrics)
+        pages = [[{'url': f'example.com/{page}/{i}', 'title': f'Trump speaks {page} {i}'} for i in range(5)]
+                 for page in range(8)]
+        for page in pages:
+            stage.submit(page)
+        stage.close()
+
+        assert len(results) == 40 and stage.failed_pages == 0
+        assert metrics.value('sentinews_analyzer_titles_total', analyzer='vader') == 40
+        assert metrics.value('sentinews_analyzer_seconds', analyzer='vader') == 8
+        assert len(ScoreCache(path=tmp_path / 'scores.sqlite').connection.execute(
+            'SELECT key FROM scores').fetchall()) == 40
+
+
+    def test_workers_build_configured_analyzers(self, monkeypatch):
+        """
+        Test for:
+        analyzer_specs()
+        ScoringStage
+        A worker should build each analyzer with the arguments the caller's was built
+        with, and an analyzer a worker cannot build should be refused up front.
+        """
+        from sentinews import scoring
+
+        class ConfiguredAnalyzer:
+            def __init__(self, backend='eager'):
+                self.name = 'configured'
+                self.backend = backend
+
+            def options(self):
+                return {'backend': self.backend}
+
+        monkeypatch.setitem(models.ANALYZER_CLASSES, 'configured', ConfiguredAnalyzer)
+        monkeypatch.setattr(scoring, '_worker_analyzers', None)
+        monkeypatch.setattr(scoring, '_worker_cache', None)
+        names, options = analyzer_specs([ConfiguredAnalyzer(backend='quantized'), VaderAnalyzer()])
+        assert (names, options) == (['configured', 'vader'], {'configured': {'backend': 'quantized'}})
+        # What each worker process runs first
+        scoring._init_worker(names, options)
+        assert scoring._worker_analyzers.get('configured').backend == 'quantized'
+
+        registry = AnalyzerRegistry('configured', options={'configured': {'backend': 'quantized'}})
+        assert analyzer_specs(registry) == (['configured'], {'configured': {'backend': 'quantized'}})
+        with pytest.raises(ValueError):
+            analyzer_specs([FixedAnalyzer()])
+
+
+class TestBenchmarks:
+
+    def test_synthetic_headlines(self):
+        """
+        Test for:
+        synthetic_headlines()
+        The corpus should be reproducible and every headline should name one candidate.
+        """
+        names = ['Joe Biden', 'Andrew Yang']
+        headlines = synthetic_headlines(100, seed=3, names=names)
+        assert headlines == synthetic_headlines(100, seed=3, names=names)
+        assert headlines != synthetic_headlines(100, seed=4, names=names)
+        matcher = CandidateMatcher(['biden', 'yang'])
+        assert None not in matcher.match_many(headlines)
+
+    def test_bench_analyzers(self, tmp_path):
+        """
+        Test for:
+        benchmarks/bench_analyzers.py
+        A small run should write every measurement as JSON.
+        """
+        script = pathlib.Path(__file__).parent.parent / 'benchmarks' / 'bench_analyzers.py'
+        output = tmp_path / 'results.json'
+        subprocess.run([sys.executable, str(script), '--analyzers', 'vader', '--titles', '40',
+                        '--latency-samples', '10', '--batch-sizes', '1,16', '--output', str(output)], check=True)
+        results = json.loads(output.read_text())['results']
+        assert set(results['vader']) == {'cold_start', 'latency', 'throughput'}
+        assert set(results['vader']['throughput']) == {'1', '16'}
+        assert results['analyze_title']['analyzers'] == ['vader']